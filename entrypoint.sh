@@ -1,4 +1,7 @@
 while true; do
-    timeout 1000s python3 -m modio_repo
+    # syncs every 180s, builds in the background while the next sync runs.
+    # a sync that takes longer than the timeout isn't built, the next one starts.
+    # started again if it exits anyway
+    python3 -m modio_repo loop --interval 180 --cycle-timeout 1000
     sleep 180
-done
\ No newline at end of file
+done
@@ -1,139 +1,172 @@
 from __future__ import annotations
 
-import json
-from collections import Counter
-from datetime import datetime
-from typing import Type
+import argparse
+import asyncio
+import os
+from typing import Awaitable, Callable
 
 from tortoise import Tortoise, run_async
 
-from modio_repo.downloader import main as downloader_main
-from modio_repo.models import Mod, ModFileBase, PcPalletError, QuestPalletError
-from modio_repo.slz_json import reset as reset_slzjson
-from modio_repo.slz_repositoryfile import RepositoryFile
+from modio_repo.identity import identity
+from modio_repo.metrics import METRICS_DB_QUERIES, metrics
+from modio_repo.snapshot import DB_PATH, BuildProcess, snapshot_db
 from modio_repo.utils import log
 
+# the commands import what they need themselves. a build from the database doesn't
+# load modio, aiohttp and the downloader, and stages picked with --profile are
+# known before the profiled modules are imported
 
-async def check_duplicate_pallet_for(
-    file_: ModFileBase, error: Type[PcPalletError | QuestPalletError]
-):
-    pallets = await file_.pallet.all()
-    if len(pallets) > 1:
-        barcodes = Counter([p.barcode for p in pallets])
-        (common,) = barcodes.most_common(1)
-        barcode, count = common
-        if count > 1:
-            (err, _) = await error.update_or_create(
-                file=file_,
-                defaults={"error": f"{file_.url} contains duplicate pallet barcodes: {barcode}"},
-            )
-            await err.save()
 
+async def init_db(db_url: str = f"sqlite://{DB_PATH}"):
+    from modio_repo.migrations import migrate
 
-async def mark_duplicate_pallets(mod: Mod):
-    pc_file = await mod.get_pc_file()
-    if pc_file is not None:
-        await check_duplicate_pallet_for(pc_file, PcPalletError)
-
-    quest_file = await mod.get_quest_file()
-    if quest_file is not None:
-        await check_duplicate_pallet_for(quest_file, QuestPalletError)
+    await Tortoise.init(db_url=db_url, modules={"models": ["modio_repo.models"]})
+    await Tortoise.generate_schemas()
+    if METRICS_DB_QUERIES:
+        metrics.count_queries()
+    await migrate()
 
 
 async def run():
     log("started run")
-    await Tortoise.init(
-        db_url="sqlite://db.sqlite3", modules={"models": ["modio_repo.models"]}
-    )
-    await Tortoise.generate_schemas()
+    identity.clear()
+    await refresh()
+    build_metrics = await BuildProcess(snapshot_db(), metrics.snapshot()).wait()
+    if build_metrics is not None:
+        metrics.merge(build_metrics)
+
+
+# gc, sync and checks, everything that writes to the database
+async def refresh():
+    await gc()
+    await sync()
+    await check()
+
+
+# runs cycles until it's stopped. the build of a cycle reads a snapshot in another
+# process while the next cycle syncs, only one build runs at a time. a cycle that
+# runs into the timeout isn't built, the next one picks up where it stopped
+async def loop(interval: float, cycle_timeout: float):
+    await init_db()
+    build: BuildProcess | None = None
+    try:
+        while True:
+            log("started cycle")
+            identity.clear()
+            metrics.reset()
+            try:
+                await asyncio.wait_for(refresh(), cycle_timeout)
+            except asyncio.TimeoutError:
+                log(f"cycle took longer than {cycle_timeout}s, not building it")
+                metrics.inc("cycle_timeouts")
+                timed_out = True
+            else:
+                timed_out = False
+            if build is not None:
+                await build.wait()
+                build = None
+            if timed_out:
+                metrics.write()
+            else:
+                build = BuildProcess(snapshot_db(), metrics.snapshot())
+            await asyncio.sleep(interval)
+    finally:
+        # the build is a daemon process, it would die with this one
+        if build is not None:
+            await build.wait()
+
+
+async def sync():
+    # loads the mod.io credentials from .env, nothing else needs them
+    from modio_repo.downloader import main as downloader_main
+
     await downloader_main()
 
-    mods = await Mod.filter(malformed_pallet=False)
-
-    # TODO: handle deletion of mods
-    log("checking duplicate, malformed")
-    for mod in mods:
-        await mark_duplicate_pallets(mod)
-        await set_malformed(mod)
-    
-    log("writing repo file")
-
-    reset_slzjson()
-    repofile = RepositoryFile(
-        "./static/repository.json",
-        "mod.io (unofficial)",
-        "Unofficial repository of mod.io mods",
+
+async def check():
+    from modio_repo.checks import check
+
+    await check()
+
+
+async def build():
+    from modio_repo.build import build
+
+    await build()
+
+
+async def gc():
+    from modio_repo.gc import delete_old_pallets
+
+    await delete_old_pallets()
+
+
+COMMANDS: dict[str, tuple[str, Callable[[], Awaitable]]] = {
+    "run": ("pallet gc, mod.io sync, checks and build (the default)", run),
+    "sync": ("update the database from mod.io", sync),
+    "check": ("mark duplicate and malformed pallets", check),
+    "build": ("write the repositories and the site from the database", build),
+    "gc": ("delete unused pallet manifests and cached pallets", gc),
+}
+
+
+async def run_command(name: str):
+    await init_db()
+    await COMMANDS[name][1]()
+    from modio_repo.profiling import write_reports
+
+    metrics.write()
+    write_reports()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m modio_repo")
+    parser.add_argument(
+        "--profile", default=None, help="stages to profile, see MODIO_REPO_PROFILE"
+    )
+    parser.add_argument("--profiler", default=None, help="cprofile, yappi or tracemalloc")
+    commands = parser.add_subparsers(dest="command")
+    for name, (description, _) in COMMANDS.items():
+        commands.add_parser(name, help=description)
+    loop_parser = commands.add_parser(
+        "loop", help="run cycles, building while the next one syncs"
     )
-    sfw_mods = await Mod.filter(malformed_pallet=False, nsfw=False)
-    for mod in sfw_mods:
-        await repofile.add_mod(mod)
-    repofile.save()
-
-    reset_slzjson()
-    nsfw_repofile = RepositoryFile(
-        "./static/nsfw_repository.json",
-        "mod.io nsfw (unofficial)",
-        "Unofficial repository of NSFW mod.io mods",
+    loop_parser.add_argument(
+        "--interval", type=float, default=180, help="seconds between cycles"
     )
-    nsfw_mods = await Mod.filter(malformed_pallet=False, nsfw=True)
-    for mod in nsfw_mods:
-        await nsfw_repofile.add_mod(mod)
-    nsfw_repofile.save()
-
-    faulty_pc = await PcPalletError.all()
-    faulty_quest = await QuestPalletError.all()
-    faulty_mods = {}
-    for pc_err in faulty_pc:
-        file = await pc_err.file
-        mod = await file.mod
-        faulty_mods[mod.id] = {
-            "modname": mod.name,
-            "messages": [pc_err.error],
-            "last_update": mod.mod_updated.isoformat()
-        }
-    for quest_err in faulty_quest:
-        file = await quest_err.file
-        mod = await file.mod
-        if mod.id not in faulty_mods:
-            faulty_mods[mod.id] = {
-                "modname": mod.name,
-                "messages": [quest_err.error],
-                "last_update": mod.mod_updated.isoformat()
-            }
-        else:
-            faulty_mods[mod.id]["messages"].append(quest_err.error)
-    with open("./static/site_meta.json", "w+") as f:
-        json.dump({
-            "updated": datetime.utcnow().isoformat(),
-            "nsfw_count": len(nsfw_mods),
-            "sfw_count": len(sfw_mods),
-            "faulty_count": len(faulty_mods)
-        }, f)
-    with open("./static/errors.json", "w+") as f:
-        json.dump(list(faulty_mods.values()), f)
-
-
-
-async def set_malformed(mod):
-    pc_file = await mod.get_pc_file()
-    if pc_file is not None:
-        count = await pc_file.pallet_error.all().count()
-        if count > 0:
-            mod.malformed_pallet = True  # type: ignore
-            await mod.save()
-
-    quest_file = await mod.get_quest_file()
-    if quest_file is not None:
-        count = await quest_file.pallet_error.all().count()
-        if count > 0:
-            mod.malformed_pallet = True  # type: ignore
-            await mod.save()
-
-
-def main():
-    run_async(run())
+    loop_parser.add_argument(
+        "--cycle-timeout",
+        type=float,
+        default=1000,
+        help="seconds a sync may take, a cycle that takes longer is not built",
+    )
+    # its arguments, --help too, are left to the benchmark's own parser
+    commands.add_parser("bench", help="offline end to end benchmark", add_help=False)
+    args, rest = parser.parse_known_args(argv)
+    if rest and args.command != "bench":
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+
+    if args.profile is not None or args.profiler is not None:
+        from modio_repo.profiling import configure
+
+        # the build process reads them from the environment
+        if args.profile is not None:
+            os.environ["MODIO_REPO_PROFILE"] = args.profile
+        if args.profiler is not None:
+            os.environ["MODIO_REPO_PROFILER"] = args.profiler
+
+        configure(args.profile, args.profiler)
+
+    if args.command == "bench":
+        from modio_repo.bench.runner import main as bench_main
+
+        bench_main(rest)
+        return
+    if args.command == "loop":
+        run_async(loop(args.interval, args.cycle_timeout))
+        return
+    run_async(run_command(args.command or "run"))
 
 
 if __name__ == "__main__":
     main()
-
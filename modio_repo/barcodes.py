@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, Sequence
+
+from modio_repo import pallet_cache, pallet_json
+from modio_repo.metrics import metrics
+from modio_repo.models import (
+    BarcodeChange,
+    BarcodeConflict,
+    BarcodeIndex,
+    Crate,
+    PalletBase,
+    PalletCache,
+    PcModFile,
+    PcPallet,
+    QuestModFile,
+    QuestPallet,
+)
+from modio_repo.utils import log
+
+# sqlite limits the number of variables of a statement
+CHUNK = 500
+
+
+def chunks(items: Sequence[str]) -> Iterable[Sequence[str]]:
+    for start in range(0, len(items), CHUNK):
+        yield items[start : start + CHUNK]
+
+
+# only barcodes marked here are checked again, so the check is proportional
+# to what changed
+async def mark_changed(barcodes: Iterable[str]):
+    await BarcodeChange.bulk_create(
+        [BarcodeChange(barcode=barcode) for barcode in set(barcodes)],
+        ignore_conflicts=True,
+    )
+
+
+# the pallets of one file, and their crates (one list per pallet), replace what the
+# index had for its mod and platform
+async def index_pallets(
+    file: PcModFile | QuestModFile,
+    pallets: Sequence[PalletBase],
+    crates: Sequence[list[dict[str, Any]]],
+):
+    mod_id: int = file.mod_id  # type: ignore
+    platform = pallet_cache.platform_of(file)
+    rows = BarcodeIndex.filter(mod_id=mod_id, platform=platform)
+    await mark_changed(await rows.values_list("barcode", flat=True))  # type: ignore
+    await rows.delete()
+    await Crate.filter(mod_id=mod_id, platform=platform).delete()
+    await index_crates(mod_id, file.id, platform, pallets, crates)
+    await BarcodeIndex.bulk_create(
+        [
+            BarcodeIndex(
+                barcode=p.barcode, mod_id=mod_id, file_id=file.id, platform=platform
+            )
+            for p in pallets
+        ]
+    )
+    await mark_changed(p.barcode for p in pallets)
+
+
+# before the files of these mods are dropped or the mods deleted
+async def forget_mods(mod_ids: Sequence[int]):
+    rows = BarcodeIndex.filter(mod_id__in=mod_ids)
+    await mark_changed(await rows.values_list("barcode", flat=True))  # type: ignore
+    await rows.delete()
+    await Crate.filter(mod_id__in=mod_ids).delete()
+
+
+async def index_crates(
+    mod_id: int,
+    file_id: int,
+    platform: str,
+    pallets: Sequence[PalletBase],
+    crates: Sequence[list[dict[str, Any]]],
+):
+    await Crate.bulk_create(
+        [
+            Crate(
+                barcode=crate["barcode"],
+                title=crate["title"],
+                crate_type=crate["type"],
+                pallet_barcode=pallet.barcode,
+                mod_id=mod_id,
+                file_id=file_id,
+                platform=platform,
+            )
+            for pallet, pallet_crates in zip(pallets, crates)
+            for crate in pallet_crates
+        ]
+    )
+
+
+async def update_conflicts():
+    barcodes: list[str] = await BarcodeChange.all().values_list("barcode", flat=True)  # type: ignore
+    metrics.inc("barcodes_rechecked", len(barcodes))
+    now = datetime.now()
+    for chunk in chunks(barcodes):
+        mods: defaultdict[str, set[int]] = defaultdict(set)
+        for barcode, mod_id in await BarcodeIndex.filter(
+            barcode__in=chunk
+        ).values_list("barcode", "mod_id"):
+            mods[barcode].add(mod_id)  # type: ignore
+        conflicts = {barcode: ids for barcode, ids in mods.items() if len(ids) > 1}
+        await BarcodeConflict.filter(barcode__in=chunk).exclude(
+            barcode__in=list(conflicts)
+        ).delete()
+        for barcode, ids in conflicts.items():
+            conflict = await BarcodeConflict.get_or_none(barcode=barcode)
+            if conflict is None:
+                log(f"barcode {barcode} is used by mods {sorted(ids)}")
+                await BarcodeConflict.create(
+                    barcode=barcode, mod_ids=sorted(ids), found=now
+                )
+            elif conflict.mod_ids != sorted(ids):
+                conflict.mod_ids = sorted(ids)
+                await conflict.save(update_fields=["mod_ids"])
+        await BarcodeChange.filter(barcode__in=chunk).delete()
+    metrics.set("barcode_conflicts", await BarcodeConflict.all().count())
+
+
+# the whole index from the pallet tables, for existing databases
+async def rebuild():
+    await BarcodeIndex.all().delete()
+    for platform, pallet_type in (("pc", PcPallet), ("quest", QuestPallet)):
+        rows = await pallet_type.all().values_list("barcode", "file_id", "file__mod_id")
+        await BarcodeIndex.bulk_create(
+            [
+                BarcodeIndex(
+                    barcode=barcode, mod_id=mod_id, file_id=file_id, platform=platform
+                )
+                for barcode, file_id, mod_id in rows
+            ]
+        )
+    await mark_changed(await BarcodeIndex.all().values_list("barcode", flat=True))  # type: ignore
+    await update_conflicts()
+
+
+def read_crates(fs_path: str) -> list[dict[str, Any]] | None:
+    try:
+        return pallet_json.crates(pallet_json.read(Path(fs_path)))
+    except (OSError, ValueError):
+        return None
+
+
+# the crates of existing pallets and cached pallets, read once from their manifests.
+# pallets whose manifest is gone get their crates when the file is parsed again
+async def rebuild_crates():
+    await Crate.all().delete()
+    manifests: dict[str, list[dict[str, Any]] | None] = {}
+    for platform, pallet_type in (("pc", PcPallet), ("quest", QuestPallet)):
+        rows = await pallet_type.all().values_list(
+            "fs_path", "barcode", "file_id", "file__mod_id"
+        )
+        crates = []
+        for fs_path, barcode, file_id, mod_id in rows:
+            manifests[fs_path] = read_crates(fs_path)
+            crates.extend(
+                Crate(
+                    barcode=crate["barcode"],
+                    title=crate["title"],
+                    crate_type=crate["type"],
+                    pallet_barcode=barcode,
+                    mod_id=mod_id,
+                    file_id=file_id,
+                    platform=platform,
+                )
+                for crate in manifests[fs_path] or []
+            )
+        await Crate.bulk_create(crates)
+    for cached in await PalletCache.all():
+        if cached.fs_path not in manifests:
+            manifests[cached.fs_path] = read_crates(cached.fs_path)
+        if manifests[cached.fs_path]:
+            cached.crates = manifests[cached.fs_path]
+            await cached.save(update_fields=["crates"])
+
+
+# lookups for tooling
+
+
+async def lookup(barcode: str) -> list[BarcodeIndex]:
+    return await BarcodeIndex.filter(barcode=barcode).order_by("mod_id", "platform")
+
+
+async def barcodes_of(mod_id: int) -> list[str]:
+    return await BarcodeIndex.filter(mod_id=mod_id).distinct().values_list(  # type: ignore
+        "barcode", flat=True
+    )
+
+
+async def conflicts() -> list[BarcodeConflict]:
+    return await BarcodeConflict.all().order_by("barcode")
+
+
+# the mods shipping a crate
+async def lookup_crate(barcode: str) -> list[Crate]:
+    return await Crate.filter(barcode=barcode).order_by("mod_id", "platform")
+
+
+async def crates_of(mod_id: int) -> list[Crate]:
+    return await Crate.filter(mod_id=mod_id).order_by("platform", "id")
@@ -0,0 +1,4 @@
+from modio_repo.bench.runner import main
+
+if __name__ == "__main__":
+    main()
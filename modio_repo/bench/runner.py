@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable
+
+from modio_repo.bench import synth
+from modio_repo.bench.server import serve
+from modio_repo.utils import parse_size
+
+HOST = "127.0.0.1"
+
+# stage timers shown in the report, see modio_repo.metrics
+REPORT_STAGES = [
+    "sync",
+    "modio_pagination",
+    "mod_files",
+    "modio_file_list",
+    "modio_head",
+    "pallet_download",
+    "zip_parse",
+    "checks",
+    "repository_build",
+    "repository_save",
+    "repository_variants",
+    "search_index",
+    "changes_feed",
+]
+
+
+def size_arg(size: str) -> int:
+    try:
+        return parse_size(size)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+def bench_request(base: str, path: str, method: str = "GET") -> dict:
+    req = urllib.request.Request(f"{base}{path}", method=method)
+    with urllib.request.urlopen(req, timeout=5) as resp:
+        return json.load(resp)
+
+
+def wait_for_server(base: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            bench_request(base, "/_bench/stats")
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+# the phases run in a fresh process each, so peak rss is per phase
+async def _phase_sync():
+    from modio_repo.__main__ import run_command
+
+    await run_command("run")
+
+
+async def _phase_build():
+    from modio_repo.__main__ import build, init_db
+
+    await init_db()
+    await build()
+
+
+PHASES: dict[str, Callable] = {"sync": _phase_sync, "build": _phase_build}
+
+
+def _run_phase(phase: str, workdir: str, conn):
+    import resource
+
+    os.chdir(workdir)
+    from tortoise import run_async
+
+    from modio_repo.metrics import metrics
+
+    start = time.perf_counter()
+    run_async(PHASES[phase]())
+    wall = time.perf_counter() - start
+    conn.send(
+        {
+            "wall": wall,
+            # kilobytes on linux
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "metrics": metrics.snapshot(),
+        }
+    )
+    conn.close()
+
+
+def run_phase(ctx, phase: str, workdir: Path, base: str) -> dict[str, Any]:
+    bench_request(base, "/_bench/reset", "POST")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_phase, args=(phase, str(workdir), child))
+    proc.start()
+    child.close()
+    result = parent.recv()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError(f"benchmark phase {phase} failed with {proc.exitcode}")
+    result["server"] = bench_request(base, "/_bench/stats")
+    return result
+
+
+def queries_per_mod(result: dict[str, Any]) -> float:
+    m = result["metrics"]
+    mods = m["counters"].get("mods_processed") or m["gauges"].get("repository_mods")
+    return m["gauges"].get("db_queries", 0) / max(mods or 1, 1)
+
+
+def format_report(name: str, result: dict[str, Any]) -> str:
+    m = result["metrics"]
+    server = result["server"]
+    lines = [
+        f"== {name}",
+        f"  wall time        {result['wall']:.2f}s",
+        f"  peak rss         {result['peak_rss'] / 1024**2:.1f}MB",
+        f"  requests         {server['request_count']}",
+        f"  bytes sent       {server['bytes_sent'] / 1024**2:.1f}MB",
+        f"  db queries       {m['gauges'].get('db_queries', 0):.0f}",
+        f"  queries/mod      {queries_per_mod(result):.1f}",
+        f"  downloads        {m['counters'].get('downloads', 0):.0f}",
+        f"  downloads saved  {m['counters'].get('downloads_avoided', 0):.0f}",
+    ]
+    for pool in ("api", "cdn"):
+        if f"http_{pool}_requests" in m["counters"]:
+            lines.append(
+                f"  http {pool:<11} {m['counters'][f'http_{pool}_requests']:.0f} requests,"
+                f" {m['counters'].get(f'http_{pool}_connections_new', 0):.0f} connections,"
+                f" {m['gauges'].get(f'http_{pool}_reuse_rate', 0):.0%} reused"
+            )
+    if m["counters"].get("downloads"):
+        lines.append(
+            f"  verified         {m['counters'].get('downloads_verified', 0):.0f},"
+            f" {m['counters'].get('download_resumes', 0):.0f} resumes,"
+            f" {m['counters'].get('download_size_mismatches', 0):.0f} size and"
+            f" {m['counters'].get('download_checksum_mismatches', 0):.0f} md5 mismatches"
+        )
+    if m["counters"].get("deferred_mods"):
+        lines.append(f"  deferred mods    {m['counters']['deferred_mods']:.0f}")
+    if "mods_per_second" in m["gauges"]:
+        lines.append(f"  mods/s           {m['gauges']['mods_per_second']:.1f}")
+    for stage in REPORT_STAGES:
+        timer = m["timers"].get(stage)
+        if timer is not None:
+            lines.append(
+                f"  {stage:<16} {timer['total']:.3f}s total,"
+                f" {timer['count']} calls, {timer['max']:.3f}s max"
+            )
+    for route, count in sorted(server["requests"].items()):
+        lines.append(f"    {count:>6} {route}")
+    return "\n".join(lines)
+
+
+def file_sizes(path: Path) -> tuple[int, int]:
+    content = path.read_bytes() if path.exists() else b""
+    return len(content), len(gzip.compress(content))
+
+
+# size of the search index against the repositories, and lookup latency of the same
+# algorithm the site runs, for whole words, prefixes and multi word queries
+def search_benchmark(workdir: Path, queries: int, seed: int) -> dict[str, Any]:
+    from modio_repo.search import SearchIndex, tokenize
+
+    static = workdir / "static"
+    sizes = {
+        name: file_sizes(static / name)
+        for name in ("search.json", "repository.json", "nsfw_repository.json")
+    }
+    start = time.perf_counter()
+    index = SearchIndex.load(static / "search.json")
+    load = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    samples = []
+    for mod in index.mods:
+        words = tokenize(f"{mod[1]} {mod[2]}")
+        if words:
+            word = rng.choice(words)
+            samples += [word, word[: max(len(word) // 2, 1)], " ".join(words[:2])]
+    latencies = []
+    results = 0
+    for query in rng.choices(samples or [""], k=queries):
+        start = time.perf_counter()
+        results += len(index.search(query))
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "sizes": sizes,
+        "terms": len(index.terms),
+        "mods": len(index.mods),
+        "load": load,
+        "queries": len(latencies),
+        "mean_results": results / max(len(latencies), 1),
+        "p50": latencies[len(latencies) // 2] if latencies else 0,
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else 0,
+        "max": latencies[-1] if latencies else 0,
+    }
+
+
+def format_search_report(result: dict[str, Any]) -> str:
+    lines = [
+        "== search index",
+        f"  {result['mods']} mods, {result['terms']} terms, loaded in {result['load'] * 1000:.1f}ms",
+    ]
+    for name, (raw, gz) in result["sizes"].items():
+        lines.append(f"  {name:<20} {raw / 1024:>9.1f}KB, {gz / 1024:>8.1f}KB gzipped")
+    lines.append(
+        f"  {result['queries']} queries, {result['mean_results']:.1f} results avg,"
+        f" p50 {result['p50'] * 1e6:.0f}us, p95 {result['p95'] * 1e6:.0f}us,"
+        f" max {result['max'] * 1e6:.0f}us"
+    )
+    return "\n".join(lines)
+
+
+# what each command has to import before it does anything, in a fresh interpreter
+IMPORTS = {
+    "cli": "modio_repo.__main__",
+    "build": "modio_repo.build",
+    "sync": "modio_repo.downloader",
+}
+
+
+def import_times(repeat: int = 3) -> dict[str, float]:
+    times = {}
+    for name, module in IMPORTS.items():
+        code = (
+            "import time; start = time.perf_counter();"
+            f" import {module}; print(time.perf_counter() - start)"
+        )
+        times[name] = min(
+            float(subprocess.check_output([sys.executable, "-c", code], text=True))
+            for _ in range(repeat)
+        )
+    return times
+
+
+def format_import_report(times: dict[str, float]) -> str:
+    lines = ["== import time"]
+    for name, seconds in times.items():
+        lines.append(f"  {name:<16} {seconds * 1000:.0f}ms  {IMPORTS[name]}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m modio_repo.bench",
+        description="Offline end to end benchmark against a local mod.io stand-in",
+    )
+    parser.add_argument("--mods", type=int, default=200)
+    parser.add_argument("--size", type=size_arg, default="256KB", help="archive size")
+    parser.add_argument("--quest-ratio", type=float, default=0.5)
+    parser.add_argument("--nsfw-ratio", type=float, default=0.1)
+    parser.add_argument("--broken-ratio", type=float, default=0.02)
+    parser.add_argument("--crates", type=int, default=4, help="crates per pallet")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument(
+        "--truncate-ratio",
+        type=float,
+        default=0.0,
+        help="fraction of archives whose first download breaks off halfway",
+    )
+    parser.add_argument("--cycles", type=int, default=2, help="full runs on the same db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="ingestion worker processes"
+    )
+    parser.add_argument("--search-queries", type=int, default=2000)
+    parser.add_argument(
+        "--max-queries-per-mod",
+        type=float,
+        default=None,
+        help="fail if a run after the first makes more db queries per mod",
+    )
+    parser.add_argument("--workdir", type=Path, default=None)
+    parser.add_argument("--json", type=Path, default=None, help="write results here")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="modio_repo_bench_"))
+    workdir = workdir.resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    catalog = synth.generate(
+        workdir / "cdn",
+        mods=args.mods,
+        size=args.size,
+        quest_ratio=args.quest_ratio,
+        nsfw_ratio=args.nsfw_ratio,
+        broken_ratio=args.broken_ratio,
+        crates=args.crates,
+        seed=args.seed,
+    )
+    print(
+        f"generated {len(catalog.mods)} mods, {len(catalog.files)} files,"
+        f" {catalog.total_bytes / 1024**2:.1f}MB in {time.perf_counter() - start:.1f}s"
+    )
+
+    ctx = multiprocessing.get_context("spawn")
+    port = free_port()
+    base = f"http://{HOST}:{port}"
+    server = ctx.Process(
+        target=serve,
+        args=(catalog, HOST, port, args.latency, args.truncate_ratio),
+        daemon=True,
+    )
+    server.start()
+    os.environ.update(
+        MODIO_API_URL=base,
+        MODIO_API_KEY="bench",
+        MODIO_API_SECRET="bench",
+        INGEST_WORKERS=str(args.workers),
+        METRICS_DB_QUERIES="1",
+    )
+    results = {}
+    try:
+        wait_for_server(base)
+        for cycle in range(1, args.cycles + 1):
+            name = f"run #{cycle}"
+            results[name] = run_phase(ctx, "sync", workdir, base)
+            print(format_report(name, results[name]))
+            # the first cycle inserts everything, later ones show the steady state
+            if cycle > 1 and args.max_queries_per_mod is not None:
+                per_mod = queries_per_mod(results[name])
+                assert per_mod <= args.max_queries_per_mod, (
+                    f"{name} made {per_mod:.1f} db queries per mod,"
+                    f" more than {args.max_queries_per_mod}"
+                )
+        results["build"] = run_phase(ctx, "build", workdir, base)
+        print(format_report("build", results["build"]))
+        results["search"] = search_benchmark(workdir, args.search_queries, args.seed)
+        print(format_search_report(results["search"]))
+        results["imports"] = import_times()
+        print(format_import_report(results["imports"]))
+    finally:
+        server.terminate()
+        server.join()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
+    return results
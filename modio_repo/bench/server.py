@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import asyncio
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+from modio_repo.bench.synth import Catalog, SynthFile, SynthMod
+
+GAME_ID = 3809
+PLATFORM_NAMES = {"windows": "windows", "android": "android"}
+CHUNK_SIZE = 64 * 1024
+
+
+def image(base: str, name: str) -> dict:
+    return {
+        "filename": f"{name}.png",
+        "original": f"{base}/images/{name}.png",
+        "thumb_50x50": f"{base}/images/crop_50x50/{name}.png",
+        "thumb_100x100": f"{base}/images/crop_100x100/{name}.png",
+        "thumb_320x180": f"{base}/images/crop_320x180/{name}.png",
+    }
+
+
+def user_json(base: str, name: str) -> dict:
+    return {
+        "id": zlib.crc32(name.encode()),
+        "name_id": name.lower(),
+        "username": name,
+        "date_online": 0,
+        "avatar": image(base, name),
+        "timezone": "",
+        "language": "",
+        "profile_url": f"{base}/u/{name.lower()}",
+    }
+
+
+def game_json(base: str) -> dict:
+    return {
+        "id": GAME_ID,
+        "status": 1,
+        "date_added": 0,
+        "date_updated": 0,
+        "date_live": 0,
+        "presentation_option": 0,
+        "submission_option": 1,
+        "curation_option": 0,
+        "community_options": 3,
+        "revenue_options": 0,
+        "api_access_options": 3,
+        "maturity_options": 1,
+        "ugc_name": "mods",
+        "icon": image(base, "icon"),
+        "logo": image(base, "logo"),
+        "header": image(base, "header"),
+        "homepage_url": None,
+        "name": "BONELAB",
+        "name_id": "bonelab",
+        "summary": "",
+        "instructions": None,
+        "instructions_url": None,
+        "profile_url": f"{base}/g/bonelab",
+        "tag_options": [],
+        "other_urls": [],
+        "platforms": [
+            {"platform": "windows", "label": "Windows", "moderated": False},
+            {"platform": "oculus", "label": "Oculus", "moderated": False},
+        ],
+    }
+
+
+def file_json(base: str, file_: SynthFile) -> dict:
+    return {
+        "id": file_.id,
+        "mod_id": file_.mod_id,
+        "date_added": file_.date,
+        "date_scanned": file_.date,
+        "virus_status": 1,
+        "virus_positive": 0,
+        "virustotal_hash": None,
+        "filesize": file_.size,
+        "filehash": {"md5": file_.md5},
+        "filename": f"{file_.id}.zip",
+        "version": "1.0.0",
+        "changelog": "",
+        "metadata_blob": None,
+        "download": {
+            "binary_url": (
+                f"{base}/v1/games/{GAME_ID}/mods/{file_.mod_id}/files/{file_.id}/download"
+            ),
+            "date_expires": file_.date + 3600,
+        },
+        "platforms": [{"platform": PLATFORM_NAMES[file_.platform], "status": 1}],
+    }
+
+
+def mod_json(base: str, mod: SynthMod) -> dict:
+    newest = max(mod.files, key=lambda f: f.id, default=None)
+    return {
+        "id": mod.id,
+        "game_id": GAME_ID,
+        "status": 1,
+        "visible": 1,
+        "submitted_by": user_json(base, mod.author),
+        "date_added": mod.updated,
+        "date_updated": mod.updated,
+        "date_live": mod.updated,
+        "maturity_option": 8 if mod.nsfw else 0,
+        "logo": image(base, f"mod{mod.id}"),
+        "homepage_url": None,
+        "name": mod.name,
+        "name_id": mod.name.lower().replace(" ", "-"),
+        "summary": f"Summary of {mod.name}",
+        "description": f"<p>Description of {mod.name}</p>",
+        "description_plaintext": f"Description of {mod.name}",
+        "metadata_blob": None,
+        "profile_url": f"{base}/g/bonelab/m/{mod.id}",
+        "media": {"youtube": [], "sketchfab": [], "images": []},
+        "modfile": file_json(base, newest) if newest is not None else None,
+        "metadata_kvp": [],
+        "tags": [{"name": tag, "date_added": mod.updated} for tag in mod.tags],
+        "stats": {
+            "mod_id": mod.id,
+            "popularity_rank_position": mod.rank,
+            "popularity_rank_total_mods": 0,
+            "downloads_today": 0,
+            "downloads_total": mod.downloads,
+            "subscribers_total": 0,
+            "ratings_total": 0,
+            "ratings_positive": 0,
+            "ratings_negative": 0,
+            "ratings_percentage_positive": 0,
+            "ratings_weighted_aggregate": 0,
+            "ratings_display_text": "",
+            "date_expires": 0,
+        },
+    }
+
+
+def paginated(data: list, offset: int, limit: int, total: int) -> dict:
+    return {
+        "data": data,
+        "result_count": len(data),
+        "result_offset": offset,
+        "result_limit": limit,
+        "result_total": total,
+    }
+
+
+# the subset of the mod.io api used by the importer, served from a synthetic catalog
+class FakeModio:
+    def __init__(self, catalog: Catalog, latency: float = 0.0, truncate: float = 0.0):
+        self.catalog = catalog
+        self.mods = {mod.id: mod for mod in catalog.mods}
+        self.files = catalog.files
+        self.latency = latency
+        # fraction of files whose full downloads break off halfway, ranged ones don't
+        self.truncate = truncate
+        self.requests: Counter[str] = Counter()
+        self.bytes_sent = 0
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.count_middleware])
+        app.add_routes(
+            [
+                web.get("/v1/games/{game_id}", self.get_game),
+                web.get("/v1/games/{game_id}/mods", self.get_mods),
+                web.get("/v1/games/{game_id}/mods/{mod_id}/files", self.get_files),
+                web.get(
+                    "/v1/games/{game_id}/mods/{mod_id}/files/{file_id}/download",
+                    self.redirect_download,
+                ),
+                web.get("/mods/file/{file_id}", self.redirect_download),
+                web.get("/cdn/{file_id}.zip", self.download),
+                web.get("/_bench/stats", self.get_stats),
+                web.post("/_bench/reset", self.reset_stats),
+            ]
+        )
+        return app
+
+    @web.middleware
+    async def count_middleware(self, request: web.Request, handler):
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else request.path
+        if not name.startswith("/_bench"):
+            self.requests[f"{request.method} {name}"] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    def base(self, request: web.Request) -> str:
+        return str(request.url.origin())
+
+    async def get_game(self, request: web.Request):
+        return web.json_response(game_json(self.base(request)))
+
+    async def get_mods(self, request: web.Request):
+        offset = int(request.query.get("_offset", 0))
+        limit = min(int(request.query.get("_limit", 100)), 100)
+        mods = self.catalog.mods[offset : offset + limit]
+        base = self.base(request)
+        return web.json_response(
+            paginated(
+                [mod_json(base, mod) for mod in mods],
+                offset,
+                limit,
+                len(self.catalog.mods),
+            )
+        )
+
+    async def get_files(self, request: web.Request):
+        mod = self.mods.get(int(request.match_info["mod_id"]))
+        if mod is None:
+            raise web.HTTPNotFound()
+        limit = int(request.query.get("_limit", 100))
+        files = sorted(mod.files, key=lambda f: f.id, reverse=True)[:limit]
+        base = self.base(request)
+        return web.json_response(
+            paginated([file_json(base, f) for f in files], 0, limit, len(mod.files))
+        )
+
+    async def redirect_download(self, request: web.Request):
+        file_id = int(request.match_info["file_id"])
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        raise web.HTTPFound(f"{self.base(request)}/cdn/{file_id}.zip")
+
+    async def download(self, request: web.Request):
+        file_ = self.files.get(int(request.match_info["file_id"]))
+        if file_ is None:
+            raise web.HTTPNotFound()
+
+        start = 0
+        range_header = request.headers.get("Range", "")
+        if range_header.startswith("bytes=") and range_header.endswith("-"):
+            start = int(range_header[len("bytes=") : -1])
+        if start >= file_.size and file_.size > 0:
+            raise web.HTTPRequestRangeNotSatisfiable()
+
+        response = web.StreamResponse(status=206 if start else 200)
+        response.content_type = "application/zip"
+        response.content_length = file_.size - start
+        response.headers["Accept-Ranges"] = "bytes"
+        if start:
+            response.headers["Content-Range"] = (
+                f"bytes {start}-{file_.size - 1}/{file_.size}"
+            )
+        await response.prepare(request)
+        end = file_.size
+        if not start and self.truncated(file_):
+            end = file_.size // 2
+        with file_.path.open("rb") as f:
+            f.seek(start)
+            while start < end and (chunk := f.read(min(CHUNK_SIZE, end - start))):
+                await response.write(chunk)
+                self.bytes_sent += len(chunk)
+                start += len(chunk)
+        if end < file_.size:
+            assert request.transport is not None
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+    def truncated(self, file_: SynthFile) -> bool:
+        return zlib.crc32(str(file_.id).encode()) % 1000 < self.truncate * 1000
+
+    async def get_stats(self, request: web.Request):
+        return web.json_response(
+            {
+                "requests": dict(self.requests),
+                "request_count": sum(self.requests.values()),
+                "bytes_sent": self.bytes_sent,
+            }
+        )
+
+    async def reset_stats(self, request: web.Request):
+        self.requests.clear()
+        self.bytes_sent = 0
+        return web.json_response({})
+
+
+def serve(
+    catalog: Catalog, host: str, port: int, latency: float = 0.0, truncate: float = 0.0
+):
+    web.run_app(
+        FakeModio(catalog, latency, truncate).app(),
+        host=host,
+        port=port,
+        print=None,
+        handle_signals=True,
+    )
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+PALLET_TYPE = (
+    "SLZ.Marrow.Warehouse.Pallet, SLZ.Marrow.SDK, Version=0.0.0.0, Culture=neutral,"
+    " PublicKeyToken=null"
+)
+CRATE_TYPES = [
+    "SLZ.Marrow.Warehouse.SpawnableCrate, SLZ.Marrow.SDK, Version=0.0.0.0,"
+    " Culture=neutral, PublicKeyToken=null",
+    "SLZ.Marrow.Warehouse.AvatarCrate, SLZ.Marrow.SDK, Version=0.0.0.0,"
+    " Culture=neutral, PublicKeyToken=null",
+    "SLZ.Marrow.Warehouse.LevelCrate, SLZ.Marrow.SDK, Version=0.0.0.0,"
+    " Culture=neutral, PublicKeyToken=null",
+]
+# mod.io tags, the repository is sharded by these
+TAGS = ["Avatar", "Weapon", "Level", "Utility", "Vehicle"]
+# the importer detects the platform from the path separator in the catalog json
+PLATFORM_MARKERS = {
+    "windows": "{SLZ.Marrow.MarrowSDK.RuntimeModsPath}\\",
+    "android": "{SLZ.Marrow.MarrowSDK.RuntimeModsPath}/",
+}
+
+
+@dataclass
+class SynthFile:
+    id: int
+    mod_id: int
+    platform: str
+    date: int
+    path: Path
+    size: int = 0
+    md5: str = ""
+
+
+@dataclass
+class SynthMod:
+    id: int
+    name: str
+    author: str
+    rank: int
+    downloads: int
+    nsfw: bool
+    updated: int
+    tags: list[str] = field(default_factory=list)
+    files: list[SynthFile] = field(default_factory=list)
+
+
+@dataclass
+class Catalog:
+    mods: list[SynthMod]
+
+    @property
+    def files(self) -> dict[int, SynthFile]:
+        return {f.id: f for mod in self.mods for f in mod.files}
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(f.size for mod in self.mods for f in mod.files)
+
+
+def pallet_json(barcode: str, title: str, author: str, crates: int) -> dict:
+    types = {"t:1": {"type": "t:1", "fullname": PALLET_TYPE}}
+    for i, fullname in enumerate(CRATE_TYPES, start=2):
+        types[f"t:{i}"] = {"type": f"t:{i}", "fullname": fullname}
+
+    objects = {}
+    crate_refs = []
+    for i in range(crates):
+        ref = f"o:{i + 2}"
+        type_ref = f"t:{2 + i % len(CRATE_TYPES)}"
+        crate_refs.append({"ref": ref, "type": type_ref})
+        objects[ref] = {
+            "barcode": f"{barcode}.Crate{i}",
+            "title": f"{title} crate {i}",
+            "description": "",
+            "unlockable": False,
+            "redacted": False,
+            "tags": [],
+            "mainAsset": {"guid": f"{i:032x}"},
+            "pallet": {"ref": "o:1", "type": "t:1"},
+            "isa": {"type": type_ref},
+        }
+    objects["o:1"] = {
+        "barcode": barcode,
+        "title": title,
+        "description": "",
+        "unlockable": False,
+        "redacted": False,
+        "tags": [],
+        "author": author,
+        "version": "1.0.0",
+        "sdkVersion": "0.2.0",
+        "crates": crate_refs,
+        "changeLogs": [],
+        "dependencies": [],
+        "isa": {"type": "t:1"},
+    }
+    return {
+        "version": 1,
+        "root": {"ref": "o:1", "type": "t:1"},
+        "objects": objects,
+        "types": types,
+    }
+
+
+# fixed timestamps, so the same seed gives the same archives and hashes on every run
+def entry(name: str) -> ZipInfo:
+    return ZipInfo(name, date_time=(2022, 9, 29, 0, 0, 0))
+
+
+def write_archive(
+    path: Path,
+    barcode: str,
+    title: str,
+    author: str,
+    platform: str,
+    size: int,
+    crates: int,
+    rng: random.Random,
+    broken: bool = False,
+):
+    if broken:
+        path.write_bytes(rng.randbytes(max(size, 64)))
+        return
+
+    catalog = {
+        "m_LocatorId": "AddressablesMainContentCatalog",
+        "m_InternalIds": [
+            f"{PLATFORM_MARKERS[platform]}{barcode}/bundle_{i}.bundle" for i in range(3)
+        ],
+    }
+    with ZipFile(path, "w") as zf:
+        zf.writestr(
+            entry(f"{barcode}/pallet.json"),
+            json.dumps(pallet_json(barcode, title, author, crates), indent=2),
+            compress_type=ZIP_DEFLATED,
+        )
+        zf.writestr(
+            entry(f"{barcode}/catalog_{barcode}.json"),
+            json.dumps(catalog),
+            compress_type=ZIP_DEFLATED,
+        )
+        # random bytes so the archive stays at the requested size after compression
+        zf.writestr(
+            entry(f"{barcode}/{platform}/content.bundle"),
+            rng.randbytes(size),
+            compress_type=ZIP_STORED,
+        )
+
+
+def generate(
+    out: Path,
+    mods: int,
+    size: int,
+    quest_ratio: float = 0.5,
+    nsfw_ratio: float = 0.1,
+    broken_ratio: float = 0.02,
+    crates: int = 4,
+    seed: int = 0,
+) -> Catalog:
+    rng = random.Random(seed)
+    out.mkdir(parents=True, exist_ok=True)
+    now = int(time.time())
+    catalog = Catalog([])
+    for i in range(mods):
+        mod_id = 100000 + i
+        author = f"Author{rng.randrange(max(mods // 5, 1))}"
+        mod = SynthMod(
+            id=mod_id,
+            name=f"Synthetic Mod {i}",
+            author=author,
+            rank=i + 1,
+            downloads=rng.randrange(100000),
+            nsfw=rng.random() < nsfw_ratio,
+            updated=now - rng.randrange(86400 * 30),
+            tags=[TAGS[i % len(TAGS)]],
+        )
+        barcode = f"{author}.SyntheticMod{i}"
+        broken = rng.random() < broken_ratio
+        platforms = ["windows"]
+        if rng.random() < quest_ratio:
+            platforms.append("android")
+        for n, platform in enumerate(platforms):
+            # stable per mod, so catalogs of different sizes can share a workdir
+            file_id = mod_id * 10 + n
+            path = out / f"{file_id}.zip"
+            write_archive(
+                path, barcode, mod.name, author, platform, size, crates, rng, broken
+            )
+            data = path.read_bytes()
+            mod.files.append(
+                SynthFile(
+                    id=file_id,
+                    mod_id=mod_id,
+                    platform=platform,
+                    date=mod.updated,
+                    path=path,
+                    size=len(data),
+                    md5=hashlib.md5(data).hexdigest(),
+                )
+            )
+        catalog.mods.append(mod)
+    return catalog
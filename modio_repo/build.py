@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from pathlib import Path
+
+from modio_repo.changes import write_changes
+from modio_repo.metrics import metrics, write_atomic
+from modio_repo.models import BarcodeConflict, Listing, Mod, PcPalletError, QuestPalletError
+from modio_repo.search import write_search_index
+from modio_repo.site import render_site
+from modio_repo.slz_json import reset as reset_slzjson
+from modio_repo.slz_repositoryfile import RepositoryFile
+from modio_repo.utils import log
+
+
+# every mod sharing a barcode with others gets a message naming the others
+async def add_conflicts(faulty_mods: dict):
+    conflicts = await BarcodeConflict.all().order_by("barcode")
+    mod_ids = {mod_id for conflict in conflicts for mod_id in conflict.mod_ids}
+    mods = {mod.id: mod for mod in await Mod.filter(id__in=mod_ids)}
+    for conflict in conflicts:
+        for mod_id in conflict.mod_ids:
+            mod = mods.get(mod_id)
+            if mod is None:
+                continue
+            others = ", ".join(
+                mods[other].name for other in conflict.mod_ids if other != mod_id and other in mods
+            )
+            message = f"pallet barcode {conflict.barcode} is also used by {others}"
+            if mod_id not in faulty_mods:
+                faulty_mods[mod_id] = {
+                    "modname": mod.name,
+                    "messages": [message],
+                    "last_update": mod.mod_updated.isoformat()
+                }
+            else:
+                faulty_mods[mod_id]["messages"].append(message)
+    metrics.set("barcode_conflicts", len(conflicts))
+
+
+# every file is replaced atomically, readers see either the old or the new one.
+# only reads the database, the checks run before the snapshot is taken
+async def build():
+    log("writing repo file")
+
+    reset_slzjson()
+    repofile = RepositoryFile(
+        "./static/repository.json",
+        "mod.io (unofficial)",
+        "Unofficial repository of mod.io mods",
+    )
+    sfw_mods = await Listing.filter(malformed_pallet=False, nsfw=False).order_by("rank")
+    with metrics.timer("repository_build"):
+        for listing in sfw_mods:
+            repofile.add_listing(listing)
+    with metrics.timer("repository_save"):
+        repofile.save()
+    repositories = [repofile.index_entry("full", nsfw=False)]
+    with metrics.timer("repository_variants"):
+        repositories.extend(dict(e, nsfw=False) for e in repofile.save_variants())
+
+    reset_slzjson()
+    nsfw_repofile = RepositoryFile(
+        "./static/nsfw_repository.json",
+        "mod.io nsfw (unofficial)",
+        "Unofficial repository of NSFW mod.io mods",
+    )
+    nsfw_mods = await Listing.filter(malformed_pallet=False, nsfw=True).order_by("rank")
+    with metrics.timer("repository_build"):
+        for listing in nsfw_mods:
+            nsfw_repofile.add_listing(listing)
+    with metrics.timer("repository_save"):
+        nsfw_repofile.save()
+    repositories.append(nsfw_repofile.index_entry("full", nsfw=True))
+    with metrics.timer("repository_variants"):
+        repositories.extend(dict(e, nsfw=True) for e in nsfw_repofile.save_variants())
+    with metrics.timer("search_index"):
+        metrics.set("search_index_bytes", write_search_index(sfw_mods + nsfw_mods))
+
+    sequence = write_changes([repofile, nsfw_repofile])
+
+    updated = datetime.utcnow().isoformat()
+    write_atomic(
+        Path("./static/repositories.json"),
+        json.dumps(
+            {"updated": updated, "changes": sequence, "repositories": repositories}
+        ),
+    )
+
+    # the file and mod of every error in one query each
+    faulty_pc = await PcPalletError.all().prefetch_related("file__mod")
+    faulty_quest = await QuestPalletError.all().prefetch_related("file__mod")
+    faulty_mods = {}
+    for pc_err in faulty_pc:
+        mod = pc_err.file.mod
+        faulty_mods[mod.id] = {
+            "modname": mod.name,
+            "messages": [pc_err.error],
+            "last_update": mod.mod_updated.isoformat()
+        }
+    for quest_err in faulty_quest:
+        mod = quest_err.file.mod
+        if mod.id not in faulty_mods:
+            faulty_mods[mod.id] = {
+                "modname": mod.name,
+                "messages": [quest_err.error],
+                "last_update": mod.mod_updated.isoformat()
+            }
+        else:
+            faulty_mods[mod.id]["messages"].append(quest_err.error)
+    await add_conflicts(faulty_mods)
+    site_meta = {
+        "updated": updated,
+        "nsfw_count": len(nsfw_mods),
+        "sfw_count": len(sfw_mods),
+        "faulty_count": len(faulty_mods)
+    }
+    errors = list(faulty_mods.values())
+    write_atomic(Path("./static/site_meta.json"), json.dumps(site_meta))
+    write_atomic(Path("./static/errors.json"), json.dumps(errors))
+
+    render_site(
+        {"site_meta": site_meta, "errors": errors, "repositories": repositories}
+    )
+
+    metrics.set("repository_mods", len(sfw_mods) + len(nsfw_mods))
+    metrics.set("faulty_mods", len(faulty_mods))
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from modio_repo.metrics import metrics, write_atomic
+from modio_repo.slz_repositoryfile import RepositoryFile
+from modio_repo.utils import log
+
+CHANGES_PATH = Path(os.getenv("CHANGES_PATH", "./static/changes.json"))
+# what the previous build published, by mod id
+CHANGES_STATE_PATH = Path(
+    os.getenv("CHANGES_STATE_PATH", "./static/.changes_state.json")
+)
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", "7"))
+CHANGES_VERSION = 1
+
+# rank and download counts change on every sync and are left out of the comparison,
+# otherwise every mod would be updated in every build. they're still in the entries
+VOLATILE_FIELDS = ("title",)
+
+
+def fingerprint(repository: str, listing_name: str, entry: dict) -> str:
+    content = {k: v for k, v in entry.items() if k not in VOLATILE_FIELDS}
+    content.update(repository=repository, name=listing_name)
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+# the feed is a list of builds, each with the listings added, updated and removed
+# since the build before. a consumer remembers the sequence it synced to and applies
+# the builds after it. if its sequence is older than "base" the feed doesn't reach
+# back far enough and it has to fetch the full repositories again
+class ChangesFeed:
+    def __init__(
+        self,
+        path: Path = CHANGES_PATH,
+        state_path: Path = CHANGES_STATE_PATH,
+        retention: timedelta = timedelta(days=CHANGES_RETENTION_DAYS),
+    ):
+        self.path = path
+        self.state_path = state_path
+        self.retention = retention
+        try:
+            self.feed = json.loads(path.read_text())
+            if self.feed.get("version") != CHANGES_VERSION:
+                raise ValueError(f"changes feed version {self.feed.get('version')}")
+        except (OSError, ValueError) as e:
+            log(f"starting a new changes feed: {e}")
+            self.feed = {"version": CHANGES_VERSION, "sequence": 0, "base": 0, "builds": []}
+        try:
+            self.state: dict[str, dict] | None = json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            self.state = None
+
+    @property
+    def sequence(self) -> int:
+        return self.feed["sequence"]
+
+    def collect(self, repofiles: list[RepositoryFile]) -> dict[str, dict]:
+        current = {}
+        for repofile in repofiles:
+            repository = Path(repofile.filename).name
+            for listing in repofile.listings:
+                entry = repofile.listing_entry(listing)
+                current[str(listing.mod_id)] = {  # type: ignore
+                    "repository": repository,
+                    "barcode": listing.barcode,
+                    "hash": fingerprint(repository, listing.name, entry),
+                    "entry": entry,
+                }
+        return current
+
+    def update(self, repofiles: list[RepositoryFile]) -> int:
+        now = datetime.utcnow()
+        current = self.collect(repofiles)
+
+        if self.state is None:
+            # nothing to compare against, consumers have to start from a full sync
+            self.feed["sequence"] += 1
+            self.feed["base"] = self.feed["sequence"]
+            self.feed["builds"] = []
+            log(f"changes feed reset at sequence {self.sequence}")
+        else:
+            added, updated, removed = [], [], []
+            for mod_id, item in current.items():
+                previous = self.state.get(mod_id)
+                change = {
+                    "mod_id": int(mod_id),
+                    "barcode": item["barcode"],
+                    "repository": item["repository"],
+                    "entry": item["entry"],
+                }
+                if previous is None:
+                    added.append(change)
+                elif previous["hash"] != item["hash"]:
+                    updated.append(change)
+            for mod_id, previous in self.state.items():
+                if mod_id not in current:
+                    removed.append(
+                        {
+                            "mod_id": int(mod_id),
+                            "barcode": previous["barcode"],
+                            "repository": previous["repository"],
+                        }
+                    )
+            metrics.set("changes_added", len(added))
+            metrics.set("changes_updated", len(updated))
+            metrics.set("changes_removed", len(removed))
+            if added or updated or removed:
+                self.feed["sequence"] += 1
+                self.feed["builds"].append(
+                    {
+                        "sequence": self.sequence,
+                        "time": now.isoformat(),
+                        "added": added,
+                        "updated": updated,
+                        "removed": removed,
+                    }
+                )
+                log(
+                    f"changes {self.sequence}: {len(added)} added,"
+                    f" {len(updated)} updated, {len(removed)} removed"
+                )
+
+        cutoff = (now - self.retention).isoformat()
+        builds = self.feed["builds"]
+        while builds and builds[0]["time"] < cutoff:
+            self.feed["base"] = builds.pop(0)["sequence"]
+        self.feed["updated"] = now.isoformat()
+
+        content = json.dumps(self.feed, separators=(",", ":"))
+        write_atomic(self.path, content)
+        state = {
+            mod_id: {k: item[k] for k in ("repository", "barcode", "hash")}
+            for mod_id, item in current.items()
+        }
+        write_atomic(self.state_path, json.dumps(state, separators=(",", ":")))
+        metrics.set("changes_feed_bytes", len(content))
+        return self.sequence
+
+
+def write_changes(repofiles: list[RepositoryFile]) -> int:
+    with metrics.timer("changes_feed"):
+        return ChangesFeed().update(repofiles)
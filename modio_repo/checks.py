@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+from collections import Counter
+from typing import Type
+
+from modio_repo.models import (
+    Listing,
+    Mod,
+    ModFileBase,
+    PcPalletError,
+    QuestPalletError,
+)
+from modio_repo import barcodes
+from modio_repo.metrics import metrics
+from modio_repo.profiling import profiled
+from modio_repo.utils import log
+
+
+async def check_duplicate_pallet_for(
+    file_: ModFileBase, error: Type[PcPalletError | QuestPalletError]
+):
+    pallets = await file_.get_pallets()
+    if len(pallets) > 1:
+        barcodes = Counter([p.barcode for p in pallets])
+        (common,) = barcodes.most_common(1)
+        barcode, count = common
+        if count > 1:
+            (err, _) = await error.update_or_create(
+                file=file_,
+                defaults={"error": f"{file_.url} contains duplicate pallet barcodes: {barcode}"},
+            )
+            await err.save()
+
+
+async def mark_duplicate_pallets(mod: Mod):
+    pc_file = await mod.get_pc_file()
+    if pc_file is not None:
+        await check_duplicate_pallet_for(pc_file, PcPalletError)
+
+    quest_file = await mod.get_quest_file()
+    if quest_file is not None:
+        await check_duplicate_pallet_for(quest_file, QuestPalletError)
+
+
+@profiled("checks")
+async def run_checks(mods: list[Mod]):
+    for mod in mods:
+        await mark_duplicate_pallets(mod)
+        await set_malformed(mod)
+
+
+async def set_malformed(mod):
+    pc_file = await mod.get_pc_file()
+    if pc_file is not None:
+        count = await pc_file.pallet_error.all().count()
+        if count > 0:
+            mod.malformed_pallet = True  # type: ignore
+            await mod.save()
+
+    quest_file = await mod.get_quest_file()
+    if quest_file is not None:
+        count = await quest_file.pallet_error.all().count()
+        if count > 0:
+            mod.malformed_pallet = True  # type: ignore
+            await mod.save()
+
+    if mod.malformed_pallet:
+        await Listing.filter(mod_id=mod.id).update(malformed_pallet=True)
+
+
+# the checks on their own, the build runs them too
+async def check() -> list[Mod]:
+    mods = await Mod.filter(malformed_pallet=False)
+    for mod in mods:
+        mod.remember()
+
+    log("checking duplicate, malformed")
+    with metrics.timer("checks"):
+        await run_checks(mods)
+        await barcodes.update_conflicts()
+    return mods
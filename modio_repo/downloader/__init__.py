@@ -1,32 +1,38 @@
 import asyncio
+import math
 import os
-from random import random
 import re
 from datetime import datetime, timedelta
-from pathlib import Path
 import traceback
-from typing import AsyncGenerator, Generator, List, Type
+from typing import Any, AsyncGenerator, Awaitable, Generator, Iterable, List, Type
 
-import aiohttp
 import modio
 import pytz
 from dotenv import load_dotenv
-from modio.client import Game
+from modio.client import Connection, Game
 from modio.client import Mod as ApiMod
 from modio.enums import Visibility
+from modio_repo import barcodes
+from modio_repo.downloader.failures import FailureCache
+from modio_repo.downloader.http import HttpPools
+from modio_repo.downloader.missing_pallets import MissingPallets
 from modio_repo.downloader.mod_files import ModFiles
 from modio_repo.downloader.pallets import PalletHandler
+from modio_repo.downloader.scheduler import Scheduler
+from modio_repo.downloader.sweep import delete_mods, sweep_deleted
+from modio_repo.identity import identity
+from modio_repo.listing import refresh_listing, update_listing_stats
+from modio_repo.metrics import metrics
+from modio_repo.profiling import profiled
 from modio_repo.models import (
     Mod,
     PalletBase,
     PalletErrorBase,
     PcModFile,
-    PcPallet,
     PcPalletError,
-    QuestPallet,
     QuestPalletError,
 )
-from modio_repo.utils import PalletLoadError, get_api_mod_updated, log
+from modio_repo.utils import PalletLoadError, get_api_mod_updated, log, modio_api_url
 from tortoise import Tortoise, run_async
 
 load_dotenv()
@@ -35,7 +41,8 @@ MODIO_API_KEY = os.getenv("MODIO_API_KEY")
 MODIO_API_SECRET = os.getenv("MODIO_API_SECRET")
 
 # paralell downloads
-par_download_sem = asyncio.Semaphore(8)
+PAR_DOWNLOADS = 8
+par_download_sem = asyncio.Semaphore(PAR_DOWNLOADS)
 
 # ingame repo downloading:  https://discord.com/channels/918643357998260246/918649756463538216/1026581323525148713
 # 1. Open data as zip
@@ -60,14 +67,100 @@ class ModSkip(Exception):
     pass
 
 
-class Run:
-    def __init__(self, session: aiohttp.ClientSession):
-        self.session = session
+def mod_changed(
+    api_mod: ApiMod, mod_updated: datetime, last_file_change: datetime | None
+) -> bool:
+    # check if mod updated
+    if mod_updated < api_mod.updated.astimezone(pytz.UTC):
+        return True
+
+    # check if new mod file
+    return (
+        api_mod.file is None
+        or last_file_change is None
+        or datetime.fromtimestamp(api_mod.file.date, tz=pytz.UTC) > last_file_change
+    )
+
+
+# the columns refreshed on every run
+def stats_fields(api_mod: ApiMod) -> dict[str, Any]:
+    return {
+        "name": api_mod.name,
+        "description": api_mod.summary,
+        "thumbnailUrl": mod_logo_url(api_mod),
+        # malformed_pallet is kept, the file did not change
+        "nsfw": api_mod.maturity.value == api_mod.maturity.explicit.value,
+        "rank": api_mod.stats.rank,
+        "downloads": api_mod.stats.downloads,
+        "tags": sorted(api_mod.tags),
+    }
+
+
+# all columns, for new and changed mods
+def mod_fields(api_mod: ApiMod) -> dict[str, Any]:
+    return {
+        **stats_fields(api_mod),
+        "mod_updated": get_api_mod_updated(api_mod),
+        "last_checked": datetime.now(),
+        "malformed_pallet": False,
+    }
+
+
+class ModioConnection(Connection):
+    @property
+    def _base_path(self):
+        return f"{modio_api_url()}/{self.version}"
+
+
+def make_client(http: HttpPools) -> modio.Client:
+    client = modio.Client(api_key=MODIO_API_KEY, access_token=MODIO_API_SECRET)
+    # modio.Client has no option for the api host, it gets a connection that has one,
+    # built with the arguments the client passes to its own
+    client.connection = ModioConnection(
+        api_key=MODIO_API_KEY,
+        access_token=MODIO_API_SECRET,
+        lang=client.lang,
+        version=client.version,
+        test=client.test,
+        platform=None,
+        portal=None,
+        ratelimit_max_sleep=math.inf,
+    )
+    # instead of client.start(), which opens a session of its own
+    client.connection.async_session = http.api
+    return client
+
+
+# the platforms of a mod are separate archives, they're downloaded and parsed side by
+# side under the pools' connection limits. all of them finish, then the first error
+# in platform order (pc first) is raised, so a broken one still ends the mod
+async def each_platform(jobs: Iterable[Awaitable[Any]]) -> list[Any]:
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
 
+class Run:
+    def __init__(self, http: HttpPools):
+        self.http = http
+        self.failures = FailureCache()
+        self.pages_waiting = 0
+        # new and changed mods, downloaded after the pagination in priority order
+        self.scheduler: Scheduler[tuple[ApiMod, bool]] = Scheduler(self.bytes_spent)
+        self.bytes_at_start = metrics.counters["download_bytes"]
+        # ids of every mod mod.io listed, only a complete pass can be used to sweep
+        self.seen: set[int] = set()
+        self.complete = False
+
+    def bytes_spent(self) -> float:
+        return metrics.counters["download_bytes"] - self.bytes_at_start
+
+    @profiled("Run.run")
     async def run(self, onepage: bool = False):
-        client = modio.Client(api_key=MODIO_API_KEY, access_token=MODIO_API_SECRET)
+        client = make_client(self.http)
         log("logged in")
-        await client.start()
 
         game = await client.async_get_game(3809)  # 3809 = bonelab
         
@@ -76,31 +169,55 @@ class Run:
         async for mods in self.generate_mods(game, onepage):
             tasks.append(self.insert_mods(mods))
         await asyncio.gather(*tasks)
-        await client.close()
+        self.complete = not onepage
+        await self.run_scheduled()
+        await self.finish()
+
+    async def finish(self):
+        if self.complete:
+            with metrics.timer("sweep"):
+                await sweep_deleted(self.seen)
+        missing = MissingPallets()
+        await missing.load()
+        metrics.set("missing_pallet_queue", len(missing))
+        await missing.repair(self.repair_pallet)
+        await self.failures.report()
 
     async def generate_mods(
         self, game: Game, onepage: bool
     ) -> AsyncGenerator[List[ApiMod], None]:
-        mods_result, pagination = await game.async_get_mods()
+        with metrics.timer("modio_pagination"):
+            mods_result, pagination = await game.async_get_mods()
+        metrics.inc("modio_pages")
         yield mods_result
         if onepage:
             return
         while not pagination.max():
             filters = modio.Filter()
             filters.offset(pagination.next())
-            mods_result, pagination = await game.async_get_mods(filters=filters)
+            with metrics.timer("modio_pagination"):
+                mods_result, pagination = await game.async_get_mods(filters=filters)
+            metrics.inc("modio_pages")
             yield mods_result
             
     async def delete_mod(self, api_mod: ApiMod):
-        mod = await Mod.filter(id=api_mod.id).first()
-        if mod is not None:
-            await mod.delete()
+        await self.delete_mod_id(api_mod.id)
+
+    async def delete_mod_id(self, mod_id: int):
+        if await Mod.get_cached(mod_id) is not None:
+            await delete_mods([mod_id])
+        identity.forget_mod(mod_id)
 
     async def insert_mods(self, mods_result: List[ApiMod]):
+        self.seen.update(api_mod.id for api_mod in mods_result)
         # use the semaphore to limit paralellism
+        self.pages_waiting += 1
+        metrics.set_max("pages_waiting", self.pages_waiting)
         async with par_download_sem:
+            self.pages_waiting -= 1
             log(f"working on {len(mods_result)}")
             for api_mod in mods_result:
+                metrics.inc("mods_processed")
                 if api_mod.visible.value == Visibility.hidden.value:
                     await self.delete_mod(api_mod)
                     print(f"Deleted invisible mod {api_mod.name}")
@@ -116,129 +233,151 @@ class Run:
                     
 
     async def insert_update_mod(self, api_mod: ApiMod):
-        mod = await Mod.filter(id=api_mod.id).first()
+        mod = await Mod.get_cached(api_mod.id)
         if mod is None:
-            await self.insert_mod(api_mod)
+            self.schedule(api_mod, None)
+        elif mod_changed(api_mod, mod.mod_updated, await mod.get_last_file_change()):
+            log(f"Mod has changed, updating and re-downloading {api_mod.name}")
+            self.schedule(api_mod, mod)
         else:
-            changed = False
+            await self.update_stats_mod(api_mod)
+
+    def schedule(self, api_mod: ApiMod, mod: Mod | None):
+        self.scheduler.push(
+            (api_mod, mod is not None),
+            api_mod.stats.rank,
+            api_mod.stats.downloads,
+            mod.last_checked if mod is not None else None,
+            api_mod.file.size if api_mod.file is not None else 0,
+        )
 
+    async def run_scheduled(self):
+        metrics.inc("scheduled_mods", len(self.scheduler))
+        await asyncio.gather(
+            *(self.scheduled_worker() for _ in range(PAR_DOWNLOADS))
+        )
+        for api_mod, known in self.scheduler.deferred:
+            # known mods keep their old files until the next run, new ones wait
+            if known:
+                await self.update_stats_mod(api_mod)
+        metrics.inc("deferred_mods", len(self.scheduler.deferred))
+        self.scheduler.report()
 
-            # check if mod updated
-            if mod.mod_updated < api_mod.updated.astimezone(pytz.UTC):
-                changed = True
-            
-            # check if pallet exists (random chance to not redownload all missing ones every time)
-            if random() > 0.95:
-                pc_file = await mod.get_pc_file()
-                if pc_file is not None:
-                    pc_pallet = await pc_file.pallet.all().first()
-                    if pc_pallet is None:
-                        changed = True
-                quest_file = await mod.get_quest_file()
-                if quest_file is not None:
-                    pc_pallet = await quest_file.pallet.all().first()
-                    if pc_pallet is None:
-                        changed = True
-             
-            # check if new mod file
-            last_file_change = await mod.get_last_file_change()
-            if (
-                api_mod.file is None
-                or last_file_change is None
-                or datetime.fromtimestamp(api_mod.file.date, tz=pytz.UTC)
-                > last_file_change
-            ):
-                changed = True
-
-            if changed:
-                log(f"Mod has changed, updating and re-downloading {api_mod.name}")
+    async def scheduled_worker(self):
+        while (item := self.scheduler.pop()) is not None:
+            api_mod, _ = item
+            try:
                 await self.insert_mod(api_mod)
-            else:
-                await self.update_stats_mod(api_mod)
+            except ModSkip:
+                log("Skipped ", api_mod.name)
+            except Exception as e:
+                traceback.print_exc()
+                log(e, " in ", api_mod.name)
 
     async def update_stats_mod(self, api_mod: ApiMod):
-        mod, created = await Mod.update_or_create(
-            id=api_mod.id,
-            defaults={
-                "name": api_mod.name,
-                "description": api_mod.summary,
-                # "mod_updated": get_api_mod_updated(api_mod),
-                # "last_checked": datetime.now(),
-                "thumbnailUrl": mod_logo_url(api_mod),
-                "malformed_pallet": False,
-                "nsfw": api_mod.maturity.value == api_mod.maturity.explicit.value,
-                "rank": api_mod.stats.rank,
-                "downloads": api_mod.stats.downloads,
-            },
-        )
+        await self.save_stats(api_mod.id, stats_fields(api_mod))
 
-        await mod.save()
+    async def save_stats(self, mod_id: int, fields: dict[str, Any]):
+        mod, created = await Mod.update_or_create(id=mod_id, defaults=fields)
+        mod.remember()
+        await update_listing_stats(mod)
 
     async def insert_mod(self, api_mod: ApiMod):
-        mod, created = await Mod.update_or_create(
-            id=api_mod.id,
-            defaults={
-                "name": api_mod.name,
-                "description": api_mod.summary,
-                "mod_updated": get_api_mod_updated(api_mod),
-                "last_checked": datetime.now(),
-                "thumbnailUrl": mod_logo_url(api_mod),
-                "malformed_pallet": False,
-                "nsfw": api_mod.maturity.value == api_mod.maturity.explicit.value,
-                "rank": api_mod.stats.rank,
-                "downloads": api_mod.stats.downloads,
-            },
-        )
+        mod = await self.save_mod(api_mod.id, mod_fields(api_mod))
+        try:
+            await self.insert_mod_files(api_mod, mod)
+        finally:
+            await refresh_listing(mod.id)
 
-        await mod.save()
+    async def save_mod(self, mod_id: int, fields: dict[str, Any]) -> Mod:
+        mod, created = await Mod.update_or_create(id=mod_id, defaults=fields)
+        mod.remember()
 
         if not created:
             # re-pull files if changed
+            await barcodes.forget_mods([mod.id])
             await mod.clear_files()
-
-        await self.insert_mod_files(api_mod, mod)
+        return mod
 
     async def insert_mod_files(self, api_mod, mod):
-        mf = ModFiles(mod, api_mod, self.session)
+        mf = ModFiles(mod, api_mod, self.http)
 
-        await mf.insert_mod_files()
+        with metrics.timer("mod_files"):
+            await mf.insert_mod_files()
 
-        pc_file = await mod.get_pc_file()
-        if pc_file is not None:
-            await self.pallet_from_file(mod, pc_file, PcPalletError)
+            jobs = []
+            pc_file = await mod.get_pc_file()
+            if pc_file is not None:
+                jobs.append(self.pallet_from_file(mod, pc_file, PcPalletError))
 
-        quest_file = await mod.get_quest_file()
-        if quest_file is not None:
-            await self.pallet_from_file(mod, quest_file, QuestPalletError)
+            quest_file = await mod.get_quest_file()
+            if quest_file is not None:
+                jobs.append(self.pallet_from_file(mod, quest_file, QuestPalletError))
+            await each_platform(jobs)
 
     async def pallet_from_file(self, mod: Mod, file, error_cls: Type[PalletErrorBase]):
+        failure = await self.failures.check(file.id)
+        if failure is not None:
+            await self.skip_failed(mod, file, error_cls, failure.error, failure.size)
+
+        ph = PalletHandler(mod, file, self.http)
         try:
-            ph = PalletHandler(mod, file, self.session)
             await ph.run()
         except PalletLoadError as e:
             if e.modio_file_id == -999:
                 log("pallet error", e)
-            await Mod.filter(id=mod.id).update(malformed_pallet=True)
-            error = error_cls(file=file, error=str(e))
-            await error.save()
-            raise ModSkip
-
-
-async def delete_old_pallets():
-    pallets: List[PcPallet | QuestPallet] = []
-    pallets.extend(await QuestPallet.all())
-    pallets.extend(await PcPallet.all())
-
-    paths = [Path(pallet.fs_path).resolve() for pallet in pallets]
-    for pallet_file in PalletHandler.PATH.glob("*.json"):
-        if pallet_file.resolve() not in paths:
-            pallet_file.unlink()
-            log(f"Expunged {pallet_file.relative_to(Path())}")
+            await self.failures.record(file.id, e, ph.downloaded)
+            await self.mark_malformed(mod, file, error_cls, str(e))
+        else:
+            if await self.failures.clear(file.id):
+                await self.clear_malformed(mod, file, error_cls)
+
+    async def skip_failed(
+        self, mod: Mod, file, error_cls: Type[PalletErrorBase], error: str, size: int
+    ):
+        metrics.inc("downloads_skipped_failed")
+        metrics.inc("download_bytes_saved", size)
+        log(f"Skipping known broken file {file.id} of {mod.name}: {error}")
+        await self.mark_malformed(mod, file, error_cls, error)
+
+    # a retry after the backoff worked. the mod is publishable again, unless the
+    # file of its other platform is still broken
+    async def clear_malformed(self, mod: Mod, file, error_cls: Type[PalletErrorBase]):
+        await error_cls.filter(file_id=file.id).delete()
+        if error_cls is PcPalletError:
+            other, other_error_cls = await mod.get_quest_file(), QuestPalletError
+        else:
+            other, other_error_cls = await mod.get_pc_file(), PcPalletError
+        if other is not None and await other_error_cls.exists(file_id=other.id):
+            return
+        await Mod.filter(id=mod.id).update(malformed_pallet=False)
+        mod.malformed_pallet = False  # type: ignore
+        metrics.inc("pallets_recovered")
+        log(f"pallet of {mod.name} works again after a failed attempt")
+
+    async def mark_malformed(
+        self, mod: Mod, file, error_cls: Type[PalletErrorBase], message: str
+    ):
+        await Mod.filter(id=mod.id).update(malformed_pallet=True)
+        mod.malformed_pallet = True  # type: ignore
+        await error_cls.update_or_create(file=file, defaults={"error": message})
+        raise ModSkip
+
+    async def repair_pallet(self, mod: Mod, file, error_cls: Type[PalletErrorBase]):
+        try:
+            await self.pallet_from_file(mod, file, error_cls)
+        except ModSkip:
+            log("Pallet still broken for ", mod.name)
+        finally:
+            await refresh_listing(mod.id)
 
 
 async def main():
-    async with aiohttp.ClientSession() as session:
-        await delete_old_pallets()
-        r = Run(session)
+    # imported here, it needs Run from this module
+    from modio_repo.downloader.sharded import INGEST_WORKERS, ShardedRun
+
+    async with HttpPools() as http:
+        r = ShardedRun(http, INGEST_WORKERS) if INGEST_WORKERS > 1 else Run(http)
         log("starting run")
-        await r.run()
+        with metrics.timer("sync"):
+            await r.run()
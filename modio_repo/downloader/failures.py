@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+from tortoise.expressions import F
+
+from modio_repo.models import PalletFailure
+from modio_repo.utils import PalletLoadError, log
+
+# first retry delay per failure class, doubled for every further failed attempt.
+# download errors are usually transient, broken archives only get fixed by a new upload
+BACKOFF_BASE = {
+    "download": timedelta(minutes=30),
+    "size": timedelta(hours=1),
+    "checksum": timedelta(hours=1),
+    "bad_zip": timedelta(hours=12),
+    "encoding": timedelta(days=1),
+    "format": timedelta(days=1),
+    "platform": timedelta(days=1),
+}
+BACKOFF_DEFAULT = timedelta(hours=6)
+BACKOFF_MAX = timedelta(days=14)
+
+
+def backoff(kind: str, attempts: int) -> timedelta:
+    delay = BACKOFF_BASE.get(kind, BACKOFF_DEFAULT) * 2 ** max(attempts - 1, 0)
+    return min(delay, BACKOFF_MAX)
+
+
+# negative results of pallet extraction, keyed by mod.io file id.
+# a new upload gets a new file id, so it is never held back by an older failure
+class FailureCache:
+    def __init__(self):
+        self.skipped = 0
+        self.bytes_saved = 0
+
+    # returns the cached failure if the file is still in backoff
+    async def check(self, file_id: int) -> PalletFailure | None:
+        failure = await PalletFailure.get_or_none(id=file_id)
+        if failure is None:
+            return None
+        if failure.retry_after <= datetime.now(timezone.utc):
+            log(f"backoff for file {file_id} expired, retrying ({failure.kind})")
+            return None
+
+        await self.count_skip(file_id, failure.size)
+        return failure
+
+    # the file wasn't downloaded because of its failure, size is what that saved
+    async def count_skip(self, file_id: int, size: int):
+        await PalletFailure.filter(id=file_id).update(
+            skipped=F("skipped") + 1, bytes_saved=F("bytes_saved") + size
+        )
+        self.skipped += 1
+        self.bytes_saved += size
+
+    async def record(self, file_id: int, error: PalletLoadError, size: int):
+        now = datetime.now(timezone.utc)
+        failure = await PalletFailure.get_or_none(id=file_id)
+        if failure is None:
+            failure = PalletFailure(
+                id=file_id, attempts=0, size=0, skipped=0, bytes_saved=0
+            )
+        failure.attempts += 1
+        failure.kind = error.kind
+        failure.error = str(error)
+        failure.size = size or failure.size
+        failure.last_failed = now
+        failure.retry_after = now + backoff(error.kind, failure.attempts)
+        await failure.save()
+
+    # true if the file had failed before
+    async def clear(self, file_id: int) -> bool:
+        return await PalletFailure.filter(id=file_id).delete() > 0
+
+    async def report(self):
+        failures = await PalletFailure.all()
+        total_saved = sum(f.bytes_saved for f in failures)
+        log(
+            f"skipped {self.skipped} known broken files this run,"
+            f" saved {self.bytes_saved / 1e6:.1f}MB"
+            f" ({total_saved / 1e6:.1f}MB total over {len(failures)} cached failures)"
+        )
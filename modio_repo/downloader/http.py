@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import os
+from types import SimpleNamespace
+
+import aiohttp
+
+from modio_repo.metrics import metrics
+
+# connections per host. the api pool carries the modio client, file list HEADs and
+# the download redirects, the cdn pool only the archives
+HTTP_API_CONNECTIONS = int(os.getenv("HTTP_API_CONNECTIONS", "16"))
+HTTP_CDN_CONNECTIONS = int(os.getenv("HTTP_CDN_CONNECTIONS", "8"))
+# seconds an idle connection is kept open for the next request
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+# seconds a resolved host is cached
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+
+REDIRECTS = {301, 302, 303, 307, 308}
+
+
+# counts requests, new and reused connections and dns lookups per pool as
+# http_<pool>_* metrics. every new https connection is a tls handshake
+def trace_config(pool: str) -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+
+    async def request_start(session, ctx: SimpleNamespace, params):
+        ctx.https = params.url.scheme == "https"
+        metrics.inc(f"http_{pool}_requests")
+
+    async def connection_created(session, ctx: SimpleNamespace, params):
+        metrics.inc(f"http_{pool}_connections_new")
+        if getattr(ctx, "https", False):
+            metrics.inc(f"http_{pool}_tls_handshakes")
+
+    async def connection_reused(session, ctx, params):
+        metrics.inc(f"http_{pool}_connections_reused")
+
+    async def dns_resolved(session, ctx, params):
+        metrics.inc(f"http_{pool}_dns_lookups")
+
+    async def dns_cache_hit(session, ctx, params):
+        metrics.inc(f"http_{pool}_dns_cache_hits")
+
+    trace.on_request_start.append(request_start)
+    trace.on_connection_create_end.append(connection_created)
+    trace.on_connection_reuseconn.append(connection_reused)
+    trace.on_dns_resolvehost_end.append(dns_resolved)
+    trace.on_dns_cache_hit.append(dns_cache_hit)
+    return trace
+
+
+def make_session(pool: str, connections: int) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit_per_host=connections,
+        keepalive_timeout=HTTP_KEEPALIVE,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_TTL,
+    )
+    return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config(pool)])
+
+
+# all http of a run goes through these two sessions, the modio client included
+class HttpPools:
+    def __init__(self):
+        self.api = make_session("api", HTTP_API_CONNECTIONS)
+        self.cdn = make_session("cdn", HTTP_CDN_CONNECTIONS)
+
+    async def close(self):
+        await self.api.close()
+        await self.cdn.close()
+
+    async def __aenter__(self) -> HttpPools:
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import os
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, NamedTuple, Type
+
+from tortoise import Tortoise
+
+from modio_repo.models import (
+    Mod,
+    ModFileBase,
+    PalletErrorBase,
+    PalletFailure,
+    PcModFile,
+    PcPalletError,
+    QuestModFile,
+    QuestPalletError,
+)
+from modio_repo.utils import log
+
+# files without a pallet, which either have no recorded error, e.g. because a run was
+# killed by the timeout in entrypoint.sh in the middle of a download, or whose failure
+# backoff ran out. the parameter is a json list of the latter's file ids
+MISSING_PALLETS_SQL = """
+SELECT 'pc' AS platform, f.id AS file_id, f.mod_id AS mod_id, m.rank AS rank
+FROM pc_file f JOIN mod m ON m.id = f.mod_id
+WHERE NOT EXISTS (SELECT 1 FROM pc_pallet p WHERE p.file_id = f.id)
+  AND (
+    NOT EXISTS (SELECT 1 FROM pc_pallet_error e WHERE e.file_id = f.id)
+    OR f.id IN (SELECT value FROM json_each(?1))
+  )
+UNION ALL
+SELECT 'quest' AS platform, f.id AS file_id, f.mod_id AS mod_id, m.rank AS rank
+FROM quest_file f JOIN mod m ON m.id = f.mod_id
+WHERE NOT EXISTS (SELECT 1 FROM quest_pallet p WHERE p.file_id = f.id)
+  AND (
+    NOT EXISTS (SELECT 1 FROM quest_pallet_error e WHERE e.file_id = f.id)
+    OR f.id IN (SELECT value FROM json_each(?1))
+  )
+"""
+
+PLATFORM_MODELS: dict[str, tuple[Type[ModFileBase], Type[PalletErrorBase]]] = {
+    "pc": (PcModFile, PcPalletError),
+    "quest": (QuestModFile, QuestPalletError),
+}
+
+# how many missing pallets are re-downloaded per run at most
+MAX_REPAIRS_PER_RUN = int(os.getenv("MAX_PALLET_REPAIRS", "20"))
+PARALLEL_REPAIRS = 4
+
+RepairFunc = Callable[[Mod, ModFileBase, Type[PalletErrorBase]], Awaitable[None]]
+
+
+class MissingPallet(NamedTuple):
+    # sorts by rank first, so the most popular mods are repaired first
+    rank: int
+    platform: str
+    file_id: int
+    mod_id: int
+
+
+class MissingPallets:
+    def __init__(self, max_repairs: int = MAX_REPAIRS_PER_RUN):
+        self.max_repairs = max_repairs
+        self.queue: list[MissingPallet] = []
+
+    def __len__(self):
+        return len(self.queue)
+
+    async def load(self):
+        # compared by tortoise, which knows how it stores the timezone aware retry_after
+        expired = await PalletFailure.filter(
+            retry_after__lte=datetime.now(timezone.utc)
+        ).values_list("id", flat=True)
+        conn = Tortoise.get_connection("default")
+        rows = await conn.execute_query_dict(MISSING_PALLETS_SQL, [json.dumps(expired)])
+        self.queue = [
+            MissingPallet(row["rank"], row["platform"], row["file_id"], row["mod_id"])
+            for row in rows
+        ]
+        heapq.heapify(self.queue)
+        log(f"found {len(self.queue)} files without pallet")
+
+    def pop_batch(self) -> list[MissingPallet]:
+        batch = []
+        while self.queue and len(batch) < self.max_repairs:
+            batch.append(heapq.heappop(self.queue))
+        return batch
+
+    async def repair(self, repair_func: RepairFunc):
+        batch = self.pop_batch()
+        if len(batch) == 0:
+            return
+        log(f"repairing {len(batch)} missing pallets, {len(self.queue)} left queued")
+        sem = asyncio.Semaphore(PARALLEL_REPAIRS)
+
+        async def repair_one(missing: MissingPallet):
+            file_cls, error_cls = PLATFORM_MODELS[missing.platform]
+            async with sem:
+                file_ = await file_cls.get_or_none(id=missing.file_id)
+                mod = await Mod.get_cached(missing.mod_id)
+                if file_ is None or mod is None:
+                    return
+                await repair_func(mod, file_, error_cls)
+
+        results = await asyncio.gather(
+            *(repair_one(missing) for missing in batch), return_exceptions=True
+        )
+        for missing, result in zip(batch, results):
+            if isinstance(result, Exception):
+                log(f"could not repair pallet for file {missing.file_id}: {result!r}")
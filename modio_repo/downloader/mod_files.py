@@ -1,35 +1,50 @@
+import asyncio
 from datetime import datetime
+from typing import NamedTuple
 
-import aiohttp
 import modio
 from modio.client import Mod as ApiMod
 from modio.enums import TargetPlatform
-from modio.entities import ModFilePlatform
+from modio.entities import ModFile, ModFilePlatform
 
+from modio_repo.downloader.http import HttpPools
+from modio_repo.metrics import metrics
 from modio_repo.models import Mod, PcModFile, QuestModFile
 from modio_repo.utils import log
 
 def contains_targetplatforms(modplatforms: list[ModFilePlatform], targetplatforms: list[TargetPlatform]):
     return len([ modplatform for modplatform in modplatforms for targetplatform in targetplatforms if modplatform.platform == targetplatform ]) > 0
 
+# the newest file of each platform, as plain data so it can cross process boundaries
+class FileInfo(NamedTuple):
+    platform: str
+    id: int
+    added: datetime
+    url: str
+    filehash: str
+    filesize: int
+
+
 class ModFiles:
     def __init__(
-        self, mod: Mod, api_mod: ApiMod, session: aiohttp.ClientSession
+        self, mod: Mod | None, api_mod: ApiMod, http: HttpPools
     ) -> None:
         self.mod = mod
         self.api_mod = api_mod
-        self.session = session
+        self.http = http
 
-    async def insert_mod_files(self):
+    async def select_files(self) -> list[FileInfo]:
         filters = modio.Filter()
         # All endpoints are sorted by the id column in ascending order by default (oldest first). therefor, reversing key gets us the newest dl_urls
         filters.sort(key="id", reverse=True)
         filters.limit(10)
 
-        log("Getting file list from API for mod " + str(self.mod.id))
+        log("Getting file list from API for mod " + str(self.api_mod.id))
 
-        dl_urls, _ = await self.api_mod.async_get_files(filters=filters)
+        with metrics.timer("modio_file_list"):
+            dl_urls, _ = await self.api_mod.async_get_files(filters=filters)
 
+        selected = []
         need_oculus = True
         need_pc = True
         for file_data in dl_urls:
@@ -37,30 +52,54 @@ class ModFiles:
                 platforms = file_data.platforms
                 if need_oculus and contains_targetplatforms(platforms, [TargetPlatform.android, TargetPlatform.oculus]):
                     log("\tQuest: " + file_data.url)
-                    r = await self.session.head(file_data.url)
-                    mf = QuestModFile(
-                        id=file_data.id,
-                        added=datetime.fromtimestamp(file_data.date),
-                        url=r.headers["Location"],
-                        mod=self.mod,
-                    )
-                    await mf.save()
+                    selected.append(("quest", file_data))
                     need_oculus = False
 
                 if need_pc and contains_targetplatforms(platforms, [TargetPlatform.windows]):
                     log("\tPC: " + file_data.url)
-                    r = await self.session.head(file_data.url)
-                    mf = PcModFile(
-                        id=file_data.id,
-                        added=datetime.fromtimestamp(file_data.date),
-                        url=r.headers["Location"],
-                        mod=self.mod,
-                    )
-                    await mf.save()
+                    selected.append(("pc", file_data))
                     need_pc = False
+        # the HEADs of both platforms go out together
+        return list(
+            await asyncio.gather(
+                *(self.file_info(platform, file_data) for platform, file_data in selected)
+            )
+        )
+
+    async def file_info(self, platform: str, file_data: ModFile) -> FileInfo:
+        with metrics.timer("modio_head"):
+            async with self.http.api.head(file_data.url) as r:
+                location = r.headers["Location"]
+        return FileInfo(
+            platform=platform,
+            id=file_data.id,
+            added=datetime.fromtimestamp(file_data.date),
+            url=location,
+            filehash=file_data.hash,
+            filesize=file_data.size,
+        )
+
+    async def insert_mod_files(self):
+        assert self.mod is not None
+        await insert_files(self.mod, await self.select_files())
 
     async def get_quest(self) -> QuestModFile | None:
         return await self.mod.quest_file.all().first()
 
     async def get_pc(self) -> PcModFile | None:
         return await self.mod.pc_file.all().first()
+
+
+async def insert_files(mod: Mod, files: list[FileInfo]):
+    for info in files:
+        file_cls = QuestModFile if info.platform == "quest" else PcModFile
+        mf = file_cls(
+            id=info.id,
+            added=info.added,
+            url=info.url,
+            filehash=info.filehash,
+            filesize=info.filesize,
+            mod=mod,
+        )
+        await mf.save()
+        mod.set_file(info.platform, mf)
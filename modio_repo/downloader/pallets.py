@@ -5,13 +5,19 @@ import json
 from enum import Enum
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Generic, List, Tuple, Type, TypeVar
+from typing import Any, Generic, List, Sequence, Tuple, Type, TypeVar
 from zipfile import BadZipfile, ZipFile
 
 import aiofiles
 import aiohttp
+from yarl import URL
+from modio_repo import barcodes, pallet_cache, pallet_json
+from modio_repo.downloader.http import REDIRECTS, HttpPools
+from modio_repo.downloader.transfer import DOWNLOAD_RESUMES, SHORT_READ, Transfer
+from modio_repo.metrics import metrics
+from modio_repo.profiling import profiled
 from modio_repo.models import Mod, PcModFile, PcPallet, QuestModFile, QuestPallet
-from modio_repo.utils import PalletLoadError, log
+from modio_repo.utils import PalletLoadError, log, modio_api_url
 
 T = TypeVar("T", QuestModFile, PcModFile)
 
@@ -21,81 +27,120 @@ class ModPlatform(Enum):
     QUEST = 1
 
 
-class PalletHandler(Generic[T]):
-    PATH = Path("./static/pallets/")
+class PalletExtractor:
+    # downloads a mod.io file and reads its pallets, without touching the database.
+    # the sharded importer runs this in worker processes
+    PATH = pallet_cache.PALLET_DIR
     PATH.mkdir(exist_ok=True, parents=True)
 
-    def __init__(self, mod: Mod, file: T, session: aiohttp.ClientSession):
-        self.file = file
-        self.modio_file_id = file.id
-        self.mod = mod
-        self.session = session
+    def __init__(
+        self,
+        modio_file_id: int,
+        http: HttpPools,
+        filesize: int | None = None,
+        filehash: str | None = None,
+    ):
+        self.modio_file_id = modio_file_id
+        self.http = http
+        self.downloaded = 0
+        # the listed size and md5 the download is checked against
+        self.filesize = filesize
+        self.filehash = filehash
+        # md5 of the download, if it matched the listed one
+        self.verified_hash: str | None = None
 
     @property
     def path(self):
         return self.PATH / f"{self.modio_file_id}.json"
 
-    async def run(self):
-        db_pallet = await self.file.pallet.all().first()
-
-        if db_pallet is not None:
-            return db_pallet
-
-        pallet_type, web_platform = self.get_pallet_class()
+    async def extract(self, web_platform: ModPlatform) -> list[dict[str, Any]]:
         try:
-            file_obj = await self.download()
+            with metrics.timer("pallet_download"):
+                file_obj = await self.download()
         except asyncio.exceptions.TimeoutError:
-            raise PalletLoadError("Could not download mod file", -999)
-        pallet_list = await self.get_from_zip(file_obj)
+            raise PalletLoadError("Could not download mod file", -999, "download")
+        finally:
+            metrics.inc("downloads")
+            metrics.inc("download_bytes", self.downloaded)
+        with metrics.timer("zip_parse"):
+            pallet_list = await self.get_from_zip(file_obj)
 
+        pallets = []
         for zf_path, fs_path, mod_platform in pallet_list:
-            data = self.get_pallet_content(fs_path)
-
-            db_pallet = pallet_type(
-                barcode=data["barcode"],
-                author=data["author"],
-                version=data["version"],
-                sdkVersion=data["sdkVersion"],
-                zip_path=str(zf_path),
-                fs_path=str(fs_path),
-                file=self.file,
-            )
+            with metrics.timer("pallet_parse"):
+                data, crates = self.get_pallet_content(fs_path)
             if mod_platform != web_platform:
                 raise PalletLoadError(
-                    "Multiple Platforms or Platform Mismatch", self.modio_file_id
+                    "Multiple Platforms or Platform Mismatch",
+                    self.modio_file_id,
+                    "platform",
                 )
-            await db_pallet.save()
+            pallets.append(
+                {
+                    "barcode": data["barcode"],
+                    "author": data["author"],
+                    "version": data["version"],
+                    "sdkVersion": data["sdkVersion"],
+                    "zip_path": str(zf_path),
+                    "fs_path": str(fs_path),
+                    "crates": crates,
+                }
+            )
+        return pallets
 
-    def get_pallet_class(self) -> Tuple[Type[QuestPallet | PcPallet], ModPlatform]:
-        if isinstance(self.file, QuestModFile):
-            return QuestPallet, ModPlatform.QUEST
-        elif isinstance(self.file, PcModFile):
-            return PcPallet, ModPlatform.PCVR
-        else:
-            raise NotImplementedError("Unknown File ORM Model passed!")
-
-    async def download(self):
-        async with self.session.get(
-            f"https://api.mod.io/mods/file/{str(self.modio_file_id)}"
-        ) as response:
+    async def download(self) -> BytesIO:
+        transfer = Transfer(self.modio_file_id, self.filesize, self.filehash)
+        try:
+            await self.transfer(transfer)
+            memoryfile = transfer.finish()
+        finally:
+            self.downloaded = transfer.transferred
+        self.verified_hash = transfer.verified
+        log("done downloading, extracting zip in memory")
+        return memoryfile
+
+    async def transfer(self, transfer: Transfer):
+        url = f"{modio_api_url()}/mods/file/{str(self.modio_file_id)}"
+        async with self.http.api.get(url, allow_redirects=False) as response:
+            if response.status not in REDIRECTS:
+                await self.read(response, transfer)
+                return
+            location = response.url.join(URL(response.headers["Location"]))
+        # the api redirects to the cdn, which has its own pool. a transfer that
+        # ends short continues where it stopped
+        for attempt in range(DOWNLOAD_RESUMES + 1):
+            if attempt:
+                metrics.inc("download_resumes")
+                log(f"resuming download of {self.modio_file_id} at {transfer.received}")
             try:
-                response.raise_for_status()
-            except aiohttp.ClientError as e:
-                raise PalletLoadError("Could not open mod file url", self.modio_file_id)
+                async with self.http.cdn.get(
+                    location, headers=transfer.resume_headers()
+                ) as response:
+                    await self.read(response, transfer)
+            except SHORT_READ as e:
+                log(f"download of {self.modio_file_id} ended short: {type(e).__name__}")
+            if transfer.complete:
+                return
 
-            memoryfile = BytesIO()
-            log("downloading pallet", self.modio_file_id)
-            async for data in response.content.iter_chunked(8192):
-                memoryfile.write(data)
-            log("done downloading, extracting zip in memory")
+    async def read(self, response: aiohttp.ClientResponse, transfer: Transfer):
+        try:
+            response.raise_for_status()
+        except aiohttp.ClientError as e:
+            raise PalletLoadError(
+                "Could not open mod file url", self.modio_file_id, "download"
+            )
 
-            return memoryfile
+        log("downloading pallet", self.modio_file_id)
+        transfer.start(response)
+        async for data in response.content.iter_chunked(8192):
+            transfer.write(data)
+        transfer.ended = True
 
     async def get_from_zip(self, file_like) -> List[Tuple[Path, Path, ModPlatform]]:
         try:
             zf = ZipFile(file_like)
         except BadZipfile as e:
-            raise PalletLoadError(str(e), self.modio_file_id)
+            raise PalletLoadError(str(e), self.modio_file_id, "bad_zip")
 
         try:
             file_list = zf.infolist()
@@ -115,6 +160,7 @@ class PalletHandler(Generic[T]):
                 raise PalletLoadError(
                     "pallet.json not found in zip.",
                     self.modio_file_id,
+                    "format",
                 )
             return found_pallets
         except NotImplementedError as e:
@@ -147,42 +193,110 @@ class PalletHandler(Generic[T]):
                 "Unknown Errror",
                 self.modio_file_id,
             ) from e
-        raise PalletLoadError("Could not determine mod platform", self.modio_file_id)
+        raise PalletLoadError(
+            "Could not determine mod platform", self.modio_file_id, "platform"
+        )
 
-    def get_pallet_content(self, file: Path) -> dict[str, Any]:
-        with file.open("r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except UnicodeDecodeError:
-                print(file.resolve())
-                raise PalletLoadError("Pallet is not UTF-8", self.modio_file_id)
-            return self._read_pallet_content(data)
+    def get_pallet_content(self, file: Path) -> tuple[dict[str, Any], list[dict[str, str]]]:
+        try:
+            manifest = pallet_json.read(file)
+        except UnicodeDecodeError:
+            log(f"pallet of file {self.modio_file_id} is not UTF-8: {file.resolve()}")
+            raise PalletLoadError(
+                "Pallet is not UTF-8", self.modio_file_id, "encoding"
+            )
+        except json.JSONDecodeError as e:
+            raise PalletLoadError(
+                f"Pallet is not valid json: {e}", self.modio_file_id, "format"
+            )
+        return self._read_pallet_content(manifest), pallet_json.crates(manifest)
 
-    def _read_pallet_content(self, data: dict[Any, Any]):
-        types = data.get("types")
-        if types is None:
-            raise PalletLoadError('Could not find "types" in json', self.modio_file_id)
+    def _read_pallet_content(self, manifest: pallet_json.Manifest):
+        if manifest.types is None:
+            raise PalletLoadError(
+                'Could not find "types" in json', self.modio_file_id, "format"
+            )
 
         pallet_key = None
 
-        for key, typ in types.items():
-            if "SLZ.Marrow.Warehouse.Pallet" in typ["fullname"]:
+        for key, fullname in manifest.types.items():
+            if pallet_json.PALLET_TYPE in fullname:
                 pallet_key = key
 
         if pallet_key is None:
             raise PalletLoadError(
-                "Could not find key for SLZ.Marrow.Warehouse.Pallet", self.modio_file_id
+                "Could not find key for SLZ.Marrow.Warehouse.Pallet",
+                self.modio_file_id,
+                "format",
             )
 
         pallet_obj = None
 
-        for obj in data["objects"].values():
-            if obj["isa"]["type"] == pallet_key:
+        for obj in manifest.objects.values():
+            if obj["isa"] == pallet_key:
                 pallet_obj = obj
 
         if pallet_obj is None:
             raise PalletLoadError(
-                f"No object with key {pallet_key} found in pallet.", self.modio_file_id
+                f"No object with key {pallet_key} found in pallet.",
+                self.modio_file_id,
+                "format",
             )
 
         return pallet_obj
+
+
+class PalletHandler(PalletExtractor, Generic[T]):
+    def __init__(self, mod: Mod, file: T, http: HttpPools):
+        super().__init__(file.id, http, file.filesize, file.filehash)
+        self.file = file
+        self.mod = mod
+
+    @profiled("PalletHandler.run")
+    async def run(self):
+        db_pallets = await self.file.get_pallets()
+
+        if db_pallets:
+            return db_pallets[0]
+
+        pallet_type, web_platform = self.get_pallet_class()
+        if await pallet_cache.restore(self.file, pallet_type):
+            return
+
+        pallets = await self.extract(web_platform)
+        await insert_pallets(self.file, pallets, self.verified_hash)
+
+    def get_pallet_class(self) -> Tuple[Type[QuestPallet | PcPallet], ModPlatform]:
+        return pallet_class(self.file)
+
+
+def pallet_class(file: PcModFile | QuestModFile) -> Tuple[Type[QuestPallet | PcPallet], ModPlatform]:
+    if isinstance(file, QuestModFile):
+        return QuestPallet, ModPlatform.QUEST
+    elif isinstance(file, PcModFile):
+        return PcPallet, ModPlatform.PCVR
+    else:
+        raise NotImplementedError("Unknown File ORM Model passed!")
+
+
+async def insert_pallets(
+    file: PcModFile | QuestModFile,
+    pallet_data: Sequence[dict[str, Any]],
+    verified_hash: str | None = None,
+):
+    pallet_type, _ = pallet_class(file)
+    crates = [data.get("crates", []) for data in pallet_data]
+    if verified_hash is not None:
+        file.verified_hash = verified_hash  # type: ignore
+        await file.save(update_fields=["verified_hash"])
+    pallets = []
+    for data in pallet_data:
+        db_pallet = pallet_type(
+            file=file, **{k: v for k, v in data.items() if k != "crates"}
+        )
+        await db_pallet.save()
+        pallets.append(db_pallet)
+        metrics.inc("pallets_inserted")
+    file.set_pallets(pallets)
+    await barcodes.index_pallets(file, pallets, crates)
+    await pallet_cache.store(file, pallets, crates)
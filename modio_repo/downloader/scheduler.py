@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Generic, NamedTuple, TypeVar
+
+from modio_repo.utils import log, parse_size
+
+T = TypeVar("T")
+
+# a mod not fully refreshed for this long gets the whole staleness weight
+STALE_AFTER = timedelta(days=7)
+# archives of this size get half the size weight
+SIZE_SCALE = 50 * 1024**2
+
+
+class Weights(NamedTuple):
+    rank: float = 4.0
+    downloads: float = 1.0
+    staleness: float = 1.0
+    size: float = 2.0
+
+
+# SCHEDULE_WEIGHTS="rank=4,downloads=1,staleness=1,size=2", missing ones keep the default
+def parse_weights(spec: str) -> Weights:
+    weights = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        if name.strip() not in Weights._fields:
+            raise ValueError(f"unknown schedule weight {name}, known: {Weights._fields}")
+        weights[name.strip()] = float(value)
+    return Weights(**weights)
+
+
+SCHEDULE_WEIGHTS = parse_weights(os.getenv("SCHEDULE_WEIGHTS", ""))
+# bytes downloaded per cycle before the remaining work waits for the next one, 0 is no limit
+CYCLE_BYTE_BUDGET = parse_size(os.getenv("CYCLE_BYTE_BUDGET", "0"))
+
+
+def priority(
+    weights: Weights,
+    rank: int,
+    downloads: int,
+    last_checked: datetime | None,
+    size: int,
+    now: datetime,
+) -> float:
+    # rank 1 is 1.0, rank 1000 about 0.1, unranked 0
+    rank_term = 1 / math.log2(rank + 1) if rank > 0 else 0.0
+    # 10 million downloads is 1.0
+    downloads_term = min(math.log10(max(downloads, 0) + 1) / 7, 1.0)
+    if last_checked is None:
+        staleness_term = 1.0
+    else:
+        if last_checked.tzinfo is None:
+            last_checked = last_checked.replace(tzinfo=timezone.utc)
+        staleness_term = min((now - last_checked) / STALE_AFTER, 1.0)
+    size_term = 1 / (1 + size / SIZE_SCALE)
+    return (
+        weights.rank * rank_term
+        + weights.downloads * downloads_term
+        + weights.staleness * staleness_term
+        + weights.size * size_term
+    )
+
+
+class Scheduled(NamedTuple):
+    # negated, heapq pops the smallest
+    priority: float
+    seq: int
+    size: int
+    item: Any
+
+
+# orders the download and parse work of a cycle, most visible and cheapest first,
+# and holds back what doesn't fit in the byte budget
+class Scheduler(Generic[T]):
+    def __init__(
+        self,
+        spent: Callable[[], float],
+        budget: int = CYCLE_BYTE_BUDGET,
+        weights: Weights = SCHEDULE_WEIGHTS,
+    ):
+        self.spent = spent
+        self.budget = budget
+        self.weights = weights
+        self.queue: list[Scheduled] = []
+        self.seq = itertools.count()
+        self.deferred: list[T] = []
+        self.now = datetime.now(timezone.utc)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(
+        self,
+        item: T,
+        rank: int,
+        downloads: int,
+        last_checked: datetime | None,
+        size: int,
+    ):
+        score = priority(self.weights, rank, downloads, last_checked, size, self.now)
+        heapq.heappush(self.queue, Scheduled(-score, next(self.seq), size, item))
+
+    def pop(self) -> T | None:
+        while self.queue:
+            scheduled = heapq.heappop(self.queue)
+            if self.budget and self.spent() + scheduled.size > self.budget:
+                # smaller items further down may still fit
+                self.deferred.append(scheduled.item)
+                continue
+            return scheduled.item
+        return None
+
+    def report(self):
+        if self.deferred:
+            log(
+                f"byte budget of {self.budget / 1024**2:.1f}MB used up,"
+                f" {len(self.deferred)} mods wait for the next run"
+            )
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import queue
+import traceback
+from datetime import datetime, timezone
+from typing import Any, NamedTuple, Sequence
+
+import modio
+from modio.client import Mod as ApiMod
+from modio.enums import Visibility
+
+from modio_repo.downloader import (
+    ModSkip,
+    Run,
+    each_platform,
+    make_client,
+    mod_changed,
+    mod_fields,
+    stats_fields,
+)
+from modio_repo import pallet_cache
+from modio_repo.downloader.http import HttpPools
+from modio_repo.downloader.missing_pallets import PLATFORM_MODELS
+from modio_repo.downloader.mod_files import FileInfo, ModFiles, insert_files
+from modio_repo.downloader.pallets import (
+    ModPlatform,
+    PalletExtractor,
+    insert_pallets,
+    pallet_class,
+)
+from modio_repo.downloader.scheduler import CYCLE_BYTE_BUDGET, Scheduler
+from modio_repo.listing import refresh_listing
+from modio_repo.metrics import metrics
+from modio_repo.models import Mod, PalletCache, PalletFailure, PcModFile, QuestModFile
+from modio_repo.profiling import profiled
+from modio_repo.utils import PalletLoadError, log
+
+# INGEST_WORKERS=4 splits the mod.io pages over 4 processes which do all the http
+# and zip work. the database is only written by the main process
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+PAGE_SIZE = 100
+# pages a worker works on at once, like par_download_sem for the single process run
+PAGES_PER_WORKER = int(os.getenv("INGEST_PAGES_PER_WORKER", "8"))
+
+PLATFORMS = {"pc": ModPlatform.PCVR, "quest": ModPlatform.QUEST}
+
+
+# what the workers need to know about the database, read once by the writer
+class Snapshot(NamedTuple):
+    # mod id -> (mod_updated, last file change, last_checked)
+    mods: dict[int, tuple[datetime, datetime | None, datetime]]
+    # file id -> error and size of files still in backoff after a failed extraction
+    failures: dict[int, tuple[str, int]]
+    # (file id, platform) -> filehash of pallets in the pallet cache
+    cached: dict[tuple[int, str], str | None]
+
+
+class FileResult(NamedTuple):
+    info: FileInfo
+    # parsed, cached, failed or skipped (known broken)
+    outcome: str
+    # defaults are shared by every instance, so none of them is mutable
+    pallets: Sequence[dict[str, Any]] = ()
+    error: str = ""
+    kind: str = "unknown"
+    size: int = 0
+    verified_hash: str | None = None
+
+
+class ModResult(NamedTuple):
+    # delete, stats or mod
+    op: str
+    mod_id: int
+    name: str
+    # None for deletes
+    fields: dict[str, Any] | None = None
+    files: Sequence[FileResult] = ()
+
+
+async def load_snapshot() -> Snapshot:
+    mods: dict[int, tuple[datetime, datetime | None, datetime]] = {}
+    last_change: dict[int, datetime] = {}
+    for file_cls in (PcModFile, QuestModFile):
+        for mod_id, added in await file_cls.all().values_list("mod_id", "added"):
+            if mod_id not in last_change or added > last_change[mod_id]:
+                last_change[mod_id] = added
+    for mod_id, mod_updated, last_checked in await Mod.all().values_list(
+        "id", "mod_updated", "last_checked"
+    ):
+        mods[mod_id] = (mod_updated, last_change.get(mod_id), last_checked)
+
+    now = datetime.now(timezone.utc)
+    failures = {
+        file_id: (error, size)
+        for file_id, error, size in await PalletFailure.filter(
+            retry_after__gt=now
+        ).values_list("id", "error", "size")
+    }
+    cached = {
+        (file_id, platform): filehash
+        for file_id, platform, filehash in await PalletCache.all().values_list(
+            "file_id", "platform", "filehash"
+        )
+    }
+    return Snapshot(mods, failures, cached)  # type: ignore
+
+
+class ShardWorker:
+    def __init__(
+        self, shard: int, shards: int, snapshot: Snapshot, results, onepage: bool
+    ):
+        self.shard = shard
+        self.shards = shards
+        self.snapshot = snapshot
+        self.results = results
+        self.onepage = onepage
+        self.seen: set[int] = set()
+        # every worker gets its share of the byte budget
+        self.scheduler: Scheduler[ApiMod] = Scheduler(
+            self.bytes_spent, CYCLE_BYTE_BUDGET // shards
+        )
+
+    def bytes_spent(self) -> float:
+        return metrics.counters["download_bytes"]
+
+    async def run(self):
+        async with HttpPools() as http:
+            self.http = http
+            client = make_client(http)
+            game = await client.async_get_game(3809)  # 3809 = bonelab
+
+            sem = asyncio.Semaphore(PAGES_PER_WORKER)
+            tasks = []
+            page = self.shard
+            while not (self.onepage and page > 0):
+                filters = modio.Filter()
+                filters.offset(page * PAGE_SIZE)
+                filters.limit(PAGE_SIZE)
+                async with sem:
+                    with metrics.timer("modio_pagination"):
+                        mods, pagination = await game.async_get_mods(filters=filters)
+                metrics.inc("modio_pages")
+                self.seen.update(api_mod.id for api_mod in mods)
+                if mods:
+                    tasks.append(asyncio.create_task(self.process_page(mods, sem)))
+                if not mods or pagination.max():
+                    break
+                page += self.shards
+            await asyncio.gather(*tasks)
+            await self.run_scheduled()
+
+    async def process_page(self, mods: list[ApiMod], sem: asyncio.Semaphore):
+        async with sem:
+            results = []
+            for api_mod in mods:
+                if api_mod.visible.value == Visibility.hidden.value:
+                    results.append(ModResult("delete", api_mod.id, api_mod.name))
+                    continue
+                known = self.snapshot.mods.get(api_mod.id)
+                if known is not None and not mod_changed(api_mod, *known[:2]):
+                    results.append(
+                        ModResult("stats", api_mod.id, api_mod.name, stats_fields(api_mod))
+                    )
+                    continue
+                if known is not None:
+                    log(f"Mod has changed, updating and re-downloading {api_mod.name}")
+                self.scheduler.push(
+                    api_mod,
+                    api_mod.stats.rank,
+                    api_mod.stats.downloads,
+                    known[2] if known is not None else None,
+                    api_mod.file.size if api_mod.file is not None else 0,
+                )
+            await self.put(results)
+
+    # blocks when the writer falls behind, so workers can't run away
+    async def put(self, results: list[ModResult]):
+        if results:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.results.put, ("mods", results)
+            )
+
+    # the downloads, in priority order after all pages of the shard are known
+    async def run_scheduled(self):
+        metrics.inc("scheduled_mods", len(self.scheduler))
+        await asyncio.gather(*(self.scheduled_worker() for _ in range(PAGES_PER_WORKER)))
+        # known mods keep their old files until the next run, new ones wait
+        await self.put(
+            [
+                ModResult("stats", api_mod.id, api_mod.name, stats_fields(api_mod))
+                for api_mod in self.scheduler.deferred
+                if api_mod.id in self.snapshot.mods
+            ]
+        )
+        metrics.inc("deferred_mods", len(self.scheduler.deferred))
+        self.scheduler.report()
+
+    async def scheduled_worker(self):
+        while (api_mod := self.scheduler.pop()) is not None:
+            try:
+                await self.put([await self.process_mod(api_mod)])
+            except Exception as e:
+                traceback.print_exc()
+                log(e, " in ", api_mod.name)
+
+    async def process_mod(self, api_mod: ApiMod) -> ModResult:
+        with metrics.timer("mod_files"):
+            files = await ModFiles(None, api_mod, self.http).select_files()
+            # same order as Run.insert_mod_files, pc first
+            files.sort(key=lambda info: info.platform != "pc")
+            results = await each_platform(self.process_file(info) for info in files)
+        return ModResult("mod", api_mod.id, api_mod.name, mod_fields(api_mod), results)
+
+    async def process_file(self, info: FileInfo) -> FileResult:
+        if info.id in self.snapshot.failures:
+            error, size = self.snapshot.failures[info.id]
+            return FileResult(info, "skipped", error=error, size=size)
+
+        key = (info.id, info.platform)
+        if key in self.snapshot.cached and self.snapshot.cached[key] in (
+            None,
+            info.filehash,
+        ):
+            return FileResult(info, "cached")
+
+        extractor = PalletExtractor(info.id, self.http, info.filesize, info.filehash)
+        try:
+            pallets = await extractor.extract(PLATFORMS[info.platform])
+        except PalletLoadError as e:
+            return FileResult(info, "failed", (), str(e), e.kind, extractor.downloaded)
+        return FileResult(
+            info, "parsed", pallets, verified_hash=extractor.verified_hash
+        )
+
+
+def run_worker(shard: int, shards: int, snapshot: Snapshot, results, onepage: bool):
+    worker = ShardWorker(shard, shards, snapshot, results, onepage)
+    asyncio.run(worker.run())
+    results.put(("done", shard, metrics.snapshot(), worker.seen))
+
+
+# the single writer: applies what the workers found, in the order it arrives
+class ShardedRun(Run):
+    def __init__(self, http: HttpPools, workers: int):
+        super().__init__(http)
+        self.workers = workers
+
+    @profiled("Run.run")
+    async def run(self, onepage: bool = False):
+        snapshot = await load_snapshot()
+        log(f"starting {self.workers} ingestion workers")
+        ctx = multiprocessing.get_context("spawn")
+        results = ctx.Queue(maxsize=self.workers * 2)
+        procs = [
+            ctx.Process(
+                target=run_worker,
+                args=(shard, self.workers, snapshot, results, onepage),
+                daemon=True,
+            )
+            for shard in range(self.workers)
+        ]
+        for proc in procs:
+            proc.start()
+
+        running = set(range(self.workers))
+        # a worker that died leaves a gap in the seen mods, no sweep then
+        self.complete = not onepage
+        loop = asyncio.get_running_loop()
+        while running:
+            try:
+                message = await loop.run_in_executor(None, results.get, True, 1)
+            except queue.Empty:
+                for shard in list(running):
+                    if not procs[shard].is_alive():
+                        log(f"ingestion worker {shard} died: {procs[shard].exitcode}")
+                        running.discard(shard)
+                        self.complete = False
+                continue
+            if message[0] == "done":
+                _, shard, snapshot_metrics, seen = message
+                metrics.merge(snapshot_metrics)
+                self.seen.update(seen)
+                running.discard(shard)
+                continue
+            for result in message[1]:
+                await self.apply(result)
+
+        for proc in procs:
+            proc.join()
+        await self.finish()
+
+    async def apply(self, result: ModResult):
+        metrics.inc("mods_processed")
+        try:
+            if result.op == "delete":
+                await self.delete_mod_id(result.mod_id)
+                log(f"Deleted invisible mod {result.name}")
+            elif result.op == "stats":
+                await self.save_stats(result.mod_id, result.fields or {})
+            else:
+                await self.apply_mod(result)
+        except ModSkip:
+            log("Skipped ", result.name)
+        except Exception as e:
+            traceback.print_exc()
+            log(e, " in ", result.name)
+
+    async def apply_mod(self, result: ModResult):
+        mod = await self.save_mod(result.mod_id, result.fields or {})
+        try:
+            await insert_files(mod, [f.info for f in result.files])
+            await each_platform(self.apply_file(mod, f) for f in result.files)
+        finally:
+            await refresh_listing(mod.id)
+
+    async def apply_file(self, mod: Mod, result: FileResult):
+        platform = result.info.platform
+        _, error_cls = PLATFORM_MODELS[platform]
+        file = await (mod.get_pc_file() if platform == "pc" else mod.get_quest_file())
+        assert file is not None
+
+        if result.outcome == "parsed":
+            await insert_pallets(file, result.pallets, result.verified_hash)
+            if await self.failures.clear(file.id):
+                await self.clear_malformed(mod, file, error_cls)
+        elif result.outcome == "cached":
+            if not await pallet_cache.restore(file, pallet_class(file)[0]):
+                log(f"cached pallets of {file.id} are gone, left for the repair queue")
+        elif result.outcome == "skipped":
+            # the worker found the backoff, there's nothing to download here
+            await self.failures.count_skip(file.id, result.size)
+            await self.skip_failed(mod, file, error_cls, result.error, result.size)
+        elif result.outcome == "failed":
+            error = PalletLoadError(result.error, file.id, result.kind)
+            await self.failures.record(file.id, error, result.size)
+            await self.mark_malformed(mod, file, error_cls, result.error)
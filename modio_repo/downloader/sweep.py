@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from tortoise.transactions import in_transaction
+
+from modio_repo import barcodes
+from modio_repo.identity import identity
+from modio_repo.metrics import metrics
+from modio_repo.models import (
+    Mod,
+    PalletCache,
+    PalletFailure,
+    PcModFile,
+    PcPallet,
+    QuestModFile,
+    QuestPallet,
+)
+from modio_repo.utils import log
+
+# a sweep that would delete more than this fraction of the known mods is most
+# likely based on a broken listing from mod.io, and is skipped
+SWEEP_MAX_FRACTION = float(os.getenv("SWEEP_MAX_FRACTION", "0.1"))
+# catalogs up to this size are swept without the fraction check
+SWEEP_MIN_MODS = int(os.getenv("SWEEP_MIN_MODS", "20"))
+
+
+# mods the database knows but a complete pass over the mod.io listing didn't return
+# have been deleted there. they're removed together, with everything hanging off them
+async def sweep_deleted(seen: set[int], max_fraction: float = SWEEP_MAX_FRACTION):
+    known = set(await Mod.all().values_list("id", flat=True))
+    stale = sorted(known - seen)
+    metrics.set("sweep_stale_mods", len(stale))
+    if not stale:
+        return
+    if len(known) > SWEEP_MIN_MODS and len(stale) > len(known) * max_fraction:
+        log(
+            f"not deleting {len(stale)} of {len(known)} mods missing from mod.io,"
+            f" more than {max_fraction:.0%}, the listing was probably incomplete"
+        )
+        metrics.inc("sweep_aborted")
+        return
+
+    await delete_mods(stale)
+    metrics.inc("mods_deleted", len(stale))
+    log(f"deleted {len(stale)} mods no longer on mod.io: {stale}")
+
+
+# removes mods together with everything hanging off them, in the database and the
+# manifests on disk, cached pallets of their files included
+async def delete_mods(mod_ids: list[int]):
+    file_ids: list[int] = []
+    manifests: list[str] = []
+    for file_cls, pallet_cls in ((PcModFile, PcPallet), (QuestModFile, QuestPallet)):
+        ids = await file_cls.filter(mod_id__in=mod_ids).values_list("id", flat=True)
+        file_ids.extend(ids)  # type: ignore
+        manifests.extend(
+            await pallet_cls.filter(file_id__in=ids).values_list("fs_path", flat=True)  # type: ignore
+        )
+    manifests.extend(
+        await PalletCache.filter(file_id__in=file_ids).values_list("fs_path", flat=True)  # type: ignore
+    )
+
+    async with in_transaction():
+        await barcodes.forget_mods(mod_ids)
+        # files, pallets, pallet errors and listings go with the mod (on delete cascade)
+        await Mod.filter(id__in=mod_ids).delete()
+        await PalletFailure.filter(id__in=file_ids).delete()
+        await PalletCache.filter(file_id__in=file_ids).delete()
+
+    for mod_id in mod_ids:
+        identity.forget_mod(mod_id)
+    for manifest in set(manifests):
+        Path(manifest).unlink(missing_ok=True)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import hashlib
+import os
+from io import BytesIO
+
+import aiohttp
+
+from modio_repo.metrics import metrics
+from modio_repo.utils import PalletLoadError
+
+# requests that continue a transfer which ended short, with a Range header
+DOWNLOAD_RESUMES = int(os.getenv("DOWNLOAD_RESUMES", "3"))
+
+# what a transfer ending early looks like to aiohttp
+SHORT_READ = (
+    aiohttp.ClientPayloadError,
+    aiohttp.ServerDisconnectedError,
+    aiohttp.ClientOSError,
+)
+
+
+# one archive on its way into memory, checked against the size and md5 mod.io
+# lists for the file while it streams. either may be unknown (None) for files
+# inserted before they were stored, then only what is known is checked
+class Transfer:
+    def __init__(self, file_id: int, filesize: int | None, filehash: str | None):
+        self.file_id = file_id
+        self.filesize = filesize
+        self.filehash = filehash or None
+        self.buffer = BytesIO()
+        self.md5 = hashlib.md5()
+        # bytes over the wire, restarts and resumes included
+        self.transferred = 0
+        # the last response was read to its end
+        self.ended = False
+        self.verified: str | None = None
+
+    @property
+    def received(self) -> int:
+        return self.buffer.tell()
+
+    @property
+    def complete(self) -> bool:
+        return self.ended and (self.filesize is None or self.received == self.filesize)
+
+    def resume_headers(self) -> dict[str, str] | None:
+        if not self.received:
+            return None
+        return {"Range": f"bytes={self.received}-"}
+
+    def start(self, response: aiohttp.ClientResponse):
+        self.ended = False
+        if self.received and response.status != 206:
+            # the server ignored the range, the body is the whole file again
+            metrics.inc("download_restarts")
+            self.buffer = BytesIO()
+            self.md5 = hashlib.md5()
+        if self.filesize is not None and response.content_length is not None:
+            expected = self.filesize - self.received
+            if response.content_length != expected:
+                self.size_mismatch(self.received + response.content_length)
+
+    def write(self, data: bytes):
+        self.transferred += len(data)
+        if self.filesize is not None and self.received + len(data) > self.filesize:
+            self.size_mismatch(self.received + len(data))
+        self.buffer.write(data)
+        self.md5.update(data)
+
+    def size_mismatch(self, size: int):
+        metrics.inc("download_size_mismatches")
+        raise PalletLoadError(
+            f"Download size {size} does not match the listed {self.filesize} bytes",
+            self.file_id,
+            "size",
+        )
+
+    def finish(self) -> BytesIO:
+        if not self.complete:
+            raise PalletLoadError(
+                f"Download ended after {self.received} of {self.filesize} bytes",
+                self.file_id,
+                "download",
+            )
+        digest = self.md5.hexdigest()
+        if self.filehash is not None and digest != self.filehash:
+            metrics.inc("download_checksum_mismatches")
+            raise PalletLoadError(
+                f"Download md5 {digest} does not match the listed {self.filehash}",
+                self.file_id,
+                "checksum",
+            )
+        if self.filehash is not None:
+            metrics.inc("downloads_verified")
+            self.verified = digest
+        return self.buffer
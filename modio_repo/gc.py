@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from modio_repo import pallet_cache
+from modio_repo.metrics import metrics
+from modio_repo.models import PcPallet, QuestPallet
+from modio_repo.utils import log
+
+
+async def delete_old_pallets():
+    with metrics.timer("pallet_gc"):
+        await pallet_cache.prune()
+        pallets: list[PcPallet | QuestPallet] = []
+        pallets.extend(await QuestPallet.all())
+        pallets.extend(await PcPallet.all())
+
+        paths = {Path(pallet.fs_path).resolve() for pallet in pallets}
+        # manifests of cached pallets are reused when their file comes back
+        paths.update(Path(path).resolve() for path in await pallet_cache.cached_paths())
+        for pallet_file in pallet_cache.PALLET_DIR.glob("*.json"):
+            if pallet_file.resolve() not in paths:
+                pallet_file.unlink()
+                log(f"Expunged {pallet_file.relative_to(Path())}")
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Hashable, TypeVar
+
+from modio_repo.metrics import metrics
+
+if TYPE_CHECKING:
+    from modio_repo.models import Mod, ModFileBase, PalletBase
+
+V = TypeVar("V")
+
+
+# one instance per mod id and one lookup per relation for the whole run (sync and
+# build), instead of querying the same files and pallets again in every step.
+# everything that writes those relations has to keep this up to date:
+# Mod.remember, Mod.clear_files, Mod.set_file, ModFileBase.set_pallets and forget_mod
+class IdentityMap:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.mods: dict[int, Mod | None] = {}
+        # (mod id, "pc" | "quest") -> file
+        self.files: dict[tuple[int, str], ModFileBase | None] = {}
+        # (file table, file id) -> pallets
+        self.pallets: dict[tuple[str, int], list[PalletBase]] = {}
+
+    async def lookup(
+        self, cache: dict[Any, V], key: Hashable, load: Callable[[], Awaitable[V]]
+    ) -> V:
+        if key in cache:
+            metrics.inc("identity_hits")
+            return cache[key]
+        metrics.inc("identity_misses")
+        value = cache[key] = await load()
+        return value
+
+    def forget_mod(self, mod_id: int):
+        self.mods.pop(mod_id, None)
+        self.forget_files(mod_id)
+
+    def forget_files(self, mod_id: int):
+        for platform in ("pc", "quest"):
+            file = self.files.pop((mod_id, platform), None)
+            if file is not None:
+                self.pallets.pop((file._meta.db_table, file.id), None)  # type: ignore
+
+
+identity = IdentityMap()
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+from modio_repo.models import Listing, Mod, PcPallet, QuestPallet
+from modio_repo.utils import log
+
+
+# recompute the listing of one mod from its files and pallets.
+# mods without any pallet are not publishable and lose their listing
+async def refresh_listing(mod_id: int) -> Listing | None:
+    mod = await Mod.get_cached(mod_id)
+    if mod is None:
+        return None
+
+    pc_file = await mod.get_pc_file()
+    quest_file = await mod.get_quest_file()
+
+    pallets: list[PcPallet | QuestPallet] = []
+    if pc_file is not None:
+        pallets.extend(await pc_file.get_pallets())
+    if quest_file is not None:
+        pallets.extend(await quest_file.get_pallets())
+
+    if len(pallets) == 0:
+        await Listing.filter(mod_id=mod.id).delete()
+        return None
+
+    # one listing per mod: the first pallet of the pc file, or of the quest file if
+    # there's no pc one, stands for the mod. mark_duplicate_pallets flags files
+    # with several pallets of the same barcode
+    pallet = pallets[0]
+    listing, _ = await Listing.update_or_create(
+        mod_id=mod.id,
+        defaults={
+            "name": mod.name,
+            "description": mod.description,
+            "thumbnailUrl": mod.thumbnailUrl,
+            "rank": mod.rank,
+            "downloads": mod.downloads,
+            "tags": mod.tags,
+            "nsfw": mod.nsfw,
+            "malformed_pallet": mod.malformed_pallet,
+            "barcode": pallet.barcode,
+            "author": pallet.author,
+            "version": pallet.version,
+            "sdkVersion": pallet.sdkVersion,
+            "manifest_file_id": pallet.file_id,  # type: ignore
+            "pc_url": pc_file.url if pc_file is not None else None,
+            "quest_url": quest_file.url if quest_file is not None else None,
+        },
+    )
+    return listing
+
+
+# the mod columns changed but its files did not, no need to look at pallets
+async def update_listing_stats(mod: Mod):
+    await Listing.filter(mod_id=mod.id).update(
+        name=mod.name,
+        description=mod.description,
+        thumbnailUrl=mod.thumbnailUrl,
+        rank=mod.rank,
+        downloads=mod.downloads,
+        tags=mod.tags,
+        nsfw=mod.nsfw,
+        malformed_pallet=mod.malformed_pallet,
+    )
+
+
+async def rebuild_listings():
+    mod_ids = await Mod.all().values_list("id", flat=True)
+    log(f"rebuilding listings for {len(mod_ids)} mods")
+    for mod_id in mod_ids:
+        await refresh_listing(mod_id)  # type: ignore
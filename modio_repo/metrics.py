@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+METRICS_JSON_PATH = Path(os.getenv("METRICS_JSON_PATH", "./static/metrics.json"))
+# point this at the node_exporter textfile collector directory in production
+METRICS_PROM_PATH = Path(os.getenv("METRICS_PROM_PATH", "./static/metrics.prom"))
+PROM_PREFIX = "modio_repo"
+# counting queries turns on tortoise's debug logging of every statement,
+# so it's only done when asked for, e.g. by the benchmark
+METRICS_DB_QUERIES = os.getenv("METRICS_DB_QUERIES", "") == "1"
+
+
+class Timer:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+# the client also logs connection setup and the like, only these are queries
+SQL_VERBS = frozenset(
+    (
+        "select", "insert", "update", "delete", "replace", "pragma", "begin",
+        "commit", "rollback", "savepoint", "release", "create", "alter", "drop",
+        "with",
+    )
+)
+
+
+# counts every statement tortoise sends to the database, by its sql verb
+class QueryCounter(logging.Handler):
+    def __init__(self, metrics: Metrics):
+        super().__init__(logging.DEBUG)
+        self.metrics = metrics
+
+    def emit(self, record: logging.LogRecord):
+        query = record.msg if not record.args else record.args[0]
+        verb = str(query).lstrip().split(None, 1)[0:1]
+        if verb and verb[0].lower() in SQL_VERBS:
+            self.metrics.inc(f"db_queries_{verb[0].lower()}")
+
+
+class Metrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.counters: defaultdict[str, float] = defaultdict(float)
+        self.gauges: dict[str, float] = {}
+        self.timers: defaultdict[str, Timer] = defaultdict(Timer)
+
+    def inc(self, name: str, value: float = 1):
+        self.counters[name] += value
+
+    def set(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def set_max(self, name: str, value: float):
+        if value > self.gauges.get(name, 0):
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        self.timers[name].observe(seconds)
+
+    # works around sync and async code alike, the time spent awaiting is included
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name].observe(time.perf_counter() - start)
+
+    # add up the snapshot of another process, e.g. an ingestion worker
+    def merge(self, snapshot: dict):
+        for name, value in snapshot["counters"].items():
+            self.counters[name] += value
+        for name, value in snapshot["gauges"].items():
+            self.set_max(name, value)
+        for name, t in snapshot["timers"].items():
+            timer = self.timers[name]
+            timer.count += t["count"]
+            timer.total += t["total"]
+            timer.max = max(timer.max, t["max"])
+
+    def count_queries(self):
+        logger = logging.getLogger("tortoise.db_client")
+        if not any(isinstance(h, QueryCounter) for h in logger.handlers):
+            logger.addHandler(QueryCounter(self))
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+
+    def derived(self) -> dict[str, float]:
+        derived = {}
+        download = self.timers.get("pallet_download")
+        if download is not None and download.total > 0:
+            derived["download_bytes_per_second"] = (
+                self.counters["download_bytes"] / download.total
+            )
+        sync = self.timers.get("sync")
+        if sync is not None and sync.total > 0:
+            derived["mods_per_second"] = self.counters["mods_processed"] / sync.total
+        for pool in ("api", "cdn"):
+            new = self.counters.get(f"http_{pool}_connections_new", 0)
+            reused = self.counters.get(f"http_{pool}_connections_reused", 0)
+            if new + reused > 0:
+                derived[f"http_{pool}_reuse_rate"] = reused / (new + reused)
+        if METRICS_DB_QUERIES:
+            derived["db_queries"] = sum(
+                v for k, v in self.counters.items() if k.startswith("db_queries_")
+            )
+        return derived
+
+    def snapshot(self) -> dict:
+        return {
+            "started": datetime.utcfromtimestamp(self.started).isoformat(),
+            "duration": time.time() - self.started,
+            "counters": dict(self.counters),
+            "gauges": {**self.gauges, **self.derived()},
+            "timers": {
+                name: {"count": t.count, "total": t.total, "max": t.max}
+                for name, t in self.timers.items()
+            },
+        }
+
+    def prometheus(self) -> str:
+        lines = []
+
+        def metric(name: str, typ: str, samples: list[tuple[str, float]]):
+            name = f"{PROM_PREFIX}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+            lines.append(f"# TYPE {name} {typ}")
+            for labels, value in samples:
+                lines.append(f"{name}{labels} {value}")
+
+        metric("cycle_duration_seconds", "gauge", [("", time.time() - self.started)])
+        for name, value in sorted(self.counters.items()):
+            metric(f"{name}_total", "counter", [("", value)])
+        for name, value in sorted({**self.gauges, **self.derived()}.items()):
+            metric(name, "gauge", [("", value)])
+        stages = sorted(self.timers.items())
+        metric(
+            "stage_seconds_total",
+            "counter",
+            [(f'{{stage="{name}"}}', t.total) for name, t in stages],
+        )
+        metric(
+            "stage_calls_total",
+            "counter",
+            [(f'{{stage="{name}"}}', t.count) for name, t in stages],
+        )
+        metric(
+            "stage_max_seconds",
+            "gauge",
+            [(f'{{stage="{name}"}}', t.max) for name, t in stages],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: Path = METRICS_JSON_PATH, prom_path: Path = METRICS_PROM_PATH):
+        write_atomic(json_path, json.dumps(self.snapshot()))
+        write_atomic(prom_path, self.prometheus())
+
+
+# scrapers and the webserver must never see a half written file
+def write_atomic(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+
+
+metrics = Metrics()
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from tortoise import Tortoise
+
+from modio_repo.pallet_cache import PALLET_FIELDS
+from modio_repo import barcodes
+from modio_repo.listing import rebuild_listings
+from modio_repo.models import PalletCache, PcPallet, QuestPallet
+from modio_repo.utils import log
+
+# Tortoise.generate_schemas only creates missing tables and indexes.
+# everything else an existing db.sqlite3 needs is done here, tracked by sqlite's user_version
+
+
+async def add_column(table: str, column: str, definition: str):
+    conn = Tortoise.get_connection("default")
+    _, rows = await conn.execute_query(f'PRAGMA table_info("{table}")')
+    # fresh databases already got the column from generate_schemas
+    if column not in {row[1] for row in rows}:
+        await conn.execute_script(
+            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition}'
+        )
+
+
+# every column added to a table that existed before. the models select all of their
+# columns, so these are added before any migration runs, whatever version the db has
+COLUMNS = [
+    ("mod", "tags", "JSON NOT NULL DEFAULT '[]'"),
+    ("listing", "tags", "JSON NOT NULL DEFAULT '[]'"),
+    ("pc_file", "filehash", "VARCHAR(32)"),
+    ("quest_file", "filehash", "VARCHAR(32)"),
+    ("pc_file", "filesize", "BIGINT"),
+    ("quest_file", "filesize", "BIGINT"),
+    ("pc_file", "verified_hash", "VARCHAR(32)"),
+    ("quest_file", "verified_hash", "VARCHAR(32)"),
+    ("pallet_cache", "crates", "JSON NOT NULL DEFAULT '[]'"),
+]
+
+
+async def backfill_listings():
+    await rebuild_listings()
+
+
+# versions that only added columns, those come from COLUMNS. the entry in MIGRATIONS
+# just moves user_version past them
+async def columns_added():
+    pass
+
+
+async def add_filehash_and_pallet_cache():
+    # seed the cache with what is already parsed. the hash is unknown until the
+    # file is seen again, restore() takes the file id alone in that case
+    now = datetime.now()
+    for platform, pallet_type in (("pc", PcPallet), ("quest", QuestPallet)):
+        await PalletCache.bulk_create(
+            [
+                PalletCache(
+                    file_id=pallet.file_id,  # type: ignore
+                    platform=platform,
+                    last_used=now,
+                    **{f: getattr(pallet, f) for f in PALLET_FIELDS},
+                )
+                for pallet in await pallet_type.all()
+            ]
+        )
+
+
+async def add_barcode_index():
+    await barcodes.rebuild()
+
+
+async def add_crate_index():
+    await barcodes.rebuild_crates()
+
+
+# append only, the position in this list is the schema version
+MIGRATIONS: list[Callable[[], Awaitable[None]]] = [
+    backfill_listings,
+    # version marker for mod.tags and listing.tags from COLUMNS. filled in by the
+    # next sync, update_stats_mod touches every visible mod
+    columns_added,
+    add_filehash_and_pallet_cache,
+    add_barcode_index,
+    # version marker for filesize and verified_hash of both file tables from COLUMNS.
+    # not backfilled, mod.io is the only source. they stay NULL until the mod changes
+    # and its files are inserted again, Transfer checks only what is known meanwhile
+    columns_added,
+    add_crate_index,
+]
+
+
+async def migrate():
+    conn = Tortoise.get_connection("default")
+    _, rows = await conn.execute_query("PRAGMA user_version")
+    version = rows[0][0]
+    if version < len(MIGRATIONS):
+        for table, column, definition in COLUMNS:
+            await add_column(table, column, definition)
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        log(f"migrating database to version {target}: {migration.__name__}")
+        await migration()
+        await conn.execute_script(f"PRAGMA user_version = {target}")
@@ -3,6 +3,8 @@ from __future__ import annotations
 from tortoise import fields
 from tortoise.models import Model
 
+from modio_repo.identity import identity
+
 
 class Mod(Model):
     id = fields.IntField(pk=True, generated=False)
@@ -15,19 +17,40 @@ class Mod(Model):
     thumbnailUrl = fields.TextField()
     rank = fields.IntField()
     downloads = fields.IntField()
+    # mod.io tag names, used to shard the repository by category
+    tags = fields.JSONField(default=list)
 
     quest_file: fields.ReverseRelation[QuestModFile]
     pc_file: fields.ReverseRelation[PcModFile]
+    listing: fields.ReverseRelation[Listing]
+
+    class Meta:
+        indexes = (("malformed_pallet", "nsfw", "rank"),)
+
+    @classmethod
+    async def get_cached(cls, mod_id: int) -> Mod | None:
+        return await identity.lookup(
+            identity.mods, mod_id, lambda: cls.get_or_none(id=mod_id)
+        )
+
+    # the instance the rest of the run should see, e.g. after update_or_create
+    def remember(self):
+        identity.mods[self.id] = self
 
-    async def get_quest_file(self):
-        cached = getattr(self, "__quest_file_cached", None)
-        self.__quest_file_cached = cached or await self.quest_file.all().first()
-        return self.__quest_file_cached
+    async def get_quest_file(self) -> QuestModFile | None:
+        return await identity.lookup(
+            identity.files, (self.id, "quest"), self.quest_file.all().first
+        )
 
-    async def get_pc_file(self):
-        cached = getattr(self, "__pc_file_cached", None)
-        self.__pc_file_cached = cached or await self.pc_file.all().first()
-        return self.__pc_file_cached
+    async def get_pc_file(self) -> PcModFile | None:
+        return await identity.lookup(
+            identity.files, (self.id, "pc"), self.pc_file.all().first
+        )
+
+    # a file was just inserted for this mod, it has no pallets yet
+    def set_file(self, platform: str, file: ModFileBase):
+        identity.files[(self.id, platform)] = file
+        file.set_pallets([])
 
     async def get_last_file_change(self):
         pc_file = await self.get_pc_file()
@@ -50,6 +73,11 @@ class Mod(Model):
         if pc_file is not None:
             await pc_file.delete()
 
+        # the pallets went with the files
+        identity.forget_files(self.id)
+        identity.files[(self.id, "quest")] = None
+        identity.files[(self.id, "pc")] = None
+
 
 class PalletErrorBase(Model):
     id = fields.IntField(pk=True)
@@ -63,6 +91,11 @@ class ModFileBase(Model):
     id: fields.IntField = fields.IntField(pk=True, generated=False)
     added = fields.DatetimeField()
     url = fields.TextField()
+    # md5 and size of the upload as reported by mod.io
+    filehash = fields.CharField(max_length=32, null=True)
+    filesize = fields.BigIntField(null=True)
+    # md5 of the archive as downloaded, set once it matched filehash
+    verified_hash = fields.CharField(max_length=32, null=True)
 
     mod: fields.ForeignKeyRelation[Mod]
     pallet_error: fields.ReverseRelation[PalletErrorBase]
@@ -71,6 +104,14 @@ class ModFileBase(Model):
     class Meta:
         abstract = True
 
+    async def get_pallets(self) -> list[PalletBase]:
+        return await identity.lookup(
+            identity.pallets, (self._meta.db_table, self.id), self.pallet.all
+        )
+
+    def set_pallets(self, pallets: list[PalletBase]):
+        identity.pallets[(self._meta.db_table, self.id)] = pallets
+
 
 class PalletBase(Model):
     id = fields.IntField(pk=True)
@@ -100,12 +141,14 @@ class QuestModFile(ModFileBase):
 
 class QuestPallet(PalletBase):
     file: fields.ForeignKeyRelation[QuestModFile] = fields.ForeignKeyField(
-        "models.QuestModFile", related_name="pallet"
+        "models.QuestModFile", related_name="pallet", index=True
     )
 
     class Meta:
         table = "quest_pallet"
         table_description = ""
+        # TextField can't take index=True
+        indexes = (("barcode",),)
 
 
 class QuestPalletError(PalletErrorBase):
@@ -133,12 +176,13 @@ class PcModFile(ModFileBase):
 
 class PcPallet(PalletBase):
     file: fields.ForeignKeyRelation[PcModFile] = fields.ForeignKeyField(
-        "models.PcModFile", related_name="pallet"
+        "models.PcModFile", related_name="pallet", index=True
     )
 
     class Meta:
         table = "pc_pallet"
         table_description = ""
+        indexes = (("barcode",),)
 
 
 class PcPalletError(PalletErrorBase):
@@ -149,3 +193,135 @@ class PcPalletError(PalletErrorBase):
     class Meta:
         table = "pc_pallet_error"
         table_description = ""
+
+
+class PalletFailure(Model):
+    # keyed by mod.io file id instead of a relation, so it survives Mod.clear_files
+    id = fields.IntField(pk=True, generated=False)
+    kind = fields.CharField(max_length=32)
+    error = fields.TextField()
+    attempts = fields.IntField(default=1)
+    # bytes downloaded by the failed attempt, saved again on every skip
+    size = fields.BigIntField(default=0)
+    skipped = fields.IntField(default=0)
+    bytes_saved = fields.BigIntField(default=0)
+    last_failed = fields.DatetimeField()
+    retry_after = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "pallet_failure"
+        table_description = ""
+
+
+class PalletCache(Model):
+    # pallets parsed from a mod.io file, keyed by file id instead of a relation like
+    # PalletFailure, so re-inserting an unchanged file doesn't download it again
+    id = fields.IntField(pk=True)
+    file_id = fields.IntField()
+    # "pc" or "quest", one upload can be listed for both
+    platform = fields.CharField(max_length=8)
+    filehash = fields.CharField(max_length=32, null=True)
+    zip_path = fields.TextField()
+    fs_path = fields.TextField()
+    barcode = fields.TextField()
+    author = fields.TextField()
+    version = fields.TextField()
+    sdkVersion = fields.TextField()
+    # barcode, title and type of the pallet's crates
+    crates = fields.JSONField(default=list)
+    last_used = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "pallet_cache"
+        table_description = ""
+        indexes = (("file_id", "platform"),)
+
+
+class BarcodeIndex(Model):
+    # every pallet barcode and where it comes from, across all mods.
+    # kept up to date as pallets are inserted and files dropped, see modio_repo.barcodes
+    id = fields.IntField(pk=True)
+    barcode = fields.TextField()
+    mod: fields.ForeignKeyRelation[Mod] = fields.ForeignKeyField(
+        "models.Mod", related_name="barcodes", index=True
+    )
+    file_id = fields.IntField()
+    # "pc" or "quest"
+    platform = fields.CharField(max_length=8)
+
+    class Meta:
+        table = "barcode_index"
+        table_description = ""
+        indexes = (("barcode",),)
+
+
+class BarcodeConflict(Model):
+    # a barcode shipped by more than one mod, they'd overwrite each other in game
+    barcode = fields.CharField(max_length=255, pk=True)
+    mod_ids = fields.JSONField()
+    found = fields.DatetimeField()
+
+    class Meta:
+        table = "barcode_conflict"
+        table_description = ""
+
+
+class Crate(Model):
+    # every crate of every pallet, so finding the mod that ships a crate doesn't
+    # need the manifests. replaced together with the barcode index
+    id = fields.IntField(pk=True)
+    barcode = fields.TextField()
+    title = fields.TextField()
+    # e.g. SpawnableCrate, AvatarCrate, LevelCrate
+    crate_type = fields.CharField(max_length=64)
+    pallet_barcode = fields.TextField()
+    mod: fields.ForeignKeyRelation[Mod] = fields.ForeignKeyField(
+        "models.Mod", related_name="crates", index=True
+    )
+    file_id = fields.IntField()
+    # "pc" or "quest"
+    platform = fields.CharField(max_length=8)
+
+    class Meta:
+        table = "crate"
+        table_description = ""
+        indexes = (("barcode",),)
+
+
+class BarcodeChange(Model):
+    # barcodes whose mods changed since the conflicts were last updated, kept in the
+    # database so a check in another process than the sync still sees them
+    barcode = fields.CharField(max_length=255, pk=True)
+
+    class Meta:
+        table = "barcode_change"
+        table_description = ""
+
+
+class Listing(Model):
+    # denormalized copy of everything RepositoryFile needs for one publishable mod,
+    # kept up to date by the importer so a repository build is a single scan
+    id = fields.IntField(pk=True)
+    mod: fields.OneToOneRelation[Mod] = fields.OneToOneField(
+        "models.Mod", related_name="listing"
+    )
+    name = fields.TextField()
+    description = fields.TextField()
+    thumbnailUrl = fields.TextField()
+    rank = fields.IntField()
+    downloads = fields.IntField()
+    nsfw = fields.BooleanField()
+    malformed_pallet = fields.BooleanField()
+    barcode = fields.TextField()
+    author = fields.TextField()
+    version = fields.TextField()
+    sdkVersion = fields.TextField()
+    manifest_file_id = fields.IntField()
+    pc_url = fields.TextField(null=True)
+    quest_url = fields.TextField(null=True)
+    tags = fields.JSONField(default=list)
+
+    class Meta:
+        table = "listing"
+        table_description = ""
+        indexes = (("nsfw", "malformed_pallet", "rank"), ("barcode",))
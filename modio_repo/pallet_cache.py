@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Sequence, Type
+
+from tortoise.expressions import Subquery
+
+from modio_repo import barcodes
+from modio_repo.metrics import metrics
+from modio_repo.models import (
+    PalletBase,
+    PalletCache,
+    PcModFile,
+    PcPallet,
+    QuestModFile,
+    QuestPallet,
+)
+from modio_repo.utils import log
+
+# pallet manifests, the repositories link to them. cached pallets keep theirs
+PALLET_DIR = Path("./static/pallets/")
+
+# cached pallets of files no mod points to anymore are dropped after this
+PALLET_CACHE_DAYS = int(os.getenv("PALLET_CACHE_DAYS", "14"))
+
+PALLET_FIELDS = ("zip_path", "fs_path", "barcode", "author", "version", "sdkVersion")
+
+
+def platform_of(file: PcModFile | QuestModFile) -> str:
+    return "quest" if isinstance(file, QuestModFile) else "pc"
+
+
+# recreate the pallets of a file from the cache, instead of downloading it again.
+# mod.io file ids are never reused, the hash only guards against a changed upload
+async def restore(
+    file: PcModFile | QuestModFile, pallet_type: Type[PcPallet | QuestPallet]
+) -> bool:
+    cached = await PalletCache.filter(
+        file_id=file.id, platform=platform_of(file)
+    ).order_by("id")
+    if not cached:
+        return False
+
+    stale = any(
+        c.filehash is not None and file.filehash is not None and c.filehash != file.filehash
+        for c in cached
+    )
+    missing = [c.fs_path for c in cached if not os.path.exists(c.fs_path)]
+    if stale or missing:
+        log(f"not reusing cached pallets of {file.id}, stale {stale}, missing {missing}")
+        await PalletCache.filter(file_id=file.id, platform=platform_of(file)).delete()
+        return False
+
+    pallets = [
+        await pallet_type.create(file=file, **{f: getattr(c, f) for f in PALLET_FIELDS})
+        for c in cached
+    ]
+    file.set_pallets(pallets)  # type: ignore
+    await barcodes.index_pallets(file, pallets, [c.crates for c in cached])
+    await PalletCache.filter(id__in=[c.id for c in cached]).update(
+        last_used=datetime.now(), filehash=file.filehash or cached[0].filehash
+    )
+    metrics.inc("downloads_avoided")
+    metrics.inc("pallets_reused", len(cached))
+    log(f"reused {len(cached)} cached pallets of file {file.id}")
+    return True
+
+
+async def store(
+    file: PcModFile | QuestModFile,
+    pallets: Sequence[PalletBase],
+    crates: Sequence[list[dict[str, Any]]],
+):
+    platform = platform_of(file)
+    await PalletCache.filter(file_id=file.id, platform=platform).delete()
+    now = datetime.now()
+    await PalletCache.bulk_create(
+        [
+            PalletCache(
+                file_id=file.id,
+                platform=platform,
+                filehash=file.filehash,
+                last_used=now,
+                crates=pallet_crates,
+                **{f: getattr(p, f) for f in PALLET_FIELDS},
+            )
+            for p, pallet_crates in zip(pallets, crates)
+        ]
+    )
+
+
+async def prune():
+    cutoff = datetime.now() - timedelta(days=PALLET_CACHE_DAYS)
+    count = await (
+        PalletCache.filter(last_used__lt=cutoff)
+        .exclude(file_id__in=Subquery(PcModFile.all().values("id")))
+        .exclude(file_id__in=Subquery(QuestModFile.all().values("id")))
+        .delete()
+    )
+    if count:
+        log(f"dropped {count} unused cached pallets")
+
+
+async def cached_paths() -> list[str]:
+    return await PalletCache.all().values_list("fs_path", flat=True)  # type: ignore
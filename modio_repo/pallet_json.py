@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple, TextIO
+
+# pallet.json is read in pieces of this many characters. only one object of
+# "objects" or "types" is decoded at a time, so content heavy pallets with
+# thousands of crates never become one big dict
+CHUNK = 64 * 1024
+# files up to this many bytes are decoded in one go. that's faster than reading
+# them piece by piece and they are too small for the memory to matter
+SMALL_FILE = CHUNK
+
+PALLET_TYPE = "SLZ.Marrow.Warehouse.Pallet"
+# what's kept of every object, the crates need barcode and title, the pallet the rest
+OBJECT_FIELDS = ("barcode", "title", "author", "version", "sdkVersion")
+
+# characters after a decoded number that may still belong to it ("." "e" "+" ...)
+NUMBER_TAIL = 2
+
+decoder = json.JSONDecoder()
+WHITESPACE = re.compile(r"\s*")
+
+
+class Reader:
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(CHUNK)
+        if not data:
+            self.eof = True
+            return False
+        if self.pos > CHUNK:
+            self.buf = self.buf[self.pos :]
+            self.pos = 0
+        self.buf += data
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()  # type: ignore
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos : self.pos + 1]
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # most likely cut off by the end of the chunk
+                if self.fill():
+                    continue
+                raise
+            # a number near the end of the chunk may go on in the next one,
+            # e.g. "-35" of "-35.5e3", or "1" followed by a "." that ends the chunk
+            if (
+                isinstance(value, (int, float))
+                and len(self.buf) - end <= NUMBER_TAIL
+                and self.fill()
+            ):
+                continue
+            self.pos = end
+            return value
+
+    # the keys of an object, the caller reads each value before asking for the next
+    def keys(self) -> Iterator[str]:
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+# ("objects" | "types", key, value) for every member of the two maps, in file order
+def members(f: TextIO) -> Iterator[tuple[str, str, Any]]:
+    reader = Reader(f)
+    for section in reader.keys():
+        if section in ("objects", "types") and reader.peek() == "{":
+            for key in reader.keys():
+                yield section, key, reader.value()
+        else:
+            reader.value()
+    if reader.peek():
+        raise json.JSONDecodeError("Extra data", reader.buf, reader.pos)
+
+
+# the same for a manifest that is already decoded
+def loaded_members(data: Any) -> Iterator[tuple[str, str, Any]]:
+    if not isinstance(data, dict):
+        raise json.JSONDecodeError("Expecting '{'", "", 0)
+    for section, values in data.items():
+        if section in ("objects", "types") and isinstance(values, dict):
+            for key, value in values.items():
+                yield section, key, value
+
+
+class Manifest(NamedTuple):
+    # type key -> fullname, None if the file has no "types"
+    types: dict[str, str] | None
+    # object key -> type key and OBJECT_FIELDS
+    objects: dict[str, dict[str, Any]]
+
+
+def scan(f: TextIO) -> Manifest:
+    return summarize(members(f))
+
+
+def summarize(all_members: Iterable[tuple[str, str, Any]]) -> Manifest:
+    types: dict[str, str] | None = None
+    objects: dict[str, dict[str, Any]] = {}
+    for section, key, value in all_members:
+        if not isinstance(value, dict):
+            continue
+        if section == "types":
+            types = {} if types is None else types
+            types[key] = str(value.get("fullname", ""))
+        else:
+            summary = {field: value[field] for field in OBJECT_FIELDS if field in value}
+            isa = value.get("isa")
+            summary["isa"] = isa.get("type") if isinstance(isa, dict) else None
+            if not isinstance(summary["isa"], str):
+                summary["isa"] = None
+            objects[key] = summary
+    return Manifest(types, objects)
+
+
+def type_name(fullname: str) -> str:
+    # "SLZ.Marrow.Warehouse.SpawnableCrate, SLZ.Marrow.SDK, ..." -> "SpawnableCrate"
+    return fullname.split(",")[0].rsplit(".", 1)[-1]
+
+
+# barcode, title and type of every crate in the manifest
+def crates(manifest: Manifest) -> list[dict[str, str]]:
+    crate_types = {
+        key: type_name(fullname)
+        for key, fullname in (manifest.types or {}).items()
+        if type_name(fullname).endswith("Crate")
+    }
+    return [
+        {
+            "barcode": obj["barcode"],
+            "title": obj.get("title", ""),
+            "type": crate_types[obj["isa"]],
+        }
+        for obj in manifest.objects.values()
+        if obj["isa"] in crate_types and "barcode" in obj
+    ]
+
+
+def read(path: Path) -> Manifest:
+    with path.open("r", encoding="utf-8") as f:
+        if path.stat().st_size <= SMALL_FILE:
+            return summarize(loaded_members(json.load(f)))
+        return scan(f)
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import asyncio
+import atexit
+import cProfile
+import functools
+import io
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, TypeVar
+
+from modio_repo.utils import log
+
+F = TypeVar("F", bound=Callable)
+
+# MODIO_REPO_PROFILE=Run.run,PalletHandler.run or "all"
+# MODIO_REPO_PROFILER=cprofile (default), yappi (needs `pip install yappi`) or tracemalloc
+STAGES = {
+    "Run.run",
+    "PalletHandler.run",
+    "checks",
+    "RepositoryFile.add_listing",
+    "RepositoryFile.save",
+}
+PROFILERS = {"cprofile", "yappi", "tracemalloc"}
+
+
+class Config:
+    def __init__(self):
+        self.stages: set[str] = set()
+        self.profiler = "cprofile"
+        self.out_dir = Path("./static/profiles")
+        self.top = 30
+
+    def load(
+        self,
+        stages: str | None = None,
+        profiler: str | None = None,
+        out_dir: str | None = None,
+        top: int | None = None,
+    ):
+        stages = stages if stages is not None else os.getenv("MODIO_REPO_PROFILE", "")
+        names = {s.strip() for s in stages.split(",") if s.strip()}
+        self.stages = set(STAGES) if "all" in names else names
+        unknown = self.stages - STAGES
+        if unknown:
+            raise ValueError(f"unknown profiling stages {unknown}, known: {STAGES}")
+
+        self.profiler = profiler or os.getenv("MODIO_REPO_PROFILER", "cprofile")
+        if self.profiler not in PROFILERS:
+            raise ValueError(f"unknown profiler {self.profiler}, known: {PROFILERS}")
+        self.out_dir = Path(
+            out_dir or os.getenv("MODIO_REPO_PROFILE_DIR", "./static/profiles")
+        )
+        self.top = top or int(os.getenv("MODIO_REPO_PROFILE_TOP", "30"))
+
+
+config = Config()
+config.load()
+
+
+def configure(
+    stages: str | None = None,
+    profiler: str | None = None,
+    out_dir: str | None = None,
+    top: int | None = None,
+):
+    # stages are checked when the decorated function is defined,
+    # so this has to run before the pipeline modules are imported
+    config.load(stages, profiler, out_dir, top)
+
+
+class StageProfile:
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.calls = 0
+        self.active = 0
+        self.seconds = 0.0
+        self.started = 0.0
+        self.pstat_files: list[str] = []
+        self.profile: cProfile.Profile | None = None
+        self.malloc_start: tracemalloc.Snapshot | None = None
+        self.malloc_peak = 0
+        self.malloc_top: list[tracemalloc.StatisticDiff] = []
+
+    def enter(self):
+        self.calls += 1
+        self.active += 1
+        if self.active > 1:
+            # concurrent calls of the same stage share one profiling window
+            return
+        self.started = time.perf_counter()
+        if config.profiler == "cprofile":
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif config.profiler == "yappi":
+            import yappi
+
+            yappi.set_clock_type("wall")
+            yappi.start()
+        else:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+            tracemalloc.reset_peak()
+            self.malloc_start = tracemalloc.take_snapshot()
+
+    def exit(self):
+        self.active -= 1
+        if self.active > 0:
+            return
+        self.seconds += time.perf_counter() - self.started
+        if config.profiler == "cprofile":
+            assert self.profile is not None
+            self.profile.disable()
+        elif config.profiler == "yappi":
+            import yappi
+
+            yappi.stop()
+            fd, path = tempfile.mkstemp(suffix=".pstat")
+            os.close(fd)
+            yappi.get_func_stats().save(path, type="pstat")
+            yappi.clear_stats()
+            self.pstat_files.append(path)
+        else:
+            _, peak = tracemalloc.get_traced_memory()
+            if peak >= self.malloc_peak and self.malloc_start is not None:
+                self.malloc_peak = peak
+                snapshot = tracemalloc.take_snapshot()
+                self.malloc_top = snapshot.compare_to(self.malloc_start, "lineno")
+            self.malloc_start = None
+
+    def stats(self) -> pstats.Stats | None:
+        if self.profile is not None:
+            return pstats.Stats(self.profile)
+        if self.pstat_files:
+            stats = pstats.Stats(*self.pstat_files)
+            # don't list the temporary files in the report
+            stats.files = []
+            return stats
+        return None
+
+    def report(self) -> str:
+        header = (
+            f"stage {self.stage}, profiler {config.profiler},"
+            f" {self.calls} calls, {self.seconds:.3f}s profiled,"
+            f" written {datetime.now().isoformat()}\n\n"
+        )
+        if config.profiler == "tracemalloc":
+            lines = [f"peak traced memory {self.malloc_peak / 1024**2:.1f}MB\n"]
+            lines.extend(str(diff) for diff in self.malloc_top[: config.top])
+            return header + "\n".join(lines) + "\n"
+
+        stats = self.stats()
+        if stats is None:
+            return header
+        out = io.StringIO()
+        stats.stream = out  # type: ignore
+        stats.sort_stats("cumulative").print_stats(config.top)
+        out.write("\n")
+        stats.sort_stats("tottime").print_stats(config.top)
+        return header + out.getvalue()
+
+    def write(self):
+        if self.calls == 0:
+            return
+        config.out_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{self.stage}.{config.profiler}"
+        (config.out_dir / f"{name}.txt").write_text(self.report())
+        stats = self.stats()
+        if stats is not None:
+            stats.dump_stats(config.out_dir / f"{name}.pstats")
+        for path in self.pstat_files:
+            os.unlink(path)
+        log(f"wrote profile for {self.stage} to {config.out_dir / name}.txt")
+
+
+profiles: dict[str, StageProfile] = {}
+# profilers hook the whole interpreter, so only one stage is profiled at a time
+_current: StageProfile | None = None
+
+
+def _enter(stage: str) -> StageProfile | None:
+    global _current
+    if _current is not None and _current.stage != stage:
+        return None
+    profile = profiles.setdefault(stage, StageProfile(stage))
+    _current = profile
+    profile.enter()
+    return profile
+
+
+def _exit(profile: StageProfile | None):
+    global _current
+    if profile is None:
+        return
+    profile.exit()
+    if profile.active == 0:
+        _current = None
+
+
+def profiled(stage: str) -> Callable[[F], F]:
+    if stage not in STAGES:
+        raise ValueError(f"unknown profiling stage {stage}")
+
+    def decorator(func: F) -> F:
+        if stage not in config.stages:
+            # disabled stages get the undecorated function, so there is no overhead
+            return func
+
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                profile = _enter(stage)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _exit(profile)
+
+            return async_wrapper  # type: ignore
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _enter(stage)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _exit(profile)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def write_reports():
+    for profile in profiles.values():
+        profile.write()
+    profiles.clear()
+
+
+atexit.register(write_reports)
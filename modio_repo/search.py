@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from modio_repo.metrics import write_atomic
+from modio_repo.models import Listing
+
+SEARCH_INDEX_PATH = Path(os.getenv("SEARCH_INDEX_PATH", "./static/search.json"))
+SEARCH_INDEX_VERSION = 1
+
+# platform bits in the mods table of the index
+PLATFORM_PC = 1
+PLATFORM_QUEST = 2
+
+
+# lowercase ascii words, the site does the same to the query
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", text)
+    text = text.encode("ascii", "ignore").decode().lower()
+    # barcodes are Author.PalletName, camel case words are split too
+    return [t for t in re.split(r"[^a-z0-9]+", text) if t]
+
+
+def camel_words(text: str) -> str:
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", text)
+
+
+# the index is a list of mods in rank order and a map of words to positions in that
+# list. postings are ascending, so results come out ranked without sorting
+def build_index(listings: list[Listing]) -> dict:
+    listings = sorted(listings, key=lambda l: l.rank)
+    mods = []
+    terms: defaultdict[str, list[int]] = defaultdict(list)
+    for position, listing in enumerate(listings):
+        platforms = (PLATFORM_PC if listing.pc_url else 0) | (
+            PLATFORM_QUEST if listing.quest_url else 0
+        )
+        mods.append(
+            [
+                listing.mod_id,  # type: ignore
+                listing.name,
+                listing.author,
+                listing.thumbnailUrl,
+                platforms,
+                int(listing.nsfw),
+            ]
+        )
+        words = set(tokenize(listing.name))
+        words.update(tokenize(camel_words(listing.name)))
+        words.update(tokenize(listing.author))
+        words.update(tokenize(listing.barcode))
+        words.update(tokenize(camel_words(listing.barcode)))
+        for word in words:
+            terms[word].append(position)
+
+    return {
+        "version": SEARCH_INDEX_VERSION,
+        "updated": datetime.utcnow().isoformat(),
+        "fields": ["id", "name", "author", "thumbnailUrl", "platforms", "nsfw"],
+        "mods": mods,
+        "terms": dict(sorted(terms.items())),
+    }
+
+
+def write_search_index(listings: list[Listing], path: Path = SEARCH_INDEX_PATH) -> int:
+    content = json.dumps(build_index(listings), separators=(",", ":"))
+    write_atomic(path, content)
+    return len(content)
+
+
+# the same lookup the site does in javascript, used by the benchmark
+class SearchIndex:
+    def __init__(self, index: dict):
+        self.mods: list[list] = index["mods"]
+        self.terms: dict[str, list[int]] = index["terms"]
+        self.words = list(self.terms)
+
+    @classmethod
+    def load(cls, path: Path = SEARCH_INDEX_PATH) -> SearchIndex:
+        return cls(json.loads(path.read_text()))
+
+    # every word of the query has to match, the last one as a prefix
+    def postings(self, word: str, prefix: bool) -> set[int]:
+        if not prefix:
+            return set(self.terms.get(word, ()))
+        found: set[int] = set()
+        start = bisect.bisect_left(self.words, word)
+        for term in self.words[start:]:
+            if not term.startswith(word):
+                break
+            found.update(self.terms[term])
+        return found
+
+    def search(self, query: str, limit: int = 20) -> list[list]:
+        words = tokenize(query)
+        if not words:
+            return []
+        matches = self.postings(words[-1], prefix=True)
+        for word in words[:-1]:
+            if not matches:
+                break
+            matches &= self.postings(word, prefix=False)
+        return [self.mods[position] for position in sorted(matches)[:limit]]
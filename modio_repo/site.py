@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+from jinja2 import Environment, FileSystemLoader, meta
+
+from modio_repo.metrics import metrics, write_atomic
+from modio_repo.utils import log
+
+TEMPLATE_DIR = Path(os.getenv("SITE_TEMPLATE_DIR", "./templates"))
+SITE_OUT_DIR = Path(os.getenv("SITE_OUT_DIR", "./static"))
+# content hash of every page's inputs from the last render
+SITE_STATE_PATH = Path(os.getenv("SITE_STATE_PATH", "./static/.site_state.json"))
+
+# data inlined into pages, keyed by template name. pages not listed here only
+# depend on their templates. without this data the templates fall back to
+# fetching the json files in the browser, so staticbuild.sh still works
+PAGE_DATA = {
+    "index.html": ("site_meta", "repositories"),
+    "errors.html": ("errors",),
+}
+# fields that change on every build and are left out of the hash, or no page with them
+# would ever be skipped. the pages fetch site_meta.json for the current time
+VOLATILE = {"site_meta": ("updated",)}
+
+
+class Site:
+    def __init__(self, template_dir: Path = TEMPLATE_DIR, out_dir: Path = SITE_OUT_DIR):
+        self.template_dir = template_dir
+        self.out_dir = out_dir
+        self.env = Environment(loader=FileSystemLoader(str(template_dir)))
+        self._deps: dict[str, set[str]] = {}
+
+    # same rule as staticjinja: templates starting with _ or . are partials
+    def pages(self) -> list[str]:
+        return sorted(
+            name
+            for name in self.env.list_templates()
+            if not any(part.startswith(("_", ".")) for part in name.split("/"))
+        )
+
+    # the template itself and everything it extends, includes or imports
+    def dependencies(self, name: str) -> set[str]:
+        if name not in self._deps:
+            self._deps[name] = {name}
+            source, _, _ = self.env.loader.get_source(self.env, name)  # type: ignore
+            for ref in meta.find_referenced_templates(self.env.parse(source)):
+                if ref is not None:
+                    self._deps[name] |= self.dependencies(ref)
+        return self._deps[name]
+
+    def input_hash(self, name: str, context: dict[str, Any]) -> str:
+        h = hashlib.sha256()
+        for dep in sorted(self.dependencies(name)):
+            h.update(dep.encode())
+            h.update((self.template_dir / dep).read_bytes())
+        stable = {
+            key: (
+                {k: v for k, v in value.items() if k not in VOLATILE[key]}
+                if key in VOLATILE and isinstance(value, dict)
+                else value
+            )
+            for key, value in context.items()
+        }
+        h.update(json.dumps(stable, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def render(self, data: dict[str, Any], force: bool = False) -> list[str]:
+        try:
+            state = json.loads(SITE_STATE_PATH.read_text())
+        except (OSError, ValueError):
+            state = {}
+
+        rendered = []
+        for name in self.pages():
+            context = {key: data[key] for key in PAGE_DATA.get(name, ()) if key in data}
+            digest = self.input_hash(name, context)
+            out = self.out_dir / name
+            if not force and state.get(name) == digest and out.exists():
+                metrics.inc("site_pages_skipped")
+                continue
+            write_atomic(out, self.env.get_template(name).render(**context))
+            state[name] = digest
+            rendered.append(name)
+            metrics.inc("site_pages_rendered")
+
+        write_atomic(SITE_STATE_PATH, json.dumps(state, indent=2))
+        if rendered:
+            log(f"rendered {', '.join(rendered)}")
+        return rendered
+
+
+def render_site(data: dict[str, Any], force: bool = False) -> list[str]:
+    if not TEMPLATE_DIR.is_dir():
+        log(f"no templates at {TEMPLATE_DIR}, not rendering the site")
+        return []
+    with metrics.timer("site_render"):
+        return Site().render(data, force)
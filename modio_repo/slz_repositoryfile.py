@@ -1,11 +1,36 @@
-from modio_repo.models import Mod, PcPallet, QuestPallet
-from modio_repo.slz_json import RefList, SLZContainer, SLZObject, SLZType, dump
+from __future__ import annotations
+
+import os
+import re
+from collections import defaultdict
+from pathlib import Path
+
+from modio_repo.metrics import write_atomic
+from modio_repo.models import Listing, Mod
+from modio_repo.profiling import profiled
+from modio_repo.slz_json import (
+    RefList,
+    SLZContainer,
+    SLZObject,
+    SLZType,
+    dumps,
+    reset as reset_slzjson,
+)
 from modio_repo.utils import log
 
+SITE_URL = "https://blrepo.laund.moe"
+TRENDING_COUNT = int(os.getenv("REPOSITORY_TRENDING_COUNT", "50"))
+
+
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "other"
+
 
 class RepositoryFile:
     def __init__(self, filename: str, reponame: str, repo_description: str):
         self.filename = filename
+        self.reponame = reponame
+        self.listings: list[Listing] = []
 
         self.t_repo = SLZType(
             "SLZ.Marrow.Forklift.Model.ModRepository, SLZ.Marrow.SDK, Version=0.0.0.0,"
@@ -38,62 +63,123 @@ class RepositoryFile:
             )
         )
 
+    @profiled("RepositoryFile.save")
     def save(self):
-        with open(self.filename, "w+") as f:
-            dump(self.repository, f)
+        write_atomic(Path(self.filename), dumps(self.repository))
 
-    async def add_mod(self, mod: Mod):
-        targets = {}
+    # entry for the repositories.json index
+    def index_entry(self, kind: str, **extra) -> dict:
+        return {
+            "title": self.reponame,
+            "url": f"{SITE_URL}/{Path(self.filename).name}",
+            "kind": kind,
+            "count": len(self.listings),
+            **extra,
+        }
+
+    # smaller repositories built from the listings of this one: the top mods by rank
+    # and one per mod.io tag. this resets the slz_json refs, so save() has to come first
+    def save_variants(self, trending: int = TRENDING_COUNT) -> list[dict]:
+        path = Path(self.filename)
+        variants = [
+            (
+                path.with_name(f"{path.stem}.trending.json"),
+                f"{self.reponame} trending",
+                f"Top {trending} mods of {self.reponame} by mod.io rank",
+                sorted(self.listings, key=lambda l: l.rank)[:trending],
+                {"kind": "trending"},
+            )
+        ]
 
-        pc_file = await mod.get_pc_file()
-
-        quest_file = await mod.get_quest_file()
-
-        pallets: list[PcPallet | QuestPallet] = []
-        if pc_file is not None:
-            pallets.extend(await pc_file.pallet)
-        if quest_file is not None:
-            pallets.extend(await quest_file.pallet)
-
-        # TODO: what should really be used for the barcode?
-        # what if there are multiple pallets in these files?
-        if len(pallets) > 0:
-            pallet = pallets[0]
-            self.maybe_add_platform(targets, "pc", pc_file)
-            self.maybe_add_platform(targets, "oculus-quest", quest_file)
-            file_ = await pallet.file
-            self.objects.append(
-                SLZObject(
-                    self.t_list.ref,
-                    barcode=pallet.barcode,
-                    title=self.titlesorthack(mod),
-                    description=mod.description,
-                    author=pallet.author,
-                    version=pallet.version,
-                    sdkVersion=pallet.sdkVersion,
-                    internal=False,
-                    tags=[],
-                    thumbnailUrl=mod.thumbnailUrl,
-                    manifestUrl=f"https://blrepo.laund.moe/pallets/{file_.id}_0.json",
-                    targets=targets,
+        categories: defaultdict[str, list[Listing]] = defaultdict(list)
+        for listing in self.listings:
+            for tag in listing.tags:
+                categories[tag].append(listing)
+        for tag, listings in sorted(categories.items()):
+            variants.append(
+                (
+                    path.with_name(f"{path.stem}.category.{slugify(tag)}.json"),
+                    f"{self.reponame} {tag}",
+                    f"{tag} mods of {self.reponame}",
+                    listings,
+                    {"kind": "category", "category": tag},
                 )
             )
 
-    def maybe_add_platform(self, targets, platform, file_):
-        if file_ is not None:
-            target = SLZObject(
-                self.t_target.ref,
-                thumbnailOverride=None,
-                url=file_.url,
+        # categories that no longer have any mods
+        written = {filename for filename, *_ in variants}
+        for stale in path.parent.glob(f"{path.stem}.category.*.json"):
+            if stale not in written:
+                log(f"removing empty category repository {stale}")
+                stale.unlink()
+
+        entries = []
+        for filename, reponame, description, listings, extra in variants:
+            reset_slzjson()
+            variant = RepositoryFile(str(filename), reponame, description)
+            for listing in listings:
+                variant.add_listing(listing)
+            variant.save()
+            entries.append(variant.index_entry(**extra))
+        return entries
+
+    # the fields of one repository entry, shared with the changes feed
+    def listing_entry(self, listing: Listing) -> dict:
+        targets = {}
+        if listing.pc_url is not None:
+            targets["pc"] = listing.pc_url
+        if listing.quest_url is not None:
+            targets["oculus-quest"] = listing.quest_url
+        return {
+            "barcode": listing.barcode,
+            "title": self.titlesorthack(listing),
+            "description": listing.description,
+            "author": listing.author,
+            "version": listing.version,
+            "sdkVersion": listing.sdkVersion,
+            "thumbnailUrl": listing.thumbnailUrl,
+            "manifestUrl": f"{SITE_URL}/pallets/{listing.manifest_file_id}_0.json",
+            "targets": targets,
+        }
+
+    @profiled("RepositoryFile.add_listing")
+    def add_listing(self, listing: Listing):
+        self.listings.append(listing)
+        entry = self.listing_entry(listing)
+        targets = {}
+        for platform, url in entry["targets"].items():
+            self.add_platform(targets, platform, url)
+        self.objects.append(
+            SLZObject(
+                self.t_list.ref,
+                barcode=entry["barcode"],
+                title=entry["title"],
+                description=entry["description"],
+                author=entry["author"],
+                version=entry["version"],
+                sdkVersion=entry["sdkVersion"],
+                internal=False,
+                tags=[],
+                thumbnailUrl=entry["thumbnailUrl"],
+                manifestUrl=entry["manifestUrl"],
+                targets=targets,
             )
-            self.objects.append(target)
-            targets[platform] = {
-                "ref": target.ref,
-                "type": target.type,
-            }
+        )
+
+    def add_platform(self, targets, platform, url: str):
+        target = SLZObject(
+            self.t_target.ref,
+            thumbnailOverride=None,
+            url=url,
+        )
+        self.objects.append(target)
+        targets[platform] = {
+            "ref": target.ref,
+            "type": target.type,
+        }
 
     # in-game ui sorting hack based on ranks (trending)
-    def titlesorthack(self, mod: Mod):
+    def titlesorthack(self, mod: Mod | Listing):
         rank = "<size=0%>999999999</size>"
         if mod.rank is not None:
             rank = f'<size=0%>{mod.rank:09d}</size>'
@@ -0,0 +1,84 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+from pathlib import Path
+
+from modio_repo.metrics import metrics
+from modio_repo.utils import log
+
+DB_PATH = Path(os.getenv("DB_PATH", "db.sqlite3"))
+# the copy the build reads, replaced before every build
+SNAPSHOT_PATH = Path(os.getenv("BUILD_SNAPSHOT_PATH", "db.build.sqlite3"))
+
+
+# a consistent copy of the database at one point in time, through the sqlite
+# backup api, so it doesn't matter what the sync does to the database afterwards
+def snapshot_db(src: Path = DB_PATH, dst: Path = SNAPSHOT_PATH) -> Path:
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    with metrics.timer("db_snapshot"):
+        source = sqlite3.connect(src)
+        target = sqlite3.connect(tmp)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        os.replace(tmp, dst)
+    metrics.set("db_snapshot_bytes", dst.stat().st_size)
+    return dst
+
+
+def _build_process(db_path: str, sync_metrics: dict | None, env: dict[str, str], conn):
+    # before the imports, profiling reads its settings when it's imported
+    os.environ.update(env)
+    from tortoise import run_async
+
+    from modio_repo.__main__ import init_db
+    from modio_repo.build import build
+    from modio_repo.profiling import write_reports
+
+    async def main():
+        await init_db(f"sqlite://{db_path}")
+        with metrics.timer("build"):
+            await build()
+
+    run_async(main())
+    # the parent gets only what the build did, metrics.json has the whole cycle
+    conn.send(metrics.snapshot())
+    if sync_metrics is not None:
+        metrics.merge(sync_metrics)
+    metrics.write()
+    write_reports()
+
+
+# the build of one cycle, in its own process on a snapshot of the database.
+# the next sync can go on in the meantime. it gets the environment of this process
+# as it is now, --profile and --profiler included
+class BuildProcess:
+    def __init__(self, db_path: Path, sync_metrics: dict | None = None):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_build_process,
+            args=(str(db_path), sync_metrics, dict(os.environ), child),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    # metrics of the build, None if it failed
+    async def wait(self) -> dict | None:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(None, self.conn.recv)
+        except EOFError:
+            result = None
+        await loop.run_in_executor(None, self.process.join)
+        if result is None:
+            log(f"build process failed: {self.process.exitcode}")
+            metrics.inc("build_failures")
+        return result
@@ -1,15 +1,23 @@
+from __future__ import annotations
+
+import os
+import re
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from modio.client import Mod as ApiMod
+if TYPE_CHECKING:
+    from modio.client import Mod as ApiMod
 
 class PalletLoadError(Exception):
-    def __init__(self, message, pallet_id: int):
+    def __init__(self, message, pallet_id: int, kind: str = "unknown"):
         # Call the base class constructor with the parameters it needs
         super().__init__(message)
 
         # Now for your custom code...
         self.modio_file_id = pallet_id
+        # failure class, used to pick the retry backoff
+        self.kind = kind
 
 
 def get_api_mod_updated(api_mod: ApiMod) -> datetime:
@@ -18,5 +26,21 @@ def get_api_mod_updated(api_mod: ApiMod) -> datetime:
     return max(datetime.fromtimestamp(api_mod.file.date), api_mod.updated)
 
 
+# overridable to run against a mirror or the offline benchmark server
+def modio_api_url() -> str:
+    return os.getenv("MODIO_API_URL", "https://api.mod.io").rstrip("/")
+
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+# "256KB", "1.5GB" or plain bytes
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG]?B?)", size.strip().upper())
+    if match is None:
+        raise ValueError(f"invalid size {size!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
 def log(*msg):
     print(datetime.now().isoformat(), *msg)
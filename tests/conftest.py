@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from tortoise import Tortoise
+
+from modio_repo.__main__ import init_db
+from modio_repo.identity import identity
+from modio_repo.metrics import metrics
+from modio_repo.models import Listing, Mod
+
+
+# runs a coroutine function against a fresh database in the test's directory,
+# which is also the working directory, so ./static ends up there too
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    identity.clear()
+    metrics.reset()
+
+    def run(test):
+        async def main():
+            await init_db(f"sqlite://{tmp_path / 'db.sqlite3'}")
+            try:
+                return await test()
+            finally:
+                await Tortoise.close_connections()
+
+        return asyncio.run(main())
+
+    return run
+
+
+async def create_mod(mod_id: int, name: str = "", **fields) -> Mod:
+    now = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    defaults = {
+        "name": name or f"Mod {mod_id}",
+        "description": "",
+        "mod_updated": now,
+        "last_checked": now,
+        "malformed_pallet": False,
+        "nsfw": False,
+        "thumbnailUrl": "",
+        "rank": mod_id,
+        "downloads": 0,
+    }
+    return await Mod.create(id=mod_id, **{**defaults, **fields})
+
+
+# a listing that isn't saved, for code that only reads them
+def listing(mod_id: int, **fields) -> Listing:
+    defaults = {
+        "name": f"Mod {mod_id}",
+        "description": "",
+        "thumbnailUrl": "",
+        "rank": mod_id,
+        "downloads": 0,
+        "nsfw": False,
+        "malformed_pallet": False,
+        "barcode": f"Author.Mod{mod_id}",
+        "author": "Author",
+        "version": "1.0.0",
+        "sdkVersion": "0.2.0",
+        "manifest_file_id": mod_id * 10,
+        "pc_url": f"https://example/{mod_id * 10}.zip",
+    }
+    return Listing(mod_id=mod_id, **{**defaults, **fields})
@@ -0,0 +1,77 @@
+from datetime import datetime, timezone
+
+from conftest import create_mod
+
+from modio_repo import barcodes
+from modio_repo.downloader.pallets import insert_pallets
+from modio_repo.models import PcModFile, QuestModFile
+
+
+def pallet(barcode: str) -> dict:
+    return {
+        "zip_path": "pallet.json",
+        "fs_path": f"{barcode}.json",
+        "barcode": barcode,
+        "author": "Author",
+        "version": "1.0.0",
+        "sdkVersion": "0.2.0",
+        "crates": [{"barcode": f"{barcode}.Crate", "title": "Crate", "type": "Spawnable"}],
+    }
+
+
+async def add_file(file_type, file_id: int, mod_id: int, *barcodes_: str):
+    now = datetime.now(timezone.utc)
+    file = await file_type.create(id=file_id, added=now, url="", mod_id=mod_id)
+    await insert_pallets(file, [pallet(barcode) for barcode in barcodes_])
+    return file
+
+
+async def conflicting() -> dict[str, list[int]]:
+    await barcodes.update_conflicts()
+    return {c.barcode: c.mod_ids for c in await barcodes.conflicts()}
+
+
+def test_conflicts_across_mods(db):
+    async def test():
+        for mod_id in (1, 2, 3):
+            await create_mod(mod_id)
+        await add_file(PcModFile, 10, 1, "A.Shared", "A.Own")
+        # the same mod on both platforms is no conflict
+        await add_file(QuestModFile, 11, 1, "A.Shared")
+        assert await conflicting() == {}
+
+        await add_file(PcModFile, 20, 2, "A.Shared")
+        await add_file(PcModFile, 30, 3, "A.Shared")
+        assert await conflicting() == {"A.Shared": [1, 2, 3]}
+        assert [(r.mod_id, r.platform) for r in await barcodes.lookup("A.Shared")] == [
+            (1, "pc"),
+            (1, "quest"),
+            (2, "pc"),
+            (3, "pc"),
+        ]
+        assert sorted(await barcodes.barcodes_of(1)) == ["A.Own", "A.Shared"]
+        assert [c.mod_id for c in await barcodes.lookup_crate("A.Own.Crate")] == [1]
+
+        # a new file replaces what its mod had on that platform
+        await PcModFile.filter(id=20).delete()
+        await add_file(PcModFile, 21, 2, "B.Renamed")
+        assert await conflicting() == {"A.Shared": [1, 3]}
+
+        await barcodes.forget_mods([3])
+        assert await conflicting() == {}
+        assert [r.mod_id for r in await barcodes.lookup("A.Shared")] == [1, 1]
+
+    db(test)
+
+
+# an index rebuilt from the pallet tables finds the same conflicts
+def test_rebuild(db):
+    async def test():
+        for mod_id in (1, 2):
+            await create_mod(mod_id)
+            await add_file(PcModFile, mod_id * 10, mod_id, "A.Shared")
+        await barcodes.rebuild()
+        assert await barcodes.barcodes_of(2) == ["A.Shared"]
+        assert await conflicting() == {"A.Shared": [1, 2]}
+
+    db(test)
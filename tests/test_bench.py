@@ -0,0 +1,48 @@
+import multiprocessing
+
+import pytest
+
+from modio_repo.bench import synth
+from modio_repo.bench.runner import (
+    HOST,
+    free_port,
+    queries_per_mod,
+    run_phase,
+    wait_for_server,
+)
+from modio_repo.bench.server import serve
+
+# a sync of mods that didn't change reads each mod and updates its stats and listing,
+# about 9 queries per mod. the first sync inserts everything and needs over 30
+MAX_STEADY_QUERIES_PER_MOD = 12
+
+
+@pytest.fixture
+def bench_server(tmp_path, monkeypatch):
+    catalog = synth.generate(tmp_path / "cdn", mods=30, size=16 * 1024, seed=3)
+    ctx = multiprocessing.get_context("spawn")
+    port = free_port()
+    base = f"http://{HOST}:{port}"
+    server = ctx.Process(target=serve, args=(catalog, HOST, port, 0.0, 0.0), daemon=True)
+    server.start()
+    monkeypatch.setenv("MODIO_API_URL", base)
+    monkeypatch.setenv("MODIO_API_KEY", "bench")
+    monkeypatch.setenv("MODIO_API_SECRET", "bench")
+    monkeypatch.setenv("INGEST_WORKERS", "1")
+    monkeypatch.setenv("METRICS_DB_QUERIES", "1")
+    try:
+        wait_for_server(base)
+        yield ctx, base
+    finally:
+        server.terminate()
+        server.join()
+
+
+def test_steady_state_queries_per_mod(bench_server, tmp_path):
+    ctx, base = bench_server
+    cold = run_phase(ctx, "sync", tmp_path, base)
+    steady = run_phase(ctx, "sync", tmp_path, base)
+
+    assert steady["metrics"]["counters"]["mods_processed"] == 30
+    assert queries_per_mod(steady) <= MAX_STEADY_QUERIES_PER_MOD
+    assert queries_per_mod(steady) < queries_per_mod(cold) / 2
@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timedelta
+
+from conftest import listing
+
+from modio_repo.changes import ChangesFeed
+from modio_repo.models import Listing
+from modio_repo.slz_repositoryfile import RepositoryFile
+
+
+def build(tmp_path, listings: list[Listing]) -> tuple[int, dict]:
+    repofile = RepositoryFile(str(tmp_path / "repository.json"), "test", "")
+    repofile.listings = listings
+    feed = ChangesFeed(tmp_path / "changes.json", tmp_path / ".changes_state.json")
+    sequence = feed.update([repofile])
+    return sequence, json.loads((tmp_path / "changes.json").read_text())
+
+
+# the models need tortoise set up, so the tests run inside the db fixture
+def test_changes_between_builds(db, tmp_path):
+    async def test():
+        # the first build has nothing to compare with, consumers start from it
+        sequence, feed = build(tmp_path, [listing(1), listing(3), listing(4)])
+        assert (sequence, feed["base"], feed["builds"]) == (1, 1, [])
+
+        sequence, feed = build(
+            tmp_path,
+            [listing(1, description="new"), listing(2), listing(3, rank=1, downloads=9)],
+        )
+        assert (sequence, feed["base"]) == (2, 1)
+        (changes,) = feed["builds"]
+        assert changes["sequence"] == 2
+        assert [c["mod_id"] for c in changes["added"]] == [2]
+        # rank and downloads alone are no update
+        assert [c["mod_id"] for c in changes["updated"]] == [1]
+        assert changes["updated"][0]["entry"]["description"] == "new"
+        assert changes["removed"] == [
+            {"mod_id": 4, "barcode": "Author.Mod4", "repository": "repository.json"}
+        ]
+
+        sequence, feed = build(tmp_path, [listing(1, description="new"), listing(2)])
+        assert sequence == 3
+        # nothing changed, no new build
+        sequence, feed = build(tmp_path, [listing(1, description="new"), listing(2)])
+        assert sequence == 3 and len(feed["builds"]) == 2
+
+    db(test)
+
+
+# builds older than the retention are dropped and move the base up
+def test_retention(db, tmp_path):
+    async def test():
+        build(tmp_path, [listing(1)])
+        build(tmp_path, [listing(1), listing(2)])
+        feed = json.loads((tmp_path / "changes.json").read_text())
+        feed["builds"][0]["time"] = (datetime.utcnow() - timedelta(days=8)).isoformat()
+        (tmp_path / "changes.json").write_text(json.dumps(feed))
+
+        sequence, feed = build(tmp_path, [listing(2)])
+        assert sequence == 3
+        assert feed["base"] == 2
+        assert [b["sequence"] for b in feed["builds"]] == [3]
+
+    db(test)
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta, timezone
+
+from conftest import create_mod
+
+from modio_repo.downloader.failures import BACKOFF_MAX, FailureCache, backoff
+from modio_repo.downloader.missing_pallets import MissingPallets
+from modio_repo.models import PalletFailure, PcModFile, PcPalletError
+from modio_repo.utils import PalletLoadError
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert backoff("download", 1) == timedelta(minutes=30)
+    assert backoff("download", 2) == timedelta(hours=1)
+    assert backoff("download", 4) == timedelta(hours=4)
+    assert backoff("bad_zip", 1) == timedelta(hours=12)
+    assert backoff("something new", 1) == timedelta(hours=6)
+    assert backoff("download", 30) == BACKOFF_MAX
+
+
+def test_record_and_check(db):
+    async def test():
+        failures = FailureCache()
+        error = PalletLoadError("broken", 11, "download")
+        await failures.record(11, error, 1000)
+        await failures.record(11, error, 0)
+        failure = await PalletFailure.get(id=11)
+        assert failure.attempts == 2
+        # the second attempt waits twice as long, the size of the first is kept
+        assert failure.retry_after - failure.last_failed == timedelta(hours=1)
+        assert failure.size == 1000
+
+        assert await failures.check(11) is not None
+        assert (await PalletFailure.get(id=11)).bytes_saved == 1000
+
+        await PalletFailure.filter(id=11).update(retry_after=datetime.now(timezone.utc))
+        assert await failures.check(11) is None
+        assert await failures.clear(11)
+        assert not await failures.clear(11)
+
+    db(test)
+
+
+# files with an error row are only repaired once their backoff ran out
+def test_missing_pallets_include_expired_failures(db):
+    async def test():
+        now = datetime.now(timezone.utc)
+        failures = FailureCache()
+        for mod_id in (1, 2, 3):
+            mod = await create_mod(mod_id)
+            await PcModFile.create(id=mod_id * 10, added=now, url="", mod=mod)
+        # 10 never got a pallet nor an error, 20 and 30 failed
+        for file_id in (20, 30):
+            await PcPalletError.create(file_id=file_id, error="broken")
+            await failures.record(file_id, PalletLoadError("broken", file_id, "download"), 1)
+        await PalletFailure.filter(id=30).update(retry_after=now - timedelta(seconds=1))
+
+        missing = MissingPallets()
+        await missing.load()
+        return sorted(m.file_id for m in missing.queue)
+
+    assert db(test) == [10, 30]
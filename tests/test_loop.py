@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from modio_repo import __main__ as cli
+from modio_repo.metrics import metrics
+
+
+class Stop(Exception):
+    pass
+
+
+class FakeBuild:
+    started: list["FakeBuild"] = []
+
+    def __init__(self, db_path, sync_metrics):
+        self.waited = False
+        FakeBuild.started.append(self)
+
+    async def wait(self):
+        self.waited = True
+
+
+def test_timed_out_cycle_is_skipped(monkeypatch):
+    cycles = []
+
+    async def refresh():
+        cycles.append(len(cycles))
+        if len(cycles) == 1:
+            await asyncio.sleep(10)
+        elif len(cycles) == 3:
+            raise Stop
+
+    async def init_db():
+        pass
+
+    written = []
+    FakeBuild.started = []
+    monkeypatch.setattr(cli, "init_db", init_db)
+    monkeypatch.setattr(cli, "refresh", refresh)
+    monkeypatch.setattr(cli, "snapshot_db", lambda: "db.build.sqlite3")
+    monkeypatch.setattr(cli, "BuildProcess", FakeBuild)
+    monkeypatch.setattr(
+        metrics, "write", lambda: written.append(metrics.counters["cycle_timeouts"])
+    )
+
+    with pytest.raises(Stop):
+        asyncio.run(cli.loop(0, 0.05))
+
+    # the first cycle timed out and wasn't built, the second was, the third failed
+    assert cycles == [0, 1, 2]
+    assert written == [1]
+    assert len(FakeBuild.started) == 1
+    # the build of the second cycle finished before the loop ended
+    assert FakeBuild.started[0].waited
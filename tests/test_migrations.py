@@ -0,0 +1,101 @@
+import asyncio
+import sqlite3
+
+from tortoise import Tortoise
+
+from modio_repo.__main__ import init_db
+from modio_repo.migrations import MIGRATIONS
+from modio_repo.models import Listing, Mod, PalletCache, PcModFile
+
+# the schema of the first release, before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE "mod" (
+    "id" INT NOT NULL  PRIMARY KEY,
+    "name" TEXT NOT NULL,
+    "description" TEXT NOT NULL,
+    "mod_updated" TIMESTAMP NOT NULL,
+    "last_checked" TIMESTAMP NOT NULL,
+    "malformed_pallet" INT NOT NULL,
+    "nsfw" INT NOT NULL,
+    "thumbnailUrl" TEXT NOT NULL,
+    "rank" INT NOT NULL,
+    "downloads" INT NOT NULL
+);
+CREATE TABLE "pc_file" (
+    "id" INT NOT NULL  PRIMARY KEY,
+    "added" TIMESTAMP NOT NULL,
+    "url" TEXT NOT NULL,
+    "mod_id" INT NOT NULL UNIQUE REFERENCES "mod" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "pc_pallet" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "zip_path" TEXT NOT NULL,
+    "fs_path" TEXT NOT NULL,
+    "barcode" TEXT NOT NULL,
+    "author" TEXT NOT NULL,
+    "version" TEXT NOT NULL,
+    "sdkVersion" TEXT NOT NULL,
+    "file_id" INT NOT NULL REFERENCES "pc_file" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "pc_pallet_error" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "error" TEXT NOT NULL,
+    "file_id" INT NOT NULL UNIQUE REFERENCES "pc_file" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "quest_file" (
+    "id" INT NOT NULL  PRIMARY KEY,
+    "added" TIMESTAMP NOT NULL,
+    "url" TEXT NOT NULL,
+    "mod_id" INT NOT NULL UNIQUE REFERENCES "mod" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "quest_pallet" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "zip_path" TEXT NOT NULL,
+    "fs_path" TEXT NOT NULL,
+    "barcode" TEXT NOT NULL,
+    "author" TEXT NOT NULL,
+    "version" TEXT NOT NULL,
+    "sdkVersion" TEXT NOT NULL,
+    "file_id" INT NOT NULL REFERENCES "quest_file" ("id") ON DELETE CASCADE
+);
+CREATE TABLE "quest_pallet_error" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "error" TEXT NOT NULL,
+    "file_id" INT NOT NULL UNIQUE REFERENCES "quest_file" ("id") ON DELETE CASCADE
+);
+INSERT INTO "mod" VALUES (
+    1, 'Mod', '', '2022-01-01 00:00:00', '2022-01-01 00:00:00', 0, 0, '', 1, 10
+);
+INSERT INTO "pc_file" VALUES (11, '2022-01-01 00:00:00', 'https://example/11.zip', 1);
+INSERT INTO "pc_pallet" VALUES (
+    NULL, 'pallet.json', 'missing/11_0.json', 'Author.Mod', 'Author', '1.0.0', '0.2.0', 11
+);
+"""
+
+
+def test_upgrade_baseline_database(tmp_path):
+    path = tmp_path / "db.sqlite3"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    async def upgrade():
+        await init_db(f"sqlite://{path}")
+        try:
+            mod = await Mod.get(id=1)
+            listing = await Listing.get(mod_id=1)
+            file = await PcModFile.get(id=11)
+            cached = await PalletCache.filter(file_id=11).count()
+        finally:
+            await Tortoise.close_connections()
+        return mod, listing, file, cached
+
+    mod, listing, file, cached = asyncio.run(upgrade())
+    assert mod.tags == []
+    assert listing.barcode == "Author.Mod"
+    assert file.filehash is None and file.filesize is None
+    assert cached == 1
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+    conn.close()
@@ -0,0 +1,83 @@
+import io
+import json
+
+import pytest
+
+from modio_repo import pallet_json
+from modio_repo.bench.synth import pallet_json as synth_pallet
+
+MANIFEST = synth_pallet("Author.Mod", "Mod", "Author", 3)
+# top level scalars that get cut at every position by some of the chunk sizes
+MANIFEST.update(version=1, size=-35000000000.0, scale=2.5e-3, count=10)
+TEXT = json.dumps(MANIFEST, indent=2)
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 5, 6, 7, 10, 64, pallet_json.CHUNK])
+def test_scan_at_any_chunk_size(monkeypatch, chunk):
+    monkeypatch.setattr(pallet_json, "CHUNK", chunk)
+    manifest = pallet_json.scan(io.StringIO(TEXT))
+
+    assert manifest.types is not None and len(manifest.types) == len(MANIFEST["types"])
+    pallet = manifest.objects["o:1"]
+    assert (pallet["barcode"], pallet["isa"]) == ("Author.Mod", "t:1")
+    assert [c["barcode"] for c in pallet_json.crates(manifest)] == [
+        f"Author.Mod.Crate{i}" for i in range(3)
+    ]
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 5, 6, 10])
+def test_number_cut_by_chunk(monkeypatch, chunk):
+    monkeypatch.setattr(pallet_json, "CHUNK", chunk)
+    assert list(pallet_json.members(io.StringIO('{"a": 1, "root": -35000000000.0}'))) == []
+
+
+def test_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        pallet_json.scan(io.StringIO('{"types": {} x'))
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 4, 5, 7])
+def test_escapes_cut_by_chunk(monkeypatch, chunk):
+    monkeypatch.setattr(pallet_json, "CHUNK", chunk)
+    title = 'a "quoted" \\ title é'
+    text = json.dumps({"objects": {"o:1": {"barcode": "B", "title": title}}})
+    assert '\\"' in text and "\\\\" in text
+    manifest = pallet_json.scan(io.StringIO(text))
+    assert manifest.objects["o:1"]["title"] == title
+
+
+# the first chunk ends at every position around the start of a nested object
+@pytest.mark.parametrize("offset", range(-3, 4))
+def test_nested_object_at_chunk_boundary(offset):
+    def text(pad: int) -> str:
+        return json.dumps(
+            {
+                "pad": "x" * pad,
+                "objects": {"o:1": {"barcode": "B", "isa": {"type": "t:1"}}},
+                "types": {"t:1": {"fullname": "SLZ.Marrow.Warehouse.SpawnableCrate"}},
+            }
+        )
+
+    nested = text(0).index('{"type"')
+    manifest = pallet_json.scan(io.StringIO(text(pallet_json.CHUNK - nested + offset)))
+    assert manifest.objects["o:1"] == {"barcode": "B", "isa": "t:1"}
+    assert pallet_json.crates(manifest) == [
+        {"barcode": "B", "title": "", "type": "SpawnableCrate"}
+    ]
+
+
+# small files are decoded in one go, larger ones streamed, with the same result
+def test_read_small_and_large(tmp_path, monkeypatch):
+    path = tmp_path / "pallet.json"
+    path.write_text(TEXT)
+    small = pallet_json.read(path)
+    monkeypatch.setattr(pallet_json, "SMALL_FILE", 0)
+    assert pallet_json.read(path) == small
+    assert small.objects["o:1"]["barcode"] == "Author.Mod"
+
+    path.write_text("[]")
+    with pytest.raises(json.JSONDecodeError):
+        pallet_json.read(path)
+    monkeypatch.setattr(pallet_json, "SMALL_FILE", 1024)
+    with pytest.raises(json.JSONDecodeError):
+        pallet_json.read(path)
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from modio_repo.downloader.scheduler import Scheduler, Weights, parse_weights
+
+MB = 1024**2
+
+
+def drain(scheduler: Scheduler) -> list:
+    order = []
+    while (item := scheduler.pop()) is not None:
+        order.append(item)
+    return order
+
+
+def test_popular_small_and_stale_first():
+    scheduler: Scheduler[str] = Scheduler(lambda: 0, budget=0)
+    fresh = scheduler.now - timedelta(hours=1)
+    scheduler.push("unranked", 0, 0, fresh, MB)
+    scheduler.push("top", 1, 1000, fresh, MB)
+    scheduler.push("top but huge", 1, 1000, fresh, 2000 * MB)
+    scheduler.push("new", 500, 0, None, MB)
+    assert drain(scheduler) == ["top", "top but huge", "new", "unranked"]
+
+
+def test_equal_priority_keeps_insertion_order():
+    scheduler: Scheduler[int] = Scheduler(lambda: 0, budget=0)
+    checked = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    for i in range(5):
+        scheduler.push(i, 10, 10, checked, MB)
+    assert drain(scheduler) == [0, 1, 2, 3, 4]
+
+
+# what doesn't fit in the rest of the budget waits, smaller items may still go
+def test_byte_budget_defers():
+    spent = 0
+    scheduler: Scheduler[str] = Scheduler(lambda: spent, budget=10 * MB)
+    scheduler.push("a", 1, 0, None, 6 * MB)
+    scheduler.push("b", 2, 0, None, 6 * MB)
+    scheduler.push("c", 3, 0, None, 3 * MB)
+
+    assert scheduler.pop() == "a"
+    spent += 6 * MB
+    assert scheduler.pop() == "c"
+    spent += 3 * MB
+    assert scheduler.pop() is None
+    assert scheduler.deferred == ["b"]
+
+
+def test_parse_weights():
+    assert parse_weights("") == Weights()
+    assert parse_weights("rank=1, size=0") == Weights(rank=1, size=0)
+    with pytest.raises(ValueError):
+        parse_weights("popularity=1")
@@ -0,0 +1,37 @@
+from conftest import listing
+
+from modio_repo.search import SearchIndex, build_index, tokenize
+
+
+def test_tokenize():
+    assert tokenize("Pokémon  Guns & Ammo 2") == ["pokemon", "guns", "ammo", "2"]
+    assert tokenize("Author.SuperPallet") == ["author", "superpallet"]
+    assert tokenize("日本語") == []
+
+
+def test_search(db):
+    async def test():
+        return SearchIndex(
+            build_index(
+                [
+                    listing(2, name="Gun Pack", barcode="Someone.GunPack"),
+                    listing(1, name="Big Gun", author="Someone", barcode="Someone.BigGun"),
+                    listing(3, name="Avatar", quest_url="https://example/31.zip"),
+                ]
+            )
+        )
+
+    index = db(test)
+
+    def ids(query: str) -> list[int]:
+        return [mod[0] for mod in index.search(query)]
+
+    # results in rank order, camel case barcodes are split into words
+    assert ids("gun") == [1, 2]
+    assert ids("pack") == [2]
+    assert ids("someone big") == [1]
+    # only the last word is a prefix
+    assert ids("gu pack") == []
+    assert ids("av") == [3]
+    assert ids("...") == []
+    assert index.mods[2][4] == 3  # pc and quest
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from conftest import create_mod
+
+from modio_repo.downloader import ModSkip
+from modio_repo.downloader.mod_files import FileInfo, insert_files
+from modio_repo.downloader.sharded import ShardedRun, ShardWorker, load_snapshot
+from modio_repo.metrics import metrics
+from modio_repo.models import Mod, PalletFailure, PcPalletError
+
+INFO = FileInfo(
+    "pc", 11, datetime(2022, 1, 1), "https://example/11.zip", "0" * 32, 100
+)
+
+
+async def create_failed_file() -> Mod:
+    mod = await create_mod(1)
+    now = datetime.now(timezone.utc)
+    await PalletFailure.create(
+        id=11,
+        kind="bad_zip",
+        error="not a zip",
+        size=100,
+        last_failed=now,
+        retry_after=now + timedelta(hours=1),
+    )
+    return mod
+
+
+# a file in backoff is skipped by the worker and only counted by the writer, which
+# has no http session to download it with
+def test_skipped_file_is_counted_and_marked_malformed(db):
+    async def test():
+        mod = await create_failed_file()
+        worker = ShardWorker(0, 1, await load_snapshot(), None, False)
+        result = await worker.process_file(INFO)
+        assert (result.outcome, result.error, result.size) == ("skipped", "not a zip", 100)
+
+        # the backoff runs out before the writer gets to the result
+        await PalletFailure.filter(id=11).update(retry_after=datetime.now(timezone.utc))
+        await insert_files(mod, [INFO])
+        with pytest.raises(ModSkip):
+            await ShardedRun(None, 2).apply_file(mod, result)  # type: ignore
+        assert (await Mod.get(id=1)).malformed_pallet
+        assert (await PcPalletError.get(file_id=11)).error == "not a zip"
+        failure = await PalletFailure.get(id=11)
+        assert (failure.attempts, failure.skipped, failure.bytes_saved) == (1, 1, 100)
+
+    db(test)
+    assert metrics.counters["downloads_skipped_failed"] == 1
+    assert metrics.counters["download_bytes_saved"] == 100
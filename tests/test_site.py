@@ -0,0 +1,34 @@
+from modio_repo import site
+from modio_repo.site import Site
+
+
+def test_unchanged_pages_are_skipped(tmp_path, monkeypatch):
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "_base.html").write_text("<title>{% block title %}{% endblock %}</title>")
+    (templates / "index.html").write_text(
+        '{% extends "_base.html" %}{% block title %}{{ site_meta.name }}{% endblock %}'
+    )
+    (templates / "about.html").write_text("about")
+    monkeypatch.setattr(site, "SITE_STATE_PATH", tmp_path / "out" / ".site_state.json")
+
+    def render(meta: dict, force: bool = False, errors: tuple = ()) -> list[str]:
+        data = {"site_meta": meta, "errors": errors}
+        return Site(templates, tmp_path / "out").render(data, force)
+
+    assert render({"name": "a", "updated": 1}) == ["about.html", "index.html"]
+    assert (tmp_path / "out" / "index.html").read_text() == "<title>a</title>"
+    # the update time alone doesn't re-render
+    assert render({"name": "a", "updated": 2}) == []
+    assert render({"name": "b", "updated": 2}) == ["index.html"]
+    # nor does data only other pages use
+    assert render({"name": "b", "updated": 2}, errors=("broken",)) == []
+
+    # a partial changing re-renders the pages using it
+    (templates / "_base.html").write_text("<h1>{% block title %}{% endblock %}</h1>")
+    assert render({"name": "b", "updated": 3}) == ["index.html"]
+
+    # a missing output is rendered again, force renders everything
+    (tmp_path / "out" / "about.html").unlink()
+    assert render({"name": "b", "updated": 3}) == ["about.html"]
+    assert render({"name": "b", "updated": 3}, force=True) == ["about.html", "index.html"]
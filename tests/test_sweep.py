@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from conftest import create_mod
+
+from modio_repo.downloader import Run
+from modio_repo.downloader.pallets import insert_pallets
+from modio_repo.downloader.sweep import SWEEP_MIN_MODS, sweep_deleted
+from modio_repo.metrics import metrics
+from modio_repo.models import (
+    BarcodeIndex,
+    Mod,
+    PalletCache,
+    PalletFailure,
+    PcModFile,
+    PcPallet,
+    QuestModFile,
+)
+
+
+# a mod with a parsed pc file and a quest file in failure backoff
+async def create_full_mod(mod_id: int) -> Path:
+    now = datetime.now(timezone.utc)
+    mod = await create_mod(mod_id)
+    pc_file = await PcModFile.create(id=mod_id * 10, added=now, url="", mod=mod)
+    await QuestModFile.create(id=mod_id * 10 + 1, added=now, url="", mod=mod)
+    manifest = Path(f"static/pallets/{mod_id * 10}_0.json")
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text("{}")
+    pallet = {
+        "zip_path": "pallet.json",
+        "fs_path": str(manifest),
+        "barcode": f"Author.Mod{mod_id}",
+        "author": "Author",
+        "version": "1.0.0",
+        "sdkVersion": "0.2.0",
+        "crates": [],
+    }
+    await insert_pallets(pc_file, [pallet])
+    await PalletFailure.create(
+        id=mod_id * 10 + 1,
+        kind="download",
+        error="broken",
+        last_failed=now,
+        retry_after=now + timedelta(hours=1),
+    )
+    return manifest
+
+
+# a mod hidden on mod.io goes with its failures, cached pallets and manifests
+def test_delete_hidden_mod(db):
+    async def test():
+        manifest = await create_full_mod(1)
+        kept = await create_full_mod(2)
+        await Run(None).delete_mod_id(1)  # type: ignore
+
+        assert await Mod.all().values_list("id", flat=True) == [2]
+        assert await PcPallet.all().values_list("file_id", flat=True) == [20]
+        assert await PalletCache.all().values_list("file_id", flat=True) == [20]
+        assert await PalletFailure.all().values_list("id", flat=True) == [21]
+        assert await BarcodeIndex.all().values_list("mod_id", flat=True) == [2]
+        assert not manifest.exists()
+        assert kept.exists()
+
+    db(test)
+
+
+# more than SWEEP_MAX_FRACTION of a large catalog missing means a broken listing
+def test_sweep_aborts_above_the_fraction(db):
+    async def test():
+        manifest = await create_full_mod(1)
+        for mod_id in range(2, 26):
+            await create_mod(mod_id)
+
+        await sweep_deleted(set(range(4, 26)))
+        assert await Mod.all().count() == 25
+        assert metrics.counters["sweep_aborted"] == 1
+
+        await sweep_deleted(set(range(3, 26)))
+        assert sorted(await Mod.all().values_list("id", flat=True)) == list(range(3, 26))
+        assert await PalletCache.all().count() == 0
+        assert await PalletFailure.all().count() == 0
+        assert not manifest.exists()
+        assert metrics.counters["mods_deleted"] == 2
+
+    db(test)
+
+
+def test_small_catalog_is_swept_whole(db):
+    async def test():
+        for mod_id in range(1, SWEEP_MIN_MODS + 1):
+            await create_mod(mod_id)
+        await sweep_deleted(set())
+        assert await Mod.all().count() == 0
+
+    db(test)
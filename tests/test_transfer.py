@@ -0,0 +1,94 @@
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from modio_repo.downloader.transfer import Transfer
+from modio_repo.metrics import metrics
+from modio_repo.utils import PalletLoadError
+
+BODY = b"0123456789" * 10
+MD5 = hashlib.md5(BODY).hexdigest()
+
+
+# what Transfer.start looks at on an aiohttp response
+def response(status: int, content_length: int | None):
+    return SimpleNamespace(status=status, content_length=content_length)
+
+
+def read(transfer: Transfer, status: int, body: bytes, length: int):
+    transfer.start(response(status, length))
+    transfer.write(body)
+    transfer.ended = True
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.reset()
+
+
+# a transfer cut short continues from where it stopped
+def test_resume():
+    transfer = Transfer(1, len(BODY), MD5)
+    transfer.start(response(200, len(BODY)))
+    transfer.write(BODY[:30])
+    assert not transfer.complete
+    assert transfer.resume_headers() == {"Range": "bytes=30-"}
+
+    read(transfer, 206, BODY[30:], 70)
+    assert transfer.finish().getvalue() == BODY
+    assert transfer.verified == MD5
+    assert transfer.transferred == len(BODY)
+    assert metrics.counters["downloads_verified"] == 1
+
+
+# a server ignoring the range sends the whole file again
+def test_range_ignored_restarts():
+    transfer = Transfer(1, len(BODY), MD5)
+    transfer.start(response(200, len(BODY)))
+    transfer.write(BODY[:30])
+
+    read(transfer, 200, BODY, 100)
+    assert transfer.finish().getvalue() == BODY
+    assert transfer.transferred == len(BODY) + 30
+    assert metrics.counters["download_restarts"] == 1
+
+
+def test_checksum_mismatch():
+    transfer = Transfer(1, len(BODY), MD5)
+    read(transfer, 200, BODY[:-1] + b"x", 100)
+    with pytest.raises(PalletLoadError) as e:
+        transfer.finish()
+    assert e.value.kind == "checksum"
+    assert transfer.verified is None
+    assert metrics.counters["download_checksum_mismatches"] == 1
+
+
+def test_size_mismatch():
+    # known from the headers, before reading anything
+    with pytest.raises(PalletLoadError) as e:
+        read(Transfer(1, len(BODY), MD5), 200, BODY, 101)
+    assert e.value.kind == "size"
+    # or while reading, without a content length
+    transfer = Transfer(1, len(BODY), MD5)
+    transfer.start(response(200, None))
+    transfer.write(BODY)
+    with pytest.raises(PalletLoadError) as e:
+        transfer.write(b"x")
+    assert e.value.kind == "size"
+
+    # ending short is a failed download
+    transfer = Transfer(1, len(BODY), MD5)
+    read(transfer, 200, BODY[:50], 100)
+    with pytest.raises(PalletLoadError) as e:
+        transfer.finish()
+    assert e.value.kind == "download"
+
+
+# files stored before the size and hash were have nothing to check against
+def test_unknown_size_and_hash():
+    transfer = Transfer(1, None, "")
+    read(transfer, 200, BODY, 100)
+    assert transfer.finish().getvalue() == BODY
+    assert transfer.verified is None
+    assert "downloads_verified" not in metrics.counters